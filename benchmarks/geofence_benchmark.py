@@ -0,0 +1,229 @@
+# Benchmarks geofence_monitor.poll end to end against an in-process stand-in for the car status
+# server, across fleet sizes, fences per car, vertices per fence, and shares of out-of-bounds cars.
+# Each configuration runs in a fresh interpreter so that its peak memory can be measured separately,
+# and reports throughput, time per stage (fetch, JSON decode, geometry, and alerting) and memory.
+#
+#   python benchmarks/geofence_benchmark.py --fleet_sizes=10,1000,100000 --output=geofence.json
+import argparse
+import BaseHTTPServer
+import itertools
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+CENTER = (-122.42, 37.77)
+FENCE_RADIUS_DEG = 0.05
+STAGES = ('fetch', 'decode', 'geometry', 'alert')
+
+
+def make_fences_json(fences, vertices):
+  # Concentric regular polygons around CENTER. Cars at CENTER are inside all of them, and cars
+  # offset by a degree are outside all of them.
+  features = []
+  for i in xrange(fences):
+    radius = FENCE_RADIUS_DEG * (i + 1)
+    ring = [[CENTER[0] + radius * math.cos(2 * math.pi * j / vertices),
+             CENTER[1] + radius * math.sin(2 * math.pi * j / vertices)] for j in xrange(vertices)]
+    features.append({
+      'type': 'Feature',
+      'properties': {},
+      'geometry': {'type': 'Polygon', 'coordinates': [ring + ring[:1]]},
+    })
+  return ', '.join(json.dumps(feature) for feature in features)
+
+
+class StatusServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, fences, vertices, out_of_bounds_share):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StatusRequestHandler)
+    # Only the car's own feature differs between responses, so the fences are serialized once.
+    self.fences_json = make_fences_json(fences, vertices)
+    self.out_of_bounds_share = out_of_bounds_share
+
+
+class StatusRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    car_id = int(self.path.rsplit('/', 1)[-1])
+    # Spread out-of-bounds cars evenly through the fleet.
+    is_out_of_bounds = (int((car_id + 1) * self.server.out_of_bounds_share) >
+                        int(car_id * self.server.out_of_bounds_share))
+    coords = [CENTER[0] + (1 if is_out_of_bounds else 0), CENTER[1]]
+    body = ('{"type": "FeatureCollection", "features": [{"type": "Feature", "properties": '
+            '{"id": %s}, "geometry": {"type": "Point", "coordinates": %s}}, %s]}' % (
+                car_id, json.dumps(coords), self.server.fences_json))
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def timed(stage_times_s, stage, fn):
+  def timed_fn(*args, **kwargs):
+    start_time = time.time()
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      stage_times_s[stage] += time.time() - start_time
+  return timed_fn
+
+
+def run(config):
+  import geofence_monitor
+  import mock
+  import mocks
+  import monitor
+  import requests
+  import shapely.geometry
+  import shapely.geometry.base
+  import tracks
+
+  status_server = StatusServer(config['fences'], config['vertices'], config['out_of_bounds_share'])
+  threading.Thread(target=status_server.serve_forever).start()
+  work_dir = tempfile.mkdtemp()
+  try:
+    monitor.server.config['TESTING'] = True
+    # Keep the first poll from running on its own timer; it's run directly below.
+    with mock.patch('threading.Timer', mocks.MockTimer):
+      geofence_monitor.start([
+        '0-%s' % (config['fleet_size'] - 1),
+        'http://localhost:5000',
+        '--car_status_url=http://127.0.0.1:%s/carStatus/%%s' % status_server.server_address[1],
+        '--max_query_qps=1000000000',
+        '--log_file_prefix=%s' % os.path.join(work_dir, 'benchmark'),
+        '--outbox_file=%s' % os.path.join(work_dir, 'benchmark.outbox'),
+        '--state_file=%s' % os.path.join(work_dir, 'benchmark.state'),
+        '--track_dir=%s' % os.path.join(work_dir, 'benchmark.tracks'),
+      ])
+    start_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    stage_times_s = dict.fromkeys(STAGES, 0.0)
+    contains = shapely.geometry.base.BaseGeometry.contains.im_func
+    with mock.patch('requests.get', timed(stage_times_s, 'fetch', requests.get)), \
+         mock.patch('requests.models.Response.json',
+                    timed(stage_times_s, 'decode', requests.models.Response.json.im_func)), \
+         mock.patch('shapely.geometry.shape',
+                    timed(stage_times_s, 'geometry', shapely.geometry.shape)), \
+         mock.patch.object(shapely.geometry.base.BaseGeometry, 'contains',
+                           timed(stage_times_s, 'geometry', contains)), \
+         mock.patch('monitor.alert', timed(stage_times_s, 'alert', monitor.alert)), \
+         mock.patch('requests.post'):
+      start_time = time.time()
+      geofence_monitor.poll()
+      total_time_s = time.time() - start_time
+    # Wait for the background log writer so that its memory is counted too.
+    for handler in monitor.logger.handlers:
+      handler.flush()
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  finally:
+    status_server.shutdown()
+    tracks.close()
+    monitor.reset()
+    shutil.rmtree(work_dir)
+
+  return dict(config,
+              total_time_s=total_time_s,
+              cars_per_s=config['fleet_size'] / total_time_s,
+              stage_times_s=stage_times_s,
+              other_time_s=total_time_s - sum(stage_times_s.itervalues()),
+              peak_rss_mb=peak_rss_kb / 1024.0,
+              poll_rss_growth_mb=(peak_rss_kb - start_rss_kb) / 1024.0)
+
+
+def run_in_subprocess(config):
+  with open(os.devnull, 'w') as devnull:
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--run=%s' % json.dumps(config)],
+        cwd=ROOT_DIR, stderr=devnull)
+  return json.loads(output.strip().split('\n')[-1])
+
+
+def config_key(result):
+  return (result['fleet_size'], result['fences'], result['vertices'],
+          result['out_of_bounds_share'])
+
+
+def parse_list(parse_item):
+  return lambda arg: [parse_item(item) for item in arg.split(',')]
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks the geofence polling pipeline.')
+  parser.add_argument('--fleet_sizes', type=parse_list(int), default=[10, 100, 1000],
+                      help='Comma-separated numbers of cars to poll')
+  parser.add_argument('--fences', type=parse_list(int), default=[1, 5],
+                      help='Comma-separated numbers of fences per car')
+  parser.add_argument('--vertices', type=parse_list(int), default=[8, 128],
+                      help='Comma-separated numbers of vertices per fence')
+  parser.add_argument('--out_of_bounds_shares', type=parse_list(float), default=[0.0, 0.1],
+                      help='Comma-separated shares of cars that are out of bounds')
+  parser.add_argument('--output', help='A file to which to write the results as JSON')
+  parser.add_argument('--baseline',
+                      help='A results file from an earlier --output against which to compare')
+  parser.add_argument('--run', help=argparse.SUPPRESS)
+  benchmark_args = parser.parse_args()
+
+  if benchmark_args.run:
+    # Keep the monitor's own log output out of the result, which is the last line.
+    sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+    result = run(json.loads(benchmark_args.run))
+    stdout.write(json.dumps(result) + '\n')
+    return
+
+  baseline_cars_per_s = {}
+  if benchmark_args.baseline:
+    with open(benchmark_args.baseline, 'r') as f:
+      for result in json.load(f)['results']:
+        baseline_cars_per_s[config_key(result)] = result['cars_per_s']
+
+  results = []
+  print('%8s %6s %8s %6s %10s %9s %9s %9s %9s %9s %9s %9s' % (
+      'cars', 'fences', 'vertices', 'oob', 'cars/s', 'vs_base', 'fetch_s', 'decode_s', 'geom_s',
+      'alert_s', 'other_s', 'peak_mb'))
+  for fleet_size, fences, vertices, out_of_bounds_share in itertools.product(
+      benchmark_args.fleet_sizes, benchmark_args.fences, benchmark_args.vertices,
+      benchmark_args.out_of_bounds_shares):
+    result = run_in_subprocess({
+      'fleet_size': fleet_size,
+      'fences': fences,
+      'vertices': vertices,
+      'out_of_bounds_share': out_of_bounds_share,
+    })
+    results.append(result)
+    stage_times_s = result['stage_times_s']
+    baseline = baseline_cars_per_s.get(config_key(result))
+    print('%8d %6d %8d %6.2f %10.1f %9s %9.3f %9.3f %9.3f %9.3f %9.3f %9.1f' % (
+        fleet_size, fences, vertices, out_of_bounds_share, result['cars_per_s'],
+        '%+.1f%%' % (100.0 * result['cars_per_s'] / baseline - 100) if baseline else '-',
+        stage_times_s['fetch'], stage_times_s['decode'], stage_times_s['geometry'],
+        stage_times_s['alert'], result['other_time_s'], result['peak_rss_mb']))
+
+  if benchmark_args.output:
+    with open(benchmark_args.output, 'w') as f:
+      json.dump({
+        'time': time.time(),
+        'python': platform.python_version(),
+        'results': results,
+      }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,73 @@
+# Measures how long the polling thread spends inside logging calls, with the log handlers attached
+# directly to the logger versus behind log_queue.QueueHandler, for both text and JSONL logs.
+#
+#   python benchmarks/logging_benchmark.py --records=5000 --fetch_s=0.001
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log_queue
+import monitor
+
+
+def run(log_format, queued, records, fetch_s, log_dir):
+  monitor.args = argparse.Namespace(log_level=logging.INFO,
+                                    log_file_prefix=os.path.join(log_dir, 'benchmark'),
+                                    log_format=log_format)
+  handlers = monitor.create_log_handlers()
+  # Keep stdout out of the measurement so that terminal speed doesn't dominate.
+  handlers[0].stream = open(os.devnull, 'w')
+  logger = logging.getLogger('benchmark.%s' % ('queued' if queued else 'direct'))
+  logger.propagate = False
+  logger.setLevel(logging.INFO)
+  logger.handlers = [log_queue.QueueHandler(handlers)] if queued else handlers
+
+  start_time = time.time()
+  logging_time_s = 0.0
+  for i in xrange(records):
+    # Stands in for the time a poll spends waiting on a car status request.
+    time.sleep(fetch_s)
+
+    # Mirrors geofence_monitor's mix of per-car info and error logs.
+    log_start_time = time.time()
+    if i % 10:
+      logger.info('Car %s was found outside of its geofences.', i)
+    else:
+      logger.error('Received %s HTTP code for car %s with response: "%s"', 500, i, 'error')
+    logging_time_s += time.time() - log_start_time
+
+  for handler in logger.handlers:
+    handler.flush()
+  total_time_s = time.time() - start_time
+  for handler in logger.handlers:
+    handler.close()
+  return logging_time_s, total_time_s
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks poll-thread time spent logging.')
+  parser.add_argument('--records', type=int, default=5000, help='The number of records to log')
+  parser.add_argument('--fetch_s', type=float, default=0.001,
+                      help='The simulated time (in seconds) spent fetching between records')
+  benchmark_args = parser.parse_args()
+
+  for log_format in ('text', 'jsonl'):
+    for queued in (False, True):
+      log_dir = tempfile.mkdtemp()
+      try:
+        logging_time_s, total_time_s = run(
+            log_format, queued, benchmark_args.records, benchmark_args.fetch_s, log_dir)
+      finally:
+        shutil.rmtree(log_dir)
+      print('%-5s %-7s poll thread time logging: %.3fs (%.1fus/record), total: %.3fs' % (
+          log_format, 'queued' if queued else 'direct', logging_time_s,
+          logging_time_s / benchmark_args.records * 1e6, total_time_s))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,76 @@
+# Measures the startup latency of each monitor entry point: how long importing the module takes, how
+# long `--help` takes end to end, and which of the heavy dependencies were loaded at import time.
+# Each measurement runs in a fresh interpreter so that nothing is already cached in sys.modules.
+#
+#   python benchmarks/startup_benchmark.py --runs=10 --output=startup.json
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ('monitor', 'geofence_monitor', 'ok_monitor')
+HEAVY_MODULES = ('flask', 'requests', 'shapely')
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start_time = time.time()
+import %s
+import_time_s = time.time() - start_time
+print(json.dumps({
+  'import_time_s': import_time_s,
+  'loaded': [module for module in %r if module in sys.modules],
+}))
+'''
+
+
+def measure_import(entry_point):
+  output = subprocess.check_output(
+      [sys.executable, '-c', IMPORT_SCRIPT % (entry_point, HEAVY_MODULES)], cwd=ROOT_DIR)
+  return json.loads(output.strip().split('\n')[-1])
+
+
+def measure_help(entry_point):
+  start_time = time.time()
+  with open(os.devnull, 'w') as devnull:
+    subprocess.check_call([sys.executable, '%s.py' % entry_point, '--help'], cwd=ROOT_DIR,
+                          stdout=devnull)
+  return time.time() - start_time
+
+
+def median(values):
+  values = sorted(values)
+  return values[len(values) // 2]
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks monitor entry point startup latency.')
+  parser.add_argument('--runs', type=int, default=10,
+                      help='The number of fresh interpreters to time per entry point')
+  parser.add_argument('--output', help='A file to which to append the results as a JSON line')
+  benchmark_args = parser.parse_args()
+
+  results = {'time': time.time(), 'entry_points': {}}
+  for entry_point in ENTRY_POINTS:
+    imports = [measure_import(entry_point) for i in xrange(benchmark_args.runs)]
+    help_times_s = ([measure_help(entry_point) for i in xrange(benchmark_args.runs)]
+                    if entry_point != 'monitor' else [])
+    result = results['entry_points'][entry_point] = {
+      'import_time_s': median([run['import_time_s'] for run in imports]),
+      'help_time_s': median(help_times_s) if help_times_s else None,
+      'loaded_at_import': imports[-1]['loaded'],
+    }
+    print('%-16s import: %6.1fms, --help: %s, loaded at import: %s' % (
+        entry_point, result['import_time_s'] * 1e3,
+        '%6.1fms' % (result['help_time_s'] * 1e3) if help_times_s else '   n/a  ',
+        ', '.join(result['loaded_at_import']) or 'none'))
+
+  if benchmark_args.output:
+    with open(benchmark_args.output, 'a') as f:
+      f.write(json.dumps(results, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,89 @@
+import gzip
+import json
+import log_index
+import logging
+import os
+import re
+import shutil
+import threading
+import traceback
+
+# Typed fields that may be attached to records with logger.log(..., extra={...}).
+EVENT_FIELDS = ('car_id', 'error', 'status_code', 'latency_s', 'poll_id')
+
+
+class JsonFormatter(logging.Formatter):
+  def format(self, record):
+    event = {
+      'time': record.created,
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+    }
+    for field in EVENT_FIELDS:
+      value = getattr(record, field, None)
+      if value is not None:
+        event[field] = value
+    if record.exc_info:
+      event['traceback'] = ''.join(traceback.format_exception(*record.exc_info))
+    return json.dumps(event, sort_keys=True)
+
+
+# Writes each event once as a JSON line, with level-filtered views left to readers, and
+# gzip-compresses rotated files in the background.
+class EventLogHandler(log_index.IndexedFileHandler):
+  def __init__(self, filename, **kwargs):
+    log_index.IndexedFileHandler.__init__(self, filename, **kwargs)
+    self.setFormatter(JsonFormatter())
+    self.compressor = None
+
+  def parse_entry(self, line):
+    return parse_event_entry(line)
+
+  def doRollover(self):
+    rotated_path = self.rotated_path()
+    log_index.IndexedFileHandler.doRollover(self)
+    if os.path.exists(rotated_path):
+      self.compressor = threading.Thread(target=compress, args=(rotated_path,),
+                                         name='log-compressor')
+      self.compressor.daemon = True
+      self.compressor.start()
+
+  def getFilesToDelete(self):
+    # TimedRotatingFileHandler only recognizes uncompressed backups, so include compressed ones.
+    prefix = '%s.' % os.path.basename(self.baseFilename)
+    backups = sorted(file_name for file_name in os.listdir(os.path.dirname(self.baseFilename))
+                     if file_name.startswith(prefix) and
+                     self.extMatch.match(re.sub(r'\.gz$', '', file_name[len(prefix):])))
+    if len(backups) <= self.backupCount:
+      return []
+    return [os.path.join(os.path.dirname(self.baseFilename), file_name)
+            for file_name in backups[:len(backups) - self.backupCount]]
+
+
+def parse_event_entry(line):
+  try:
+    event = json.loads(line)
+  except ValueError:
+    return None
+  car_id = event.get('car_id')
+  return (event['time'], logging.getLevelName(event['level']),
+          (car_id,) if car_id is not None else ())
+
+
+def compress(path):
+  compressed_path = '%s.gz' % path
+  with open(path, 'rb') as f, gzip.open('%s.tmp' % compressed_path, 'wb') as compressed_f:
+    shutil.copyfileobj(f, compressed_f)
+  os.rename('%s.tmp' % compressed_path, compressed_path)
+  # Offsets are into the uncompressed data, so the index still applies once compressed.
+  if os.path.exists('%s.idx' % path):
+    os.rename('%s.idx' % path, '%s.idx' % compressed_path)
+  os.remove(path)
+
+
+def filter_events(line, min_level):
+  try:
+    return logging.getLevelName(json.loads(line)['level']) >= min_level
+  except (ValueError, KeyError):
+    return False
@@ -0,0 +1,100 @@
+import event_log
+import gzip
+import json
+import log_index
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+
+
+class EventLogTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'test.events.jsonl')
+    self.logger = logging.getLogger('event_log_test')
+    self.logger.propagate = False
+    self.logger.setLevel(logging.INFO)
+    self.handler = event_log.EventLogHandler(self.path, when='d', interval=1, backupCount=2)
+    self.logger.handlers = [self.handler]
+
+  def tearDown(self):
+    self.handler.close()
+    self.logger.handlers = []
+    log_index.index_cache.clear()
+    shutil.rmtree(self.dir)
+
+  def read_events(self, path=None):
+    self.handler.flush()
+    with log_index.open_log(path or self.path) as f:
+      return [json.loads(line) for line in f]
+
+  def test_events_have_typed_fields(self):
+    self.logger.error('Received %s HTTP code for car %s', 404, 7,
+                      extra={'car_id': 7, 'error': 'INVALID_FETCH_RESPONSE', 'status_code': 404,
+                             'latency_s': 0.25, 'poll_id': 3})
+
+    event, = self.read_events()
+    self.assertEqual(event['level'], 'ERROR')
+    self.assertEqual(event['logger'], 'event_log_test')
+    self.assertEqual(event['message'], 'Received 404 HTTP code for car 7')
+    self.assertEqual(event['car_id'], 7)
+    self.assertEqual(event['error'], 'INVALID_FETCH_RESPONSE')
+    self.assertEqual(event['status_code'], 404)
+    self.assertEqual(event['latency_s'], 0.25)
+    self.assertEqual(event['poll_id'], 3)
+    self.assertIsInstance(event['time'], float)
+
+  def test_events_include_tracebacks(self):
+    try:
+      raise ValueError('bad car')
+    except ValueError:
+      self.logger.exception('Unhandled exception.')
+
+    event, = self.read_events()
+    self.assertTrue(event['traceback'].startswith('Traceback (most recent call last):'))
+    self.assertTrue(event['traceback'].endswith('ValueError: bad car\n'))
+
+  def test_filter_events(self):
+    self.assertTrue(event_log.filter_events('{"level": "ERROR"}', logging.WARNING))
+    self.assertFalse(event_log.filter_events('{"level": "INFO"}', logging.WARNING))
+    self.assertFalse(event_log.filter_events('not json', logging.INFO))
+
+  def test_rollover_compresses_and_stays_searchable(self):
+    self.logger.info('Car 1 was found outside of its geofences.', extra={'car_id': 1})
+    rotated_path = self.handler.rotated_path()
+    self.handler.doRollover()
+    self.handler.compressor.join()
+    self.logger.info('Car 2 was found outside of its geofences.', extra={'car_id': 2})
+
+    self.assertFalse(os.path.exists(rotated_path))
+    self.assertFalse(os.path.exists('%s.idx' % rotated_path))
+    self.assertTrue(os.path.exists('%s.gz.idx' % rotated_path))
+    self.assertEqual([event['car_id'] for event in self.read_events('%s.gz' % rotated_path)], [1])
+
+    results = [json.loads(record)['message'] for path, record in self.handler.search(car_id=1)]
+    self.assertEqual(results, ['Car 1 was found outside of its geofences.'])
+
+  def test_compressed_backups_are_deleted(self):
+    for day in ('2016-01-01', '2016-01-02', '2016-01-03'):
+      with gzip.open('%s.%s.gz' % (self.path, day), 'wb') as f:
+        f.write('{}\n')
+
+    self.assertEqual(self.handler.getFilesToDelete(), ['%s.2016-01-01.gz' % self.path])
+
+  def test_unindexed_compressed_backups_are_scanned(self):
+    rotated_path = '%s.2016-01-01.gz' % self.path
+    with gzip.open(rotated_path, 'wb') as f:
+      f.write('{"time": 1.0, "level": "INFO", "message": "Polling..."}\n'
+              '{"time": 2.0, "level": "ERROR", "message": "Timed out.", "car_id": 5}\n')
+
+    results = [json.loads(record)['message'] for path, record in self.handler.search(car_id=5)]
+    self.assertEqual(results, ['Timed out.'])
+    self.assertEqual(log_index.read_index('%s.idx' % rotated_path),
+                     [(1.0, logging.INFO, 0, ()), (2.0, logging.ERROR, 56, (5,))])
+
+
+if __name__ == '__main__':
+  unittest.main()
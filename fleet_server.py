@@ -0,0 +1,219 @@
+# Serves /carStatus/<id> GeoJSON for a synthetic fleet, as a local stand-in for the car status server
+# that geofence_monitor can be pointed at with --car_status_url for load tests and offline runs.
+#
+#   python fleet_server.py --port=5001 --cars=10000 --motion=wander --rate_limit_qps=2000
+import argparse
+import collections
+import json
+import logging
+import math
+import metrics
+import random
+import sys
+import threading
+import time
+import wsgi_server
+
+METERS_PER_DEGREE = 111320.0
+ORIGIN = (-122.42, 37.77)
+# Homes are laid out on a grid with room for each car's fences between them.
+HOMES_PER_ROW = 100
+FENCE_CACHE_SIZE = 10000
+GOLDEN_RATIO = (1 + 5 ** 0.5) / 2
+
+args, start_time = None, 0.0
+rate_limit_tokens, rate_limit_time = 0.0, 0.0
+fence_cache = collections.OrderedDict()
+lock = threading.Lock()
+
+logger = logging.getLogger('fleet_server')
+
+responses_total = metrics.Counter(
+    'fleet_server_responses_total', 'Car status responses by HTTP code.', ['code'])
+
+
+def parse_args(raw_args=sys.argv[1:]):
+  global args, start_time, rate_limit_tokens, rate_limit_time
+  parser = argparse.ArgumentParser(
+      description='Serves car statuses for a synthetic fleet, in the format of the car status '
+                  'server.')
+  parser.add_argument('--port', type=int, default=5001, help='The port on which to serve')
+  parser.add_argument('--workers', type=int, default=256,
+                      help='The maximum number of requests to handle at once')
+  parser.add_argument('--cars', type=int, default=1000,
+                      help='The number of cars in the fleet, with IDs from 0')
+  parser.add_argument('--motion', choices=('parked', 'orbit', 'wander'), default='wander',
+                      help='How cars move: "parked" cars stay put, "orbit" cars circle their home '
+                           'and "wander" cars drive out from their home and back')
+  parser.add_argument('--speed_mps', type=float, default=10.0,
+                      help='The speed (in meters per second) of moving cars')
+  parser.add_argument('--out_of_bounds_share', type=float, default=0.01,
+                      help='The share of cars that leave their first geofence: parked and orbiting '
+                           'cars stay outside it, while wandering cars cross it periodically')
+  parser.add_argument('--fences', type=int, default=1, help='The number of geofences per car')
+  parser.add_argument('--vertices', type=int, default=8, help='The number of vertices per geofence')
+  parser.add_argument('--fence_radius_m', type=float, default=2000.0,
+                      help='The radius (in meters) of each geofence')
+  parser.add_argument('--latency_median_s', type=float, default=0.0,
+                      help='The median latency (in seconds) to add to each response')
+  parser.add_argument('--latency_sigma', type=float, default=0.5,
+                      help='The log-normal shape of the added latencies')
+  parser.add_argument('--error_rate', type=float, default=0.0,
+                      help='The share of requests that fail with a 500')
+  parser.add_argument('--rate_limit_qps', type=float, default=0.0,
+                      help='The QPS above which requests are rejected with a 429, or 0 for no limit')
+  parser.add_argument('--rate_limit_burst', type=float,
+                      help='The number of requests that may exceed --rate_limit_qps in a burst. '
+                           'Defaults to a second of requests.')
+  parser.add_argument('--seed', type=int, default=0,
+                      help='Rotates the headings of every car\'s route')
+  args = parser.parse_args(raw_args)
+  if args.rate_limit_burst is None:
+    args.rate_limit_burst = args.rate_limit_qps
+  start_time = time.time()
+  rate_limit_tokens, rate_limit_time = args.rate_limit_burst, start_time
+
+
+def start(raw_args=sys.argv[1:]):
+  parse_args(raw_args)
+  logging.basicConfig(level=logging.INFO)
+  http_server = wsgi_server.make_server('threaded', '127.0.0.1', args.port, app, args.workers)
+  logger.info('Serving %s cars on port %s.', args.cars, args.port)
+  http_server.serve_forever()
+
+
+def reset():
+  global args, start_time, rate_limit_tokens, rate_limit_time
+  fence_cache.clear()
+  metrics.reset()
+  args, start_time, rate_limit_tokens, rate_limit_time = None, 0.0, 0.0, 0.0
+
+
+def home(car_id):
+  return (ORIGIN[0] + car_id % HOMES_PER_ROW * spacing_deg(),
+          ORIGIN[1] + car_id / HOMES_PER_ROW * spacing_deg())
+
+
+def spacing_deg():
+  return 3 * args.fences * args.fence_radius_m / METERS_PER_DEGREE
+
+
+def offset(coords, east_m, north_m):
+  return [coords[0] + east_m / (METERS_PER_DEGREE * math.cos(math.radians(coords[1]))),
+          coords[1] + north_m / METERS_PER_DEGREE]
+
+
+def position(car_id, now):
+  # Derived from the car's ID and the time alone, so that no per-car state is kept. Spreading
+  # headings and roaming cars by the golden ratio keeps both even across any range of IDs.
+  heading = 2 * math.pi * ((car_id + args.seed) * GOLDEN_RATIO % 1)
+  is_roaming = (car_id + 1) * GOLDEN_RATIO % 1 < args.out_of_bounds_share
+  # Roaming cars reach half again as far from home as the fence, and the rest stay well inside it.
+  radius_m = args.fence_radius_m * (1.5 if is_roaming else 0.5)
+  elapsed_s = now - start_time
+  if args.motion == 'parked':
+    distance_m = radius_m
+  elif args.motion == 'orbit':
+    distance_m = radius_m
+    heading += args.speed_mps * elapsed_s / radius_m
+  else:
+    # Out along the heading and back again, turning a little each trip.
+    trip_s = 2 * radius_m / args.speed_mps
+    trips, trip_offset_s = divmod(elapsed_s + heading / (2 * math.pi) * trip_s, trip_s)
+    distance_m = args.speed_mps * min(trip_offset_s, trip_s - trip_offset_s)
+    heading += trips * 0.5
+  return offset(home(car_id), distance_m * math.cos(heading), distance_m * math.sin(heading))
+
+
+def fences_json(car_id):
+  # Rendering hundreds of vertices dominates a response, so each car's fences are cached.
+  with lock:
+    fences = fence_cache.pop(car_id, None)
+    if fences is not None:
+      fence_cache[car_id] = fences
+      return fences
+
+  features = []
+  for i in xrange(args.fences):
+    # The first fence surrounds the car's home, and the rest are decoys to the east.
+    center = offset(home(car_id), 3 * args.fence_radius_m * i, 0)
+    ring = [offset(center, args.fence_radius_m * math.cos(2 * math.pi * j / args.vertices),
+                   args.fence_radius_m * math.sin(2 * math.pi * j / args.vertices))
+            for j in xrange(args.vertices)]
+    features.append({
+      'type': 'Feature',
+      'geometry': {'type': 'Polygon', 'coordinates': [ring + ring[:1]]},
+      'properties': {'name': 'Car %s fence %s' % (car_id, i)},
+    })
+  fences = ', '.join(json.dumps(feature) for feature in features)
+
+  with lock:
+    fence_cache[car_id] = fences
+    while len(fence_cache) > FENCE_CACHE_SIZE:
+      fence_cache.popitem(last=False)
+  return fences
+
+
+def consume_rate_limit_token():
+  global rate_limit_tokens, rate_limit_time
+  if not args.rate_limit_qps:
+    return True
+  with lock:
+    now = time.time()
+    rate_limit_tokens = min(args.rate_limit_burst,
+                            rate_limit_tokens + (now - rate_limit_time) * args.rate_limit_qps)
+    rate_limit_time = now
+    if rate_limit_tokens < 1:
+      return False
+    rate_limit_tokens -= 1
+    return True
+
+
+STATUS_LINES = {
+  200: '200 OK',
+  404: '404 Not Found',
+  429: '429 Too Many Requests',
+  500: '500 Internal Server Error',
+}
+
+
+def app(environ, start_response):
+  # A bare WSGI app rather than Flask, whose routing and request wrappers would cost more than
+  # rendering the statuses themselves.
+  path = environ.get('PATH_INFO', '')
+  if path.startswith('/carStatus/'):
+    code, body, headers = car_status(path[len('/carStatus/'):])
+    responses_total.labels(str(code)).inc()
+    content_type = 'application/json'
+  elif path == '/ok':
+    code, body, headers, content_type = 200, 'ok', [], 'text/plain'
+  elif path == '/metrics':
+    code, body, headers, content_type = 200, metrics.expose(), [], 'text/plain; version=0.0.4'
+  else:
+    code, body, headers, content_type = 404, 'Not found', [], 'text/plain'
+  start_response(STATUS_LINES[code], headers + [
+    ('Content-Type', content_type),
+    ('Content-Length', str(len(body))),
+  ])
+  return [body]
+
+
+def car_status(car_id):
+  if not consume_rate_limit_token():
+    return 429, '{"error": "Too many requests"}', [('Retry-After', '1')]
+  if args.latency_median_s:
+    time.sleep(random.lognormvariate(0, args.latency_sigma) * args.latency_median_s)
+  if not car_id.isdigit() or int(car_id) >= args.cars:
+    return 404, '{"error": "No such car"}', []
+  car_id = int(car_id)
+  if random.random() < args.error_rate:
+    return 500, '{"error": "Internal server error"}', []
+
+  return 200, (
+      '{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": {"type": "Point", '
+      '"coordinates": %s}, "properties": {"id": %s}}, %s]}' % (
+          json.dumps(position(car_id, time.time())), car_id, fences_json(car_id))), []
+
+
+if __name__ == '__main__':
+  start()
@@ -0,0 +1,207 @@
+import fleet_server
+import geofence_monitor
+import json
+import math
+import mock
+import mocks
+import monitor
+import os
+import shapely.geometry
+import shutil
+import threading
+import tracks
+import unittest
+import werkzeug.test
+import werkzeug.wrappers
+import wsgi_server
+
+
+class FleetServerTest(unittest.TestCase):
+  def setUp(self):
+    self.mock_time = mocks.MockTime()
+    mock.patch('time.time', new=self.mock_time.time).start()
+    self.client = werkzeug.test.Client(fleet_server.app, werkzeug.wrappers.BaseResponse)
+
+  def tearDown(self):
+    mock.patch.stopall()
+    fleet_server.reset()
+
+  def get_car(self, car_id):
+    response = self.client.get('/carStatus/%s' % car_id)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.headers['Content-Type'], 'application/json')
+    features = json.loads(response.data)['features']
+    car = shapely.geometry.shape(features[0]['geometry'])
+    fences = [shapely.geometry.shape(feature['geometry']) for feature in features[1:]]
+    return features, car, fences
+
+  def test_car_status(self):
+    fleet_server.parse_args(['--cars=10', '--fences=3', '--vertices=16',
+                             '--out_of_bounds_share=0'])
+
+    features, car, fences = self.get_car(7)
+
+    self.assertEqual(features[0]['type'], 'Feature')
+    self.assertEqual(features[0]['geometry']['type'], 'Point')
+    self.assertEqual(features[0]['properties'], {'id': 7})
+    self.assertEqual([feature['geometry']['type'] for feature in features[1:]], ['Polygon'] * 3)
+    self.assertEqual([len(fence.exterior.coords) for fence in fences], [17] * 3)
+    self.assertTrue(fences[0].contains(car))
+    self.assertFalse(fences[1].contains(car) or fences[2].contains(car))
+
+  def test_out_of_bounds_share(self):
+    fleet_server.parse_args(['--cars=1000', '--motion=parked', '--out_of_bounds_share=0.1'])
+
+    out_of_bounds_car_ids = []
+    for car_id in xrange(1000):
+      _, car, fences = self.get_car(car_id)
+      if not fences[0].contains(car):
+        out_of_bounds_car_ids.append(car_id)
+
+    self.assertEqual(len(out_of_bounds_car_ids), 100)
+    # Spread through the fleet rather than bunched together.
+    self.assertLess(out_of_bounds_car_ids[0], 20)
+    self.assertGreater(out_of_bounds_car_ids[-1], 980)
+
+  def test_parked_cars_stay_put(self):
+    fleet_server.parse_args(['--cars=10', '--motion=parked'])
+    _, car, _ = self.get_car(3)
+
+    self.mock_time.mock_tick(3600)
+
+    self.assertEqual(self.get_car(3)[1], car)
+
+  def test_orbiting_cars_circle_home(self):
+    fleet_server.parse_args(['--cars=10', '--motion=orbit', '--out_of_bounds_share=1'])
+    _, car, fences = self.get_car(3)
+
+    self.mock_time.mock_tick(60)
+    _, later_car, _ = self.get_car(3)
+
+    self.assertNotEqual(later_car, car)
+    for orbiting_car in (car, later_car):
+      self.assertAlmostEqual(distance_m(orbiting_car, fences[0].centroid), 3000, delta=1)
+    self.assertFalse(fences[0].contains(later_car))
+
+  def test_wandering_cars_cross_their_fence(self):
+    fleet_server.parse_args(['--cars=10', '--motion=wander', '--out_of_bounds_share=1',
+                             '--speed_mps=10', '--fence_radius_m=1000'])
+
+    verdicts = set()
+    # A round trip to 1500m and back takes 300s.
+    for _ in xrange(30):
+      _, car, fences = self.get_car(3)
+      verdicts.add(fences[0].contains(car))
+      self.mock_time.mock_tick(10)
+
+    self.assertEqual(verdicts, set([True, False]))
+
+  def test_unknown_car(self):
+    fleet_server.parse_args(['--cars=10'])
+
+    for car_id in ('10', '-1', 'car'):
+      response = self.client.get('/carStatus/%s' % car_id)
+      self.assertEqual(response.status_code, 404)
+
+  def test_errors(self):
+    fleet_server.parse_args(['--cars=10', '--error_rate=1'])
+
+    response = self.client.get('/carStatus/3')
+
+    self.assertEqual(response.status_code, 500)
+
+  def test_latency(self):
+    fleet_server.parse_args(['--cars=10', '--latency_median_s=0.1', '--latency_sigma=0'])
+
+    with mock.patch('time.sleep') as mock_sleep:
+      self.get_car(3)
+
+    mock_sleep.assert_called_once_with(0.1)
+
+  def test_rate_limit(self):
+    fleet_server.parse_args(['--cars=10', '--rate_limit_qps=2', '--rate_limit_burst=3'])
+
+    self.assertEqual([self.client.get('/carStatus/3').status_code for _ in xrange(4)],
+                     [200, 200, 200, 429])
+    response = self.client.get('/carStatus/3')
+    self.assertEqual(response.status_code, 429)
+    self.assertEqual(response.headers['Retry-After'], '1')
+
+    self.mock_time.mock_tick(1)
+    self.assertEqual([self.client.get('/carStatus/3').status_code for _ in xrange(3)],
+                     [200, 200, 429])
+
+  def test_metrics(self):
+    fleet_server.parse_args(['--cars=10'])
+    self.client.get('/carStatus/3')
+    self.client.get('/carStatus/30')
+
+    response = self.client.get('/metrics')
+
+    self.assertIn('fleet_server_responses_total{code="200"} 1.0', response.data)
+    self.assertIn('fleet_server_responses_total{code="404"} 1.0', response.data)
+
+  def test_ok(self):
+    fleet_server.parse_args([])
+
+    response = self.client.get('/ok')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.data, 'ok')
+
+
+def distance_m(point, other_point):
+  return fleet_server.METERS_PER_DEGREE * math.hypot(
+      (point.x - other_point.x) * math.cos(math.radians(other_point.y)), point.y - other_point.y)
+
+
+class FleetServerGeofenceMonitorTest(unittest.TestCase):
+  def setUp(self):
+    fleet_server.parse_args(['--cars=50', '--motion=orbit', '--fences=2', '--vertices=32',
+                             '--out_of_bounds_share=0.1'])
+    self.http_server = wsgi_server.make_server('threaded', '127.0.0.1', 0, fleet_server.app)
+    self.serve_thread = threading.Thread(target=self.http_server.serve_forever)
+    self.serve_thread.start()
+    monitor.server.config['TESTING'] = True
+    mock.patch('threading.Timer', mocks.MockTimer).start()
+
+  def tearDown(self):
+    mock.patch.stopall()
+    self.http_server.stop()
+    self.serve_thread.join()
+    fleet_server.reset()
+    state_file = monitor.args and monitor.args.state_file
+    track_dir = monitor.args and getattr(monitor.args, 'track_dir', None)
+    monitor.reset()
+    tracks.close()
+    if state_file and os.path.exists(state_file):
+      os.remove(state_file)
+    if track_dir and os.path.exists(track_dir):
+      shutil.rmtree(track_dir)
+
+  def test_geofence_monitor_poll(self):
+    geofence_monitor.start([
+      '0-49',
+      'http://localhost:5000',
+      '--car_status_url=http://127.0.0.1:%s/carStatus/%%s' % self.http_server.server_address[1],
+      '--max_query_qps=1000',
+    ])
+
+    with mock.patch('monitor.alert') as mock_alert:
+      geofence_monitor.poll()
+
+    mock_alert.assert_called_once_with('Cars outside of geofences', 'geofence_monitor_geofence', {
+      'car_count': 5,
+      'car_coords': mock.ANY,
+      'group_count': mock.ANY,
+      'groups': mock.ANY,
+      'google_maps_api_key': mock.ANY,
+    })
+    out_of_bounds_car_ids = [car_id for car_id, _ in mock_alert.call_args[0][2]['car_coords']]
+    self.assertEqual(len(out_of_bounds_car_ids), 5)
+    for car_id in out_of_bounds_car_ids:
+      self.assertLess((car_id + 1) * fleet_server.GOLDEN_RATIO % 1, 0.1)
+
+
+if __name__ == '__main__':
+  unittest.main()
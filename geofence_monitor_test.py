@@ -1,11 +1,17 @@
 import geofence_monitor
 import io
+import json
 import mock
 import mocks
 import monitor
+import os
 import re
 import requests
+import shutil
+import state
+import tempfile
 import time
+import tracks
 import unittest
 
 
@@ -134,6 +140,14 @@ CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE.raw = io.BytesIO(b'''
       }]
     }''')
 
+CAR_3_GEOFENCE_ALERT_ARGS = {
+  'car_count': 1,
+  'car_coords': [(3, [-73.98, 40.76])],
+  'group_count': 1,
+  'groups': [{'coords': [-73.98, 40.76], 'car_count': 1, 'car_coords': [(3, [-73.98, 40.76])]}],
+  'google_maps_api_key': '1234567890',
+}
+
 
 
 class GeofenceMonitorTest(unittest.TestCase):
@@ -145,13 +159,27 @@ class GeofenceMonitorTest(unittest.TestCase):
   def tearDown(self):
     self.server = None
     mock.patch.stopall()
+    state_file = monitor.args and monitor.args.state_file
+    outbox_file = monitor.args and monitor.args.outbox_file
+    track_dir = monitor.args and getattr(monitor.args, 'track_dir', None)
     monitor.reset()
+    tracks.close()
+    for path in (state_file, outbox_file, outbox_file and '%s.dead' % outbox_file):
+      if path and os.path.exists(path):
+        os.remove(path)
+    if track_dir and os.path.exists(track_dir):
+      shutil.rmtree(track_dir)
 
   def test_parse_args_without_car_ids(self):
     with self.assertRaises(SystemExit) as e:
       geofence_monitor.start([])
     self.assertEqual(e.exception.code, 2)
 
+  def test_parse_args_with_empty_alert_group_cells(self):
+    with self.assertRaises(SystemExit) as e:
+      geofence_monitor.start(['1', 'http://test.com', '--alert_group_cell_deg=0'])
+    self.assertEqual(e.exception.code, 2)
+
   def test_parse_args_defaults(self):
     geofence_monitor.start(['1', 'http://test.com'])
 
@@ -294,7 +322,7 @@ class GeofenceMonitorTest(unittest.TestCase):
       mock_alert.assert_called_once_with(
           'Cars outside of geofences',
           'geofence_monitor_geofence',
-          {'car_coords': [(3, [-73.98, 40.76])], 'google_maps_api_key': '1234567890'})
+          CAR_3_GEOFENCE_ALERT_ARGS)
 
   def test_polling_all_inside_geofences(self):
     def mock_get_response(url, timeout=999):
@@ -354,7 +382,7 @@ class GeofenceMonitorTest(unittest.TestCase):
       mock_alert.assert_called_once_with(
           'Cars outside of geofences',
           'geofence_monitor_geofence',
-          {'car_coords': [(3, [-73.98, 40.76])], 'google_maps_api_key': '1234567890'})
+          CAR_3_GEOFENCE_ALERT_ARGS)
 
   def test_polling_triggering_both_alerts(self):
     def mock_get_response(url, timeout=999):
@@ -395,7 +423,7 @@ class GeofenceMonitorTest(unittest.TestCase):
       mock_alert.assert_has_calls([
         mock.call('Cars outside of geofences',
                   'geofence_monitor_geofence',
-                  {'car_coords': [(3, [-73.98, 40.76])], 'google_maps_api_key': '1234567890'}),
+                  CAR_3_GEOFENCE_ALERT_ARGS),
         mock.call('Geofence monitor errors', 'geofence_monitor_errors',
                   {'car_errors': [
                     (-2, 'FETCH_TIMED_OUT'),
@@ -404,6 +432,30 @@ class GeofenceMonitorTest(unittest.TestCase):
                   ]}),
       ], any_order=True)
 
+    self.assertEqual(monitor.state.get('geofence_monitor.car_verdicts.-2'), 'FETCH_TIMED_OUT')
+    self.assertEqual(monitor.state.get('geofence_monitor.car_verdicts.0'), 'NO_CAR_COORDS')
+    self.assertEqual(monitor.state.get('geofence_monitor.car_verdicts.1'), 'OK')
+    self.assertEqual(monitor.state.get('geofence_monitor.car_verdicts.3'), 'OUT_OF_BOUNDS')
+
+    response = self.server.get('/metrics')
+    self.assertIn('geofence_monitor_fetch_duration_seconds_count 6', response.data)
+
+    last_poll = json.loads(self.server.get('/status').data)['last_poll']
+    self.assertEqual(last_poll['out_of_bounds_cars'], [{'car_id': 3, 'coords': [-73.98, 40.76]}])
+    self.assertEqual(last_poll['car_errors'], [
+      {'car_id': -2, 'error': 'FETCH_TIMED_OUT'},
+      {'car_id': -1, 'error': 'INVALID_FETCH_RESPONSE'},
+      {'car_id': 0, 'error': 'NO_CAR_COORDS'},
+    ])
+    self.assertIn('geofence_monitor_car_errors_total{error="FETCH_TIMED_OUT",code=""} 1.0',
+                  response.data)
+    self.assertIn(
+        'geofence_monitor_car_errors_total{error="INVALID_FETCH_RESPONSE",code="404"} 1.0',
+        response.data)
+    self.assertIn('geofence_monitor_car_errors_total{error="NO_CAR_COORDS",code=""} 1.0',
+                  response.data)
+    self.assertIn('geofence_monitor_out_of_bounds_cars 1', response.data)
+
   def test_polling_with_duplicate_car_ids(self):
     def mock_get_response(url, timeout=999):
       return {
@@ -462,6 +514,299 @@ class GeofenceMonitorTest(unittest.TestCase):
 
     self.assertTrue(request_times[1] - request_times[0] >= 0.5)
 
+  def test_polling_records_tracks(self):
+    def mock_get_response(url, timeout=999):
+      return {
+        '0': CAR_0_NO_COORDINATES_RESPONSE,
+        '1': CAR_1_INSIDE_GEOFENCE_RESPONSE,
+        '3': CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE,
+      }[re.search(r'-?\d+$', url).group()]
+
+    mock_time = mocks.MockTime()
+    mock_time.mock_tick(1000)
+    with mock.patch('time.time', new=mock_time.time):
+      with mock.patch('monitor.alert'):
+        with mock.patch('requests.get', side_effect=mock_get_response):
+          geofence_monitor.start([
+            '0', '1', '3',
+            'http://test.com',
+            '--car_status_url=http://test.com/carStatus/%s',
+            '--max_query_qps=100',
+            '--poll_period_s=10',
+          ])
+
+          monitor.poll_timer.mock_tick(0)
+          mock_time.mock_tick(10)
+          monitor.poll_timer.mock_tick(10)
+
+    self.assertEqual(json.loads(self.server.get('/tracks/3').data), {
+      'car_id': 3,
+      'positions': [
+        {'time': 1000.0, 'coords': [-73.98, 40.76], 'verdict': 'OUT_OF_BOUNDS'},
+        {'time': 1010.0, 'coords': [-73.98, 40.76], 'verdict': 'OUT_OF_BOUNDS'},
+      ],
+    })
+    self.assertEqual(json.loads(self.server.get('/tracks/1?start=1005').data)['positions'], [
+      {'time': 1010.0, 'coords': [-118.4, 34.05], 'verdict': 'OK'},
+    ])
+    self.assertEqual(json.loads(self.server.get('/tracks/0').data)['positions'], [])
+
+  def test_reloading_config_file(self):
+    config_file = os.path.join(tempfile.mkdtemp(), 'config.json')
+    with open(config_file, 'w') as f:
+      json.dump({'car_ids': ['1', '3'], 'max_query_qps': 50}, f)
+
+    with mock.patch('monitor.alert'):
+      with mock.patch('requests.get', return_value=CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE) as mock_get:
+        geofence_monitor.start([
+          '1',
+          'http://test.com',
+          '--car_status_url=http://test.com/carStatus/%s',
+          '--max_query_qps=100',
+          '--poll_period_s=10',
+          '--config_file=%s' % config_file,
+        ])
+
+        monitor.poll_timer.mock_tick(0)
+        self.assertEqual(monitor.args.car_ids, [1, 3])
+        self.assertEqual(monitor.args.query_delay_s, 0.02)
+        self.assertEqual(state.get('geofence_monitor.car_verdicts.1'), 'OUT_OF_BOUNDS')
+
+        with open(config_file, 'w') as f:
+          json.dump({'car_ids': ['3-4'], 'max_query_qps': 50}, f)
+        os.utime(config_file, (0, 0))
+        mock_get.reset_mock()
+        monitor.poll_timer.mock_tick(10)
+
+    self.assertEqual(monitor.args.car_ids, [3, 4])
+    mock_get.assert_has_calls([
+      mock.call('http://test.com/carStatus/3', timeout=10),
+      mock.call('http://test.com/carStatus/4', timeout=10),
+    ])
+    self.assertEqual(mock_get.call_count, 2)
+    self.assertIsNone(state.get('geofence_monitor.car_verdicts.1'))
+    self.assertEqual(state.get('geofence_monitor.car_verdicts.3'), 'OUT_OF_BOUNDS')
+    shutil.rmtree(os.path.dirname(config_file))
+
+  def test_reloading_unchanged_car_ids(self):
+    config_file = os.path.join(tempfile.mkdtemp(), 'config.json')
+    with open(config_file, 'w') as f:
+      json.dump({'car_ids': ['3', '1-2', '1']}, f)
+
+    geofence_monitor.start([
+      '1-3',
+      'http://test.com',
+      '--config_file=%s' % config_file,
+    ])
+    self.assertEqual(monitor.parse_config({'car_ids': ['3', '1-2', '1']}), {'car_ids': [1, 2, 3]})
+    with mock.patch('geofence_monitor.update_car_ids') as mock_update_car_ids:
+      monitor.apply_config()
+    self.assertFalse(mock_update_car_ids.called)
+    self.assertEqual(monitor.args.car_ids, [1, 2, 3])
+    shutil.rmtree(os.path.dirname(config_file))
+
+  def test_config_route(self):
+    with mock.patch('monitor.alert'):
+      with mock.patch('requests.get', return_value=CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE) as mock_get:
+        geofence_monitor.start([
+          '3',
+          'http://test.com',
+          '--car_status_url=http://test.com/carStatus/%s',
+          '--max_query_qps=100',
+          '--poll_period_s=10',
+          '--admin_token=secret',
+        ])
+        monitor.poll_timer.mock_tick(0)
+
+        config = json.dumps({'car_ids': ['1-2', '3'], 'poll_period_s': 20})
+        self.assertEqual(self.server.post('/config', data=config).status_code, 401)
+        self.assertEqual(self.server.post('/config', data=config, headers={
+          'Authorization': 'Bearer wrong',
+        }).status_code, 401)
+        response = self.server.post('/config', data=json.dumps({'port': 8080}), headers={
+          'Authorization': 'Bearer secret',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('unrecognized arguments: --port 8080', json.loads(response.data)['error'])
+        response = self.server.post('/config', data=json.dumps({'max_query_qps': 0}), headers={
+          'Authorization': 'Bearer secret',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('argument --max_query_qps: invalid', json.loads(response.data)['error'])
+        response = self.server.post('/config', data=json.dumps({'alert_group_cell_deg': 0}),
+                                    headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('argument --alert_group_cell_deg: invalid positive float value: \'0\'',
+                      json.loads(response.data)['error'])
+        response = self.server.post('/config', data=config, headers={
+          'Authorization': 'Bearer secret',
+        })
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.data), {'pending': ['car_ids', 'poll_period_s']})
+        # Applied between cycles rather than part way through one.
+        self.assertEqual(monitor.args.car_ids, [3])
+
+        mock_get.reset_mock()
+        monitor.poll_timer.mock_tick(10)
+
+    self.assertEqual(monitor.args.car_ids, [1, 2, 3])
+    self.assertEqual(monitor.args.poll_period_s, 20)
+    self.assertEqual(mock_get.call_count, 3)
+    self.assertIn('--admin_token=***', self.server.get('/args').data)
+
+  def test_config_route_disabled_without_admin_token(self):
+    geofence_monitor.start(['3', 'http://test.com'])
+
+    response = self.server.post('/config', data='{"car_ids": ["4"]}',
+                                headers={'Authorization': 'Bearer None'})
+
+    self.assertEqual(response.status_code, 403)
+
+  def test_update_car_ids(self):
+    geofence_monitor.start(['0-99999', 'http://test.com'])
+    with mock.patch('monitor.alert'):
+      geofence_monitor.finish_poll([(5, [-73.98, 40.76]), (7, [-73.98, 40.76])], [])
+    car_ids = monitor.args.car_ids
+
+    geofence_monitor.update_car_ids(car_ids, set(range(10, 100100)) - set([500]))
+
+    self.assertIs(monitor.args.car_ids, car_ids)
+    self.assertEqual(car_ids, range(10, 500) + range(501, 100100))
+    self.assertIsNone(state.get('geofence_monitor.car_verdicts.5'))
+    self.assertEqual(state.get('geofence_monitor.car_verdicts.10'), 'OK')
+    self.assertEqual(geofence_monitor.last_out_of_bounds_car_coords, [])
+
+  def test_polling_without_tracks(self):
+    with mock.patch('monitor.alert'):
+      with mock.patch('requests.get', return_value=CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE):
+        geofence_monitor.start([
+          '3',
+          'http://test.com',
+          '--car_status_url=http://test.com/carStatus/%s',
+          '--max_query_qps=100',
+          '--track_dir=',
+        ])
+
+        monitor.poll_timer.mock_tick(0)
+
+    self.assertFalse(os.path.exists('geofence_monitor.tracks'))
+    self.assertEqual(json.loads(self.server.get('/tracks/3').data)['positions'], [])
+
+  def test_restart_doesnt_realert_on_cars_already_out_of_bounds(self):
+    raw_args = [
+      '3',
+      'http://test.com',
+      '--car_status_url=http://test.com/carStatus/%s',
+      '--max_query_qps=100',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=0',
+    ]
+    with mock.patch('monitor.alert') as mock_alert:
+      with mock.patch('requests.get', return_value=CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE):
+        geofence_monitor.start(raw_args)
+        monitor.poll_timer.mock_tick(0)
+        self.assertEqual(mock_alert.call_count, 1)
+
+        monitor.reset()
+        geofence_monitor.start(raw_args)
+        monitor.poll_timer.mock_tick(10)
+        self.assertEqual(mock_alert.call_count, 1)
+
+        # Only the first cycle after restarting skips them.
+        monitor.poll_timer.mock_tick(10)
+        self.assertEqual(mock_alert.call_count, 2)
+
+  def test_failing_track_write_still_alerts(self):
+    with mock.patch('monitor.alert') as mock_alert:
+      with mock.patch('requests.get', return_value=CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE):
+        with mock.patch('tracks.append', side_effect=IOError('No space left on device')):
+          geofence_monitor.start([
+            '3',
+            'http://test.com',
+            '--car_status_url=http://test.com/carStatus/%s',
+            '--max_query_qps=100',
+          ])
+
+          monitor.poll_timer.mock_tick(0)
+
+    mock_alert.assert_called_once_with('Cars outside of geofences', 'geofence_monitor_geofence',
+                                       mock.ANY)
+
+  def test_geofence_alert_rendering(self):
+    with mock.patch('requests.post') as mock_post:
+      with mock.patch('requests.get', return_value=CAR_3_OUTSIDE_ITS_GEOFENCES_RESPONSE):
+        geofence_monitor.start([
+          '3',
+          'http://test.com',
+          '--car_status_url=http://test.com/carStatus/%s',
+          '--google_maps_api_key=1234567890',
+          '--max_query_qps=100',
+          '--poll_period_s=10',
+          '--min_poll_padding_period_s=0',
+        ])
+
+        monitor.poll_timer.mock_tick(1.0)
+        monitor.outbox.retry_timer.mock_tick(0)
+
+      filtered_html = re.sub(r'\s+', ' ', mock_post.call_args[1]['data']['html'])
+      self.assertIn('The following cars are outside of their geofences (1 in total):',
+                    filtered_html)
+      self.assertIn('markers=size:small%7C40.76,-73.98&amp;key=1234567890', filtered_html)
+      self.assertIn('<td>3</td>', filtered_html)
+      self.assertIn('(40.76, -73.98)', filtered_html)
+      self.assertIn('/out_of_bounds">See every car outside of its geofences', filtered_html)
+      self.assertNotIn('more cars', filtered_html)
+
+  def test_large_geofence_alert_rendering(self):
+    geofence_monitor.start(['0', 'http://test.com', '--google_maps_api_key=1234567890'])
+    # 5000 cars spread evenly over 100 areas.
+    car_coords = [(car_id, [-122.0 + car_id % 100, 37.0 + car_id * 0.0001])
+                  for car_id in xrange(5000)]
+
+    with mock.patch('requests.post') as mock_post:
+      geofence_monitor.finish_poll(car_coords, [])
+      monitor.outbox.retry_timer.mock_tick(0)
+
+    html = mock_post.call_args[1]['data']['html']
+    filtered_html = re.sub(r'\s+', ' ', html)
+    self.assertLess(len(html), 50000)
+    self.assertIn('(5000 in total)', filtered_html)
+    self.assertEqual(filtered_html.count('maps/api/staticmap'), 10)
+    self.assertEqual(filtered_html.count('<td>'), 10 * 3 + 20 * 2)
+    self.assertLess(max(len(url) for url in re.findall(r'src="([^"]+)"', html)), 8192)
+    self.assertIn('And 4500 more cars in 90 other areas.', filtered_html)
+    self.assertIn('And 4980 more cars.', filtered_html)
+
+  def test_group_car_coords(self):
+    geofence_monitor.start(['0', 'http://test.com', '--alert_group_cell_deg=1'])
+
+    groups = geofence_monitor.group_car_coords([
+      (1, [-73.9, 40.7]), (2, [-118.4, 34.1]), (3, [-73.1, 40.1]), (4, [-72.9, 40.7]),
+    ])
+
+    self.assertEqual(groups, [
+      {'coords': [-73.5, 40.4], 'car_count': 2,
+       'car_coords': [(1, [-73.9, 40.7]), (3, [-73.1, 40.1])]},
+      {'coords': [-118.4, 34.1], 'car_count': 1, 'car_coords': [(2, [-118.4, 34.1])]},
+      {'coords': [-72.9, 40.7], 'car_count': 1, 'car_coords': [(4, [-72.9, 40.7])]},
+    ])
+
+  def test_out_of_bounds_page(self):
+    geofence_monitor.start(['0', 'http://test.com'])
+    with mock.patch('monitor.alert'):
+      geofence_monitor.finish_poll([(car_id, [-73.98, 40.76]) for car_id in xrange(250)], [])
+
+    first_page = re.sub(r'\s+', ' ', self.server.get('/out_of_bounds').data)
+    last_page = re.sub(r'\s+', ' ', self.server.get('/out_of_bounds?page=3').data)
+
+    self.assertIn('250 cars were outside of their geofences at the last poll.', first_page)
+    self.assertEqual(first_page.count('<tr>'), 101)
+    self.assertIn('<td>0</td>', first_page)
+    self.assertIn('Page 1 of 3 <a href="?page=2">Next page</a>', first_page)
+    self.assertEqual(last_page.count('<tr>'), 51)
+    self.assertIn('<td>249</td>', last_page)
+    self.assertIn('<a href="?page=2">Previous page</a> Page 3 of 3', last_page)
+
 
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import array
+import threading
+
+
+# A fixed-size ring buffer of per-poll-cycle records, stored column-wise in preallocated arrays of
+# doubles so that recording a cycle only overwrites slots rather than allocating new objects.
+class RingBuffer(object):
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.start_times = array.array('d', [0.0]) * capacity
+    self.durations_s = array.array('d', [0.0]) * capacity
+    self.slacks_s = array.array('d', [0.0]) * capacity
+    self.alerts = array.array('d', [0.0]) * capacity
+    self.errors = array.array('d', [0.0]) * capacity
+    self.cars = array.array('d', [0.0]) * capacity
+    self.size = 0
+    self.next_index = 0
+    self.lock = threading.Lock()
+
+  def record(self, start_time, duration_s, slack_s, alerts, errors, cars):
+    with self.lock:
+      i = self.next_index
+      self.start_times[i] = start_time
+      self.durations_s[i] = duration_s
+      self.slacks_s[i] = slack_s
+      self.alerts[i] = alerts
+      self.errors[i] = errors
+      self.cars[i] = cars
+      self.next_index = (i + 1) % self.capacity
+      self.size = min(self.size + 1, self.capacity)
+
+  def indexes(self):
+    # Oldest first.
+    first_index = (self.next_index - self.size) % self.capacity
+    for offset in xrange(self.size):
+      yield (first_index + offset) % self.capacity
+
+  def cycles(self, since=None):
+    with self.lock:
+      return [{
+        'start_time': self.start_times[i],
+        'duration_s': self.durations_s[i],
+        'slack_s': self.slacks_s[i],
+        'alerts': int(self.alerts[i]),
+        'errors': int(self.errors[i]),
+        'cars': int(self.cars[i]),
+      } for i in self.indexes() if since is None or self.start_times[i] >= since]
+
+  def downsample(self, bucket_s, since=None):
+    # Summarizes the cycles starting in each bucket_s-aligned period: their mean and max durations,
+    # min slack, total alerts and errors, and the most cars evaluated in a cycle.
+    buckets = []
+    for cycle in self.cycles(since):
+      bucket_start_time = cycle['start_time'] - cycle['start_time'] % bucket_s
+      if not buckets or buckets[-1]['start_time'] != bucket_start_time:
+        buckets.append({
+          'start_time': bucket_start_time,
+          'cycles': 0,
+          'duration_s': 0.0,
+          'max_duration_s': cycle['duration_s'],
+          'min_slack_s': cycle['slack_s'],
+          'alerts': 0,
+          'errors': 0,
+          'cars': 0,
+        })
+      bucket = buckets[-1]
+      bucket['cycles'] += 1
+      bucket['duration_s'] += cycle['duration_s']
+      bucket['max_duration_s'] = max(bucket['max_duration_s'], cycle['duration_s'])
+      bucket['min_slack_s'] = min(bucket['min_slack_s'], cycle['slack_s'])
+      bucket['alerts'] += cycle['alerts']
+      bucket['errors'] += cycle['errors']
+      bucket['cars'] = max(bucket['cars'], cycle['cars'])
+    for bucket in buckets:
+      bucket['duration_s'] /= bucket['cycles']
+    return buckets
@@ -0,0 +1,53 @@
+import history
+import unittest
+
+
+
+class RingBufferTest(unittest.TestCase):
+  def test_cycles_are_oldest_first(self):
+    ring_buffer = history.RingBuffer(3)
+    self.assertEqual(ring_buffer.cycles(), [])
+
+    ring_buffer.record(10.0, 1.0, 9.0, 0, 1, 5)
+    ring_buffer.record(20.0, 2.0, 8.0, 1, 0, 5)
+    self.assertEqual(ring_buffer.cycles(), [
+      {'start_time': 10.0, 'duration_s': 1.0, 'slack_s': 9.0, 'alerts': 0, 'errors': 1, 'cars': 5},
+      {'start_time': 20.0, 'duration_s': 2.0, 'slack_s': 8.0, 'alerts': 1, 'errors': 0, 'cars': 5},
+    ])
+
+  def test_overwrites_oldest_cycles_when_full(self):
+    ring_buffer = history.RingBuffer(3)
+    for i in xrange(5):
+      ring_buffer.record(i * 10.0, 1.0, 9.0, 0, 0, 0)
+    self.assertEqual([cycle['start_time'] for cycle in ring_buffer.cycles()], [20.0, 30.0, 40.0])
+    self.assertEqual([cycle['start_time'] for cycle in ring_buffer.cycles(since=25.0)],
+                     [30.0, 40.0])
+
+  def test_downsample(self):
+    ring_buffer = history.RingBuffer(10)
+    ring_buffer.record(0.0, 1.0, 9.0, 1, 0, 5)
+    ring_buffer.record(10.0, 3.0, 7.0, 0, 2, 6)
+    ring_buffer.record(60.0, 2.0, 8.0, 0, 1, 6)
+    self.assertEqual(ring_buffer.downsample(60), [{
+      'start_time': 0.0,
+      'cycles': 2,
+      'duration_s': 2.0,
+      'max_duration_s': 3.0,
+      'min_slack_s': 7.0,
+      'alerts': 1,
+      'errors': 2,
+      'cars': 6,
+    }, {
+      'start_time': 60.0,
+      'cycles': 1,
+      'duration_s': 2.0,
+      'max_duration_s': 2.0,
+      'min_slack_s': 8.0,
+      'alerts': 0,
+      'errors': 1,
+      'cars': 6,
+    }])
+
+
+if __name__ == '__main__':
+  unittest.main()
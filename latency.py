@@ -0,0 +1,54 @@
+import collections
+import math
+
+MIN_LATENCY_S = 0.0001
+MAX_LATENCY_S = 3600.0
+# Each bucket's bound is 5% above the last, so reported percentiles are within 5% of the true value.
+BUCKET_GROWTH = 1.05
+NUM_BUCKETS = int(math.ceil(math.log(MAX_LATENCY_S / MIN_LATENCY_S, BUCKET_GROWTH))) + 1
+
+
+# Counts the latencies of the last window_size samples in fixed, log-spaced buckets, so that adding a
+# sample and computing a percentile cost O(1) and O(NUM_BUCKETS) regardless of the window size.
+class RollingHistogram(object):
+  def __init__(self, window_size):
+    self.window_size = window_size
+    self.window = collections.deque()
+    self.counts = [0] * NUM_BUCKETS
+
+  def __len__(self):
+    return len(self.window)
+
+  def add(self, latency_s):
+    return self.add_bucket(bucket_index(latency_s))
+
+  def add_bucket(self, index):
+    # Returns the bucket of the sample that fell out of the window, if any.
+    self.window.append(index)
+    self.counts[index] += 1
+    if len(self.window) <= self.window_size:
+      return None
+    evicted_index = self.window.popleft()
+    self.counts[evicted_index] -= 1
+    return evicted_index
+
+  def percentile(self, percent):
+    if not self.window:
+      return None
+    rank = max(1, int(math.ceil(percent / 100.0 * len(self.window))))
+    count = 0
+    for index, bucket_count in enumerate(self.counts):
+      count += bucket_count
+      if count >= rank:
+        return bucket_bound(index)
+
+
+def bucket_index(latency_s):
+  if latency_s <= MIN_LATENCY_S:
+    return 0
+  return min(NUM_BUCKETS - 1,
+             int(math.ceil(math.log(latency_s / MIN_LATENCY_S, BUCKET_GROWTH) - 1e-9)))
+
+
+def bucket_bound(index):
+  return MIN_LATENCY_S * BUCKET_GROWTH ** index
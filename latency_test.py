@@ -0,0 +1,35 @@
+import latency
+import unittest
+
+
+
+class RollingHistogramTest(unittest.TestCase):
+  def test_percentiles_are_within_bucket_resolution(self):
+    histogram = latency.RollingHistogram(100)
+    self.assertIsNone(histogram.percentile(50))
+
+    for i in xrange(1, 101):
+      histogram.add(i / 100.0)
+    for percent, expected_s in ((50, 0.5), (95, 0.95), (99, 0.99), (100, 1.0)):
+      self.assertGreaterEqual(histogram.percentile(percent), expected_s)
+      self.assertLess(histogram.percentile(percent), expected_s * latency.BUCKET_GROWTH)
+
+  def test_old_samples_leave_the_window(self):
+    histogram = latency.RollingHistogram(3)
+    self.assertIsNone(histogram.add(10.0))
+    histogram.add(10.0)
+    histogram.add(0.01)
+    self.assertEqual(histogram.add(0.01), latency.bucket_index(10.0))
+    self.assertEqual(len(histogram), 3)
+    self.assertLess(histogram.percentile(50), 0.011)
+
+  def test_out_of_range_latencies_are_clamped(self):
+    histogram = latency.RollingHistogram(2)
+    histogram.add(0)
+    histogram.add(10 * latency.MAX_LATENCY_S)
+    self.assertEqual(histogram.percentile(50), latency.MIN_LATENCY_S)
+    self.assertGreaterEqual(histogram.percentile(100), latency.MAX_LATENCY_S)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,194 @@
+import bisect
+import glob
+import gzip
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+
+LINE_PATTERN = re.compile(
+    r'^(?P<level>[A-Z]+)\s+(?P<asctime>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(?P<ms>\d{3}) ')
+CAR_ID_PATTERN = re.compile(r'\bcar (-?\d+)\b', re.IGNORECASE)
+
+index_cache = {}
+index_cache_lock = threading.Lock()
+
+
+# Indexes each record's time, level, car IDs and file offset. The current file's index is kept in
+# memory and written out next to the file as it's rotated, so that searches can seek straight to
+# matching records in any backup.
+class IndexedFileHandler(logging.handlers.TimedRotatingFileHandler):
+  def __init__(self, filename, **kwargs):
+    logging.handlers.TimedRotatingFileHandler.__init__(self, filename, **kwargs)
+    self.entries = (scan_index(self.baseFilename, self.parse_entry)
+                    if os.path.exists(self.baseFilename) else [])
+
+  def parse_entry(self, line):
+    return parse_text_entry(line)
+
+  def emit(self, record):
+    try:
+      if self.shouldRollover(record):
+        self.doRollover()
+      if self.stream is None:
+        self.stream = self._open()
+      offset = self.stream.tell()
+      logging.FileHandler.emit(self, record)
+      self.entries.append((record.created, record.levelno, offset, record_car_ids(record)))
+    except (KeyboardInterrupt, SystemExit):
+      raise
+    except:
+      self.handleError(record)
+
+  def _open(self):
+    # Position append-mode streams at the end up front, so that tell() is accurate without having
+    # to seek (and so flush) before every record.
+    stream = logging.handlers.TimedRotatingFileHandler._open(self)
+    stream.seek(0, 2)
+    return stream
+
+  def doRollover(self):
+    rotated_path = self.rotated_path()
+    entries, self.entries = self.entries, []
+    logging.handlers.TimedRotatingFileHandler.doRollover(self)
+    if os.path.exists(rotated_path):
+      write_index(rotated_path, entries)
+    # Drop the indexes of any backups that were just deleted.
+    for index_path in glob.glob('%s.*.idx' % self.baseFilename):
+      if not os.path.exists(index_path[:-len('.idx')]):
+        os.remove(index_path)
+
+  def rotated_path(self):
+    # Mirrors the backup name chosen by TimedRotatingFileHandler.doRollover.
+    t = self.rolloverAt - self.interval
+    if self.utc:
+      time_tuple = time.gmtime(t)
+    else:
+      time_tuple = time.localtime(t)
+      dst_now, dst_then = time.localtime()[-1], time_tuple[-1]
+      if dst_now != dst_then:
+        time_tuple = time.localtime(t + (3600 if dst_now else -3600))
+    return '%s.%s' % (self.baseFilename, time.strftime(self.suffix, time_tuple))
+
+  def log_paths(self):
+    rotated_paths = sorted(path for path in glob.glob('%s.*' % self.baseFilename)
+                           if not path.endswith(('.idx', '.tmp')))
+    return rotated_paths + [self.baseFilename]
+
+  def search(self, car_id=None, start_time=None, end_time=None, text=None, min_level=0,
+             limit=1000):
+    self.acquire()
+    try:
+      self.flush()
+      current_entries = list(self.entries)
+    finally:
+      self.release()
+
+    for path in self.log_paths():
+      entries = (current_entries if path == self.baseFilename
+                 else load_index(path, self.parse_entry))
+      for record in search_file(path, entries, car_id, start_time, end_time, text, min_level):
+        yield path, record
+        limit -= 1
+        if limit <= 0:
+          return
+
+
+def search_file(path, entries, car_id, start_time, end_time, text, min_level):
+  if not entries:
+    return
+  # Skip whole files whose records all fall outside of the time range.
+  if start_time is not None and entries[-1][0] < start_time:
+    return
+  if end_time is not None and entries[0][0] > end_time:
+    return
+
+  first_index = 0
+  if start_time is not None:
+    first_index = bisect.bisect_left([entry[0] for entry in entries], start_time)
+  with open_log(path) as f:
+    for i in xrange(first_index, len(entries)):
+      created, levelno, offset, car_ids = entries[i]
+      if end_time is not None and created > end_time:
+        break
+      if levelno < min_level or (car_id is not None and car_id not in car_ids):
+        continue
+      f.seek(offset)
+      record = f.read(entries[i + 1][2] - offset) if i + 1 < len(entries) else f.read()
+      if text and text not in record:
+        continue
+      yield record.rstrip('\n')
+
+
+def record_car_ids(record):
+  if getattr(record, 'car_id', None) is not None:
+    return (record.car_id,)
+  return tuple(int(car_id) for car_id in CAR_ID_PATTERN.findall(record.getMessage()))
+
+
+def parse_text_entry(line):
+  match = LINE_PATTERN.match(line)
+  if not match:
+    return None
+  level = logging.getLevelName(match.group('level'))
+  created = (time.mktime(time.strptime(match.group('asctime'), '%Y-%m-%d %H:%M:%S')) +
+             int(match.group('ms')) / 1000.0)
+  car_ids = tuple(int(car_id) for car_id in CAR_ID_PATTERN.findall(line))
+  return created, level if isinstance(level, int) else 0, car_ids
+
+
+def open_log(path):
+  # Rotated logs may have been compressed. Since entries are read in offset order, seeking in them
+  # only ever decompresses forwards.
+  return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'r')
+
+
+def load_index(path, parse_entry=parse_text_entry):
+  index_path = '%s.idx' % path
+  mtime = os.path.getmtime(path)
+  with index_cache_lock:
+    cached = index_cache.get(path)
+  if cached and cached[0] == mtime:
+    return cached[1]
+
+  if os.path.exists(index_path):
+    entries = read_index(index_path)
+  else:
+    # Backups written before indexing existed are scanned once and then indexed.
+    entries = scan_index(path, parse_entry)
+    write_index(path, entries)
+  with index_cache_lock:
+    index_cache[path] = (mtime, entries)
+  return entries
+
+
+def scan_index(path, parse_entry=parse_text_entry):
+  entries = []
+  with open_log(path) as f:
+    offset = 0
+    for line in iter(f.readline, ''):
+      entry = parse_entry(line)
+      if entry:
+        created, levelno, car_ids = entry
+        entries.append((created, levelno, offset, car_ids))
+      offset += len(line)
+  return entries
+
+
+def read_index(index_path):
+  entries = []
+  with open(index_path, 'r') as f:
+    for line in f:
+      created, levelno, offset, car_ids = (line.rstrip('\n').split(' ') + [''])[:4]
+      entries.append((float(created), int(levelno), int(offset),
+                      tuple(int(car_id) for car_id in car_ids.split(',') if car_id)))
+  return entries
+
+
+def write_index(path, entries):
+  with open('%s.idx' % path, 'w') as f:
+    for created, levelno, offset, car_ids in entries:
+      car_ids_str = ','.join(str(car_id) for car_id in car_ids)
+      f.write('%r %d %d %s\n' % (created, levelno, offset, car_ids_str))
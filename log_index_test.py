@@ -0,0 +1,119 @@
+import log_index
+import logging
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+
+class LogIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'test.INFO.log')
+    self.logger = logging.getLogger('log_index_test')
+    self.logger.propagate = False
+    self.logger.setLevel(logging.INFO)
+
+  def tearDown(self):
+    for handler in self.logger.handlers:
+      handler.close()
+    self.logger.handlers = []
+    log_index.index_cache.clear()
+    shutil.rmtree(self.dir)
+
+  def add_handler(self):
+    handler = log_index.IndexedFileHandler(self.path, when='d', interval=1, backupCount=7)
+    handler.setFormatter(logging.Formatter('%(levelname)-8s %(asctime)s [%(name)s]: %(message)s'))
+    self.logger.handlers = [handler]
+    return handler
+
+  def search(self, handler, **kwargs):
+    return [record.split(': ', 1)[1] for path, record in handler.search(**kwargs)]
+
+  def test_search_by_car_id(self):
+    handler = self.add_handler()
+    self.logger.info('Fetching status for car 1.')
+    self.logger.info('Car 2 was found outside of its geofences.')
+    self.logger.info('Car 12 was found outside of its geofences.')
+
+    self.assertEqual(self.search(handler, car_id=2), ['Car 2 was found outside of its geofences.'])
+    self.assertEqual(self.search(handler, car_id=3), [])
+
+  def test_search_by_level_and_text(self):
+    handler = self.add_handler()
+    self.logger.info('Polling...')
+    self.logger.error('Request for car 1 timed out after 10s.')
+    self.logger.error('Received 404 HTTP code for car 2')
+
+    self.assertEqual(self.search(handler, min_level=logging.ERROR),
+                     ['Request for car 1 timed out after 10s.', 'Received 404 HTTP code for car 2'])
+    self.assertEqual(self.search(handler, text='timed out'),
+                     ['Request for car 1 timed out after 10s.'])
+    self.assertEqual(self.search(handler, limit=1), ['Polling...'])
+
+  def test_search_returns_multiline_records(self):
+    handler = self.add_handler()
+    try:
+      raise ValueError('bad car')
+    except ValueError:
+      self.logger.exception('Unhandled exception for car 1.')
+    self.logger.info('Polling...')
+
+    records = self.search(handler, car_id=1)
+    self.assertEqual(len(records), 1)
+    self.assertTrue(records[0].startswith('Unhandled exception for car 1.\nTraceback'))
+    self.assertTrue(records[0].endswith('ValueError: bad car'))
+
+  def test_search_by_time_range(self):
+    handler = self.add_handler()
+    with mock.patch('time.time', return_value=1000.0):
+      self.logger.info('Car 1 was found outside of its geofences.')
+    with mock.patch('time.time', return_value=2000.0):
+      self.logger.info('Car 1 was found outside of its geofences again.')
+
+    self.assertEqual(self.search(handler, start_time=1500),
+                     ['Car 1 was found outside of its geofences again.'])
+    self.assertEqual(self.search(handler, end_time=1500),
+                     ['Car 1 was found outside of its geofences.'])
+    self.assertEqual(self.search(handler, start_time=3000), [])
+
+  def test_rollover_writes_index(self):
+    handler = self.add_handler()
+    self.logger.info('Car 1 was found outside of its geofences.')
+    rotated_path = handler.rotated_path()
+    handler.doRollover()
+    self.logger.info('Car 2 was found outside of its geofences.')
+
+    self.assertTrue(os.path.exists('%s.idx' % rotated_path))
+    self.assertEqual(handler.log_paths(), [rotated_path, self.path])
+    self.assertEqual(self.search(handler, car_id=1), ['Car 1 was found outside of its geofences.'])
+    self.assertEqual(self.search(handler, car_id=2), ['Car 2 was found outside of its geofences.'])
+
+  def test_unindexed_files_are_scanned(self):
+    rotated_path = '%s.2016-01-01' % self.path
+    with open(rotated_path, 'w') as f:
+      f.write('INFO     2016-01-01 10:00:00,000 [monitor]: Polling...\n'
+              'ERROR    2016-01-01 10:00:01,500 [monitor]: Request for car 7 timed out after 10s.\n')
+    handler = self.add_handler()
+
+    self.assertEqual(self.search(handler, car_id=7), ['Request for car 7 timed out after 10s.'])
+    self.assertTrue(os.path.exists('%s.idx' % rotated_path))
+    self.assertEqual(log_index.read_index('%s.idx' % rotated_path), [
+      (time.mktime((2016, 1, 1, 10, 0, 0, 0, 0, -1)), logging.INFO, 0, ()),
+      (time.mktime((2016, 1, 1, 10, 0, 1, 0, 0, -1)) + 0.5, logging.ERROR, 55, (7,)),
+    ])
+
+  def test_current_file_is_scanned_on_startup(self):
+    handler = self.add_handler()
+    self.logger.info('Car 3 was found outside of its geofences.')
+    handler.close()
+
+    handler = self.add_handler()
+    self.assertEqual(self.search(handler, car_id=3), ['Car 3 was found outside of its geofences.'])
+
+
+if __name__ == '__main__':
+  unittest.main()
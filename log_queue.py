@@ -0,0 +1,86 @@
+import logging
+import Queue
+import sys
+import threading
+import time
+import traceback
+
+MAX_BATCH_SIZE = 1000
+BATCH_PERIOD_S = 0.05
+
+
+# Hands records off to a single background writer thread, so that logging on the polling thread
+# costs a queue put rather than formatting and several synchronous file writes.
+class QueueHandler(logging.Handler):
+  def __init__(self, handlers):
+    logging.Handler.__init__(self)
+    self.handlers = handlers
+    self.queue = Queue.Queue()
+    self.writer = threading.Thread(target=self.write_batches, name='log-writer')
+    self.writer.daemon = True
+    self.writer.start()
+
+  def emit(self, record):
+    try:
+      # Merge the message args now, since they may be mutated by the time the writer gets to them.
+      record.msg = record.getMessage()
+      record.args = None
+      self.queue.put(record)
+    except (KeyboardInterrupt, SystemExit):
+      raise
+    except:
+      self.handleError(record)
+
+  def flush(self):
+    # Block until everything logged so far has been written out.
+    if self.writer.is_alive():
+      self.queue.join()
+    for handler in self.handlers:
+      handler.flush()
+
+  def close(self):
+    if self.writer.is_alive():
+      self.queue.put(None)
+      self.writer.join()
+    for handler in self.handlers:
+      handler.close()
+    logging.Handler.close(self)
+
+  def write_batches(self):
+    while True:
+      records = [self.queue.get()]
+      # Let a batch build up rather than waking (and contending with the logging thread) per record.
+      time.sleep(BATCH_PERIOD_S)
+      while len(records) < MAX_BATCH_SIZE:
+        try:
+          records.append(self.queue.get_nowait())
+        except Queue.Empty:
+          break
+
+      stop = None in records
+      records = [record for record in records if record is not None]
+      for handler in self.handlers:
+        try:
+          emit_batch(handler, records)
+        except Exception:
+          traceback.print_exc(file=sys.stderr)
+      for i in xrange(len(records) + stop):
+        self.queue.task_done()
+      if stop:
+        return
+
+
+def emit_batch(handler, records):
+  handler.acquire()
+  try:
+    # StreamHandler.emit flushes after every record, so defer that to a single flush per batch.
+    handler.flush = lambda: None
+    try:
+      for record in records:
+        if record.levelno >= handler.level:
+          handler.handle(record)
+    finally:
+      del handler.flush
+    handler.flush()
+  finally:
+    handler.release()
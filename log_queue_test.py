@@ -0,0 +1,73 @@
+import log_queue
+import logging
+import mock
+import StringIO
+import threading
+import unittest
+
+
+
+class LogQueueTest(unittest.TestCase):
+  def setUp(self):
+    self.logger = logging.getLogger('log_queue_test')
+    self.logger.propagate = False
+    self.logger.setLevel(logging.INFO)
+    self.info_stream, self.error_stream = StringIO.StringIO(), StringIO.StringIO()
+    self.info = logging.StreamHandler(stream=self.info_stream)
+    self.info.setLevel(logging.INFO)
+    self.error = logging.StreamHandler(stream=self.error_stream)
+    self.error.setLevel(logging.ERROR)
+    self.queue_handler = log_queue.QueueHandler([self.info, self.error])
+    self.logger.handlers = [self.queue_handler]
+
+  def tearDown(self):
+    self.queue_handler.close()
+    self.logger.handlers = []
+
+  def test_records_are_written_by_level(self):
+    self.logger.info('Polling...')
+    self.logger.error('Request for car %s timed out after %ss.', 1, 10)
+    self.queue_handler.flush()
+
+    self.assertEqual(self.info_stream.getvalue(),
+                     'Polling...\nRequest for car 1 timed out after 10s.\n')
+    self.assertEqual(self.error_stream.getvalue(), 'Request for car 1 timed out after 10s.\n')
+
+  def test_message_args_are_merged_when_logged(self):
+    car_ids = [1]
+    self.logger.info('Cars: %s', car_ids)
+    car_ids.append(2)
+    self.queue_handler.flush()
+
+    self.assertEqual(self.info_stream.getvalue(), 'Cars: [1]\n')
+
+  def test_records_are_written_off_the_logging_thread(self):
+    write_threads = []
+    self.info.emit = lambda record: write_threads.append(threading.current_thread())
+    self.logger.info('Polling...')
+    self.queue_handler.flush()
+
+    self.assertEqual(write_threads, [self.queue_handler.writer])
+
+  def test_batches_share_one_flush(self):
+    with mock.patch.object(self.info_stream, 'flush') as mock_flush:
+      log_queue.emit_batch(self.info, [
+        self.logger.makeRecord('log_queue_test', logging.INFO, '', 0, 'Record %s', (i,), None)
+        for i in xrange(10)
+      ])
+
+    self.assertEqual(mock_flush.call_count, 1)
+    self.assertEqual(self.info_stream.getvalue(),
+                     ''.join('Record %s\n' % i for i in xrange(10)))
+
+  def test_close_drains_queue_and_stops_writer(self):
+    for i in xrange(100):
+      self.logger.info('Record %s', i)
+    self.queue_handler.close()
+
+    self.assertFalse(self.queue_handler.writer.is_alive())
+    self.assertEqual(self.info_stream.getvalue(), ''.join('Record %s\n' % i for i in xrange(100)))
+
+
+if __name__ == '__main__':
+  unittest.main()
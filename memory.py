@@ -0,0 +1,84 @@
+import collections
+import gc
+import resource
+import sys
+import types
+
+# tracemalloc needs Python 3.4, so memory is traced through the garbage collector instead: snapshots
+# count the container objects it tracks by type, and the objects created since a snapshot are traced
+# back to the older containers holding on to them, which names the cache or list they pile up in.
+
+
+class Snapshot(object):
+  def __init__(self, keep_ids=False):
+    gc.collect()
+    objects = gc.get_objects()
+    self.rss_bytes = rss_bytes()
+    self.counts = collections.Counter(type_name(obj) for obj in objects)
+    self.ids = set(id(obj) for obj in objects) if keep_ids else None
+    del objects
+
+  def __len__(self):
+    return sum(self.counts.itervalues())
+
+  def compare_to(self, old_snapshot, limit=30):
+    # Returns the (type, count, change) of the types whose counts changed the most since the old
+    # snapshot.
+    changes = [(name, self.counts[name], self.counts[name] - old_snapshot.counts[name])
+               for name in set(self.counts) | set(old_snapshot.counts)]
+    changes = [change for change in changes if change[2]]
+    changes.sort(key=lambda change: (-abs(change[2]), change[0]))
+    return changes[:limit]
+
+
+def find_retainers(old_snapshot, limit=30):
+  # Returns the (type, holder, count) of the objects created since the old snapshot that are held by
+  # older objects, the most common first. Objects held only by other new objects are left out, so
+  # that a growing list of dicts shows up once as dicts held by the list rather than as every value
+  # held by every dict. New objects can reuse the IDs of freed ones, so the counts are lower bounds.
+  gc.collect()
+  objects = gc.get_objects()
+  new_ids = set(id(obj) for obj in objects).difference(old_snapshot.ids)
+  names = global_names()
+  retainers = collections.Counter()
+  for obj in objects:
+    if id(obj) in new_ids:
+      continue
+    for referent in gc.get_referents(obj):
+      if id(referent) in new_ids:
+        retainers[(type_name(referent), names.get(id(obj)) or type_name(obj))] += 1
+  del objects
+  return [(name, holder, count) for (name, holder), count in retainers.most_common(limit)]
+
+
+def global_names():
+  # Names every module's globals and their values, e.g. "monitor.fragment_cache".
+  names = {}
+  for module_name, module in sys.modules.items():
+    module_globals = getattr(module, '__dict__', None)
+    if not isinstance(module_globals, dict):
+      continue
+    names[id(module_globals)] = '%s globals' % module_name
+    for global_name, value in module_globals.items():
+      names.setdefault(id(value), '%s.%s' % (module_name, global_name))
+  return names
+
+
+def type_name(obj):
+  # Old-style instances are all of type "instance", so they're named by their class instead.
+  obj_type = obj.__class__ if isinstance(obj, types.InstanceType) else type(obj)
+  module = getattr(obj_type, '__module__', None)
+  if not module or module == '__builtin__':
+    return obj_type.__name__
+  return '%s.%s' % (module, obj_type.__name__)
+
+
+def rss_bytes():
+  # The current resident set size where /proc has it, or else the peak.
+  try:
+    with open('/proc/self/statm', 'r') as f:
+      return int(f.read().split()[1]) * resource.getpagesize()
+  except (EnvironmentError, IndexError, ValueError):
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, and Linux kilobytes.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
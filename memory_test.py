@@ -0,0 +1,45 @@
+import memory
+import unittest
+
+leaked = []
+
+
+class Leak(object):
+  pass
+
+
+class OldStyleLeak():
+  pass
+
+
+class MemoryTest(unittest.TestCase):
+  def tearDown(self):
+    del leaked[:]
+
+  def test_compare_to(self):
+    snapshot = memory.Snapshot()
+    leaked.extend(Leak() for _ in xrange(100))
+    leaked.extend(OldStyleLeak() for _ in xrange(10))
+
+    changes = memory.Snapshot().compare_to(snapshot)
+
+    self.assertEqual(changes[0], ('%s.Leak' % __name__, 100, 100))
+    self.assertIn(('%s.OldStyleLeak' % __name__, 10, 10), changes)
+
+  def test_find_retainers(self):
+    snapshot = memory.Snapshot(keep_ids=True)
+    leaked.extend({'id': [i]} for i in xrange(100))
+
+    retainers = memory.find_retainers(snapshot)
+
+    # Most new dicts are held by the list, while the lists held by the new dicts aren't counted.
+    name, holder, count = retainers[0]
+    self.assertEqual((name, holder), ('dict', '%s.leaked' % __name__))
+    self.assertGreater(count, 90)
+    self.assertNotIn('list', [name for name, holder, count in retainers if holder == 'dict'])
+
+  def test_rss_bytes(self):
+    self.assertGreater(memory.rss_bytes(), 1024 * 1024)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,88 @@
+import logging
+import random
+import threading
+import time
+
+# Each member's [heartbeat, local time the heartbeat last increased]. Members bump their own
+# heartbeat every gossip round and exchange heartbeats with a few random peers, so a heartbeat that
+# stops increasing everywhere means that no one in the mesh has heard from that member.
+self_url, members, fanout, token = '', {}, 3, ''
+
+lock = threading.Lock()
+logger = logging.getLogger('monitor.mesh')
+
+
+def join(raw_self_url, peer_urls, raw_fanout=3, raw_token=''):
+  global self_url, fanout, token
+  now = time.time()
+  with lock:
+    self_url, fanout, token = raw_self_url, raw_fanout, raw_token
+    members.clear()
+    for url in set(peer_urls) | set([self_url]):
+      members[url] = [0, now]
+
+
+def heartbeats():
+  with lock:
+    return dict((url, member[0]) for url, member in members.iteritems())
+
+
+def merge(remote_heartbeats):
+  # Only known members are tracked, so a peer can't add arbitrary URLs to the mesh.
+  now = time.time()
+  with lock:
+    for url, heartbeat in remote_heartbeats.iteritems():
+      member = members.get(url)
+      if member and heartbeat > member[0]:
+        member[0], member[1] = heartbeat, now
+
+
+def gossip(timeout_s):
+  # Deferred until the first round, since the requests stack is slow to import.
+  import requests
+
+  with lock:
+    members[self_url][0] += 1
+    members[self_url][1] = time.time()
+    peer_urls = [url for url in members if url != self_url]
+  sampled_peer_urls = random.sample(peer_urls, min(fanout, len(peer_urls)))
+
+  unreachable_peer_urls = []
+  def exchange(peer_url):
+    try:
+      response = requests.post('%s/mesh/gossip' % peer_url, json={'heartbeats': heartbeats()},
+                               headers={'Authorization': 'Bearer %s' % token}, timeout=timeout_s)
+      response.raise_for_status()
+      merge(response.json()['heartbeats'])
+    except Exception as e:
+      logger.warning('Failed to gossip with "%s": %s', peer_url, e)
+      unreachable_peer_urls.append(peer_url)
+
+  exchangers = [threading.Thread(target=exchange, args=(peer_url,), name='gossip-%s' % i)
+                for i, peer_url in enumerate(sampled_peer_urls)]
+  for exchanger in exchangers:
+    exchanger.start()
+  for exchanger in exchangers:
+    exchanger.join()
+  return unreachable_peer_urls
+
+
+def failed_members(fail_period_s):
+  # Returns (url, seconds since the member was last heard from) for each member that's gone quiet.
+  now = time.time()
+  with lock:
+    return sorted((url, now - member[1]) for url, member in members.iteritems()
+                  if url != self_url and now - member[1] > fail_period_s)
+
+
+def leader(failed_urls):
+  # Every member derives the same leader from the same view, so only one of them alerts.
+  with lock:
+    return min(url for url in members if url not in failed_urls)
+
+
+def leave():
+  global self_url, token
+  with lock:
+    self_url, token = '', ''
+    members.clear()
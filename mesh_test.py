@@ -0,0 +1,70 @@
+import mesh
+import mock
+import mocks
+import requests
+import unittest
+
+
+
+class MeshTest(unittest.TestCase):
+  def setUp(self):
+    self.mock_time = mocks.MockTime()
+    mock.patch('time.time', new=self.mock_time.time).start()
+    mesh.join('http://a.com', ['http://b.com', 'http://c.com', 'http://d.com'], 2, 'secret')
+
+  def tearDown(self):
+    mock.patch.stopall()
+    mesh.leave()
+
+  def test_merge_keeps_newer_heartbeats_of_known_members(self):
+    mesh.merge({'http://b.com': 3, 'http://c.com': 0, 'http://unknown.com': 5})
+    mesh.merge({'http://b.com': 2})
+    self.assertEqual(mesh.heartbeats(), {
+      'http://a.com': 0,
+      'http://b.com': 3,
+      'http://c.com': 0,
+      'http://d.com': 0,
+    })
+
+  def test_failed_members_and_leader(self):
+    self.mock_time.mock_tick(30)
+    mesh.merge({'http://b.com': 1, 'http://d.com': 1})
+    self.mock_time.mock_tick(40)
+    self.assertEqual(mesh.failed_members(60), [('http://c.com', 70.0)])
+    self.assertEqual(mesh.leader([]), 'http://a.com')
+    self.assertEqual(mesh.leader(['http://a.com', 'http://c.com']), 'http://b.com')
+
+  def test_gossip_exchanges_heartbeats_with_random_peers(self):
+    response = requests.Response()
+    response.status_code = 200
+    response.json = lambda: {'heartbeats': {'http://b.com': 4, 'http://c.com': 2}}
+
+    with mock.patch('random.sample', return_value=['http://b.com', 'http://c.com']) as mock_sample:
+      with mock.patch('requests.post', return_value=response) as mock_post:
+        self.assertEqual(mesh.gossip(5), [])
+    mock_sample.assert_called_once_with(mock.ANY, 2)
+    self.assertEqual(sorted(mock_sample.call_args[0][0]),
+                     ['http://b.com', 'http://c.com', 'http://d.com'])
+    mock_post.assert_has_calls([
+      mock.call('http://b.com/mesh/gossip', json={'heartbeats': mock.ANY},
+                headers={'Authorization': 'Bearer secret'}, timeout=5),
+      mock.call('http://c.com/mesh/gossip', json={'heartbeats': mock.ANY},
+                headers={'Authorization': 'Bearer secret'}, timeout=5),
+    ], any_order=True)
+    self.assertEqual(mock_post.call_args[1]['json']['heartbeats']['http://a.com'], 1)
+    self.assertEqual(mesh.heartbeats(), {
+      'http://a.com': 1,
+      'http://b.com': 4,
+      'http://c.com': 2,
+      'http://d.com': 0,
+    })
+
+  def test_gossip_reports_unreachable_peers(self):
+    with mock.patch('random.sample', return_value=['http://b.com']):
+      with mock.patch('requests.post', side_effect=Exception('Connection refused')):
+        self.assertEqual(mesh.gossip(5), ['http://b.com'])
+    self.assertEqual(mesh.heartbeats()['http://b.com'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,141 @@
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+registry = []
+
+
+class Metric(object):
+  type = None
+
+  def __init__(self, name, help, label_names=()):
+    self.name = name
+    self.help = help
+    self.label_names = tuple(label_names)
+    self.children = {}
+    # Only guards child creation; recording on an existing child takes no lock.
+    self.lock = threading.Lock()
+    registry.append(self)
+
+  def labels(self, *label_values):
+    child = self.children.get(label_values)
+    if child is None:
+      with self.lock:
+        child = self.children.get(label_values)
+        if child is None:
+          child = self.children[label_values] = self.new_child()
+    return child
+
+  def new_child(self):
+    raise NotImplementedError()
+
+  def expose(self):
+    yield '# HELP %s %s' % (self.name, self.help)
+    yield '# TYPE %s %s' % (self.name, self.type)
+    for label_values, child in sorted(self.children.items()):
+      for line in child.expose(self.name, zip(self.label_names, label_values)):
+        yield line
+
+
+class Counter(Metric):
+  type = 'counter'
+
+  def new_child(self):
+    return CounterChild()
+
+  def inc(self, amount=1):
+    self.labels().inc(amount)
+
+
+class Gauge(Metric):
+  type = 'gauge'
+
+  def new_child(self):
+    return GaugeChild()
+
+  def set(self, value):
+    self.labels().set(value)
+
+
+class Histogram(Metric):
+  type = 'histogram'
+
+  def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+    super(Histogram, self).__init__(name, help, label_names)
+    self.buckets = tuple(sorted(buckets))
+
+  def new_child(self):
+    return HistogramChild(self.buckets)
+
+  def observe(self, value):
+    self.labels().observe(value)
+
+
+class CounterChild(object):
+  def __init__(self):
+    self.value = 0.0
+
+  def inc(self, amount=1):
+    self.value += amount
+
+  def expose(self, name, labels):
+    yield '%s%s %s' % (name, format_labels(labels), format_value(self.value))
+
+
+class GaugeChild(object):
+  def __init__(self):
+    self.value = 0.0
+
+  def set(self, value):
+    self.value = value
+
+  def expose(self, name, labels):
+    yield '%s%s %s' % (name, format_labels(labels), format_value(self.value))
+
+
+class HistogramChild(object):
+  def __init__(self, buckets):
+    self.buckets = buckets
+    # Preallocated per-bucket (non-cumulative) counts, with a final overflow bucket for +Inf.
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+
+  def expose(self, name, labels):
+    cumulative_count = 0
+    for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+      cumulative_count += count
+      yield '%s_bucket%s %s' % (name, format_labels(labels + [('le', format_value(bound))]),
+                                cumulative_count)
+    yield '%s_sum%s %s' % (name, format_labels(labels), format_value(self.sum))
+    yield '%s_count%s %s' % (name, format_labels(labels), cumulative_count)
+
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (label, escape_label_value(value))
+                           for label, value in labels)
+
+
+def escape_label_value(value):
+  return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value))
+
+
+def expose():
+  return '\n'.join(line for metric in registry for line in metric.expose()) + '\n'
+
+
+def reset():
+  for metric in registry:
+    metric.children.clear()
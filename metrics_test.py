@@ -0,0 +1,70 @@
+import metrics
+import unittest
+
+
+
+class MetricsTest(unittest.TestCase):
+  def setUp(self):
+    self.registry = metrics.registry[:]
+    del metrics.registry[:]
+
+  def tearDown(self):
+    metrics.registry[:] = self.registry
+
+  def test_counter(self):
+    counter = metrics.Counter('test_total', 'A test counter.', ['kind'])
+    counter.labels('a').inc()
+    counter.labels('a').inc(2)
+    counter.labels('b').inc()
+
+    self.assertEqual(metrics.expose(),
+                     '# HELP test_total A test counter.\n'
+                     '# TYPE test_total counter\n'
+                     'test_total{kind="a"} 3.0\n'
+                     'test_total{kind="b"} 1.0\n')
+
+  def test_gauge(self):
+    gauge = metrics.Gauge('test_gauge', 'A test gauge.')
+    gauge.set(5)
+    gauge.set(-1.5)
+
+    self.assertEqual(metrics.expose(),
+                     '# HELP test_gauge A test gauge.\n'
+                     '# TYPE test_gauge gauge\n'
+                     'test_gauge -1.5\n')
+
+  def test_histogram(self):
+    histogram = metrics.Histogram('test_seconds', 'A test histogram.', buckets=[0.1, 1])
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(10)
+
+    self.assertEqual(metrics.expose(),
+                     '# HELP test_seconds A test histogram.\n'
+                     '# TYPE test_seconds histogram\n'
+                     'test_seconds_bucket{le="0.1"} 2\n'
+                     'test_seconds_bucket{le="1.0"} 3\n'
+                     'test_seconds_bucket{le="+Inf"} 4\n'
+                     'test_seconds_sum 10.65\n'
+                     'test_seconds_count 4\n')
+
+  def test_labels_are_reused_and_escaped(self):
+    counter = metrics.Counter('test_total', 'A test counter.', ['kind'])
+    self.assertIs(counter.labels('a'), counter.labels('a'))
+
+    counter.labels('quote " and \\ and \n').inc()
+    self.assertIn(r'test_total{kind="quote \" and \\ and \n"} 1.0', metrics.expose())
+
+  def test_reset(self):
+    counter = metrics.Counter('test_total', 'A test counter.')
+    counter.inc()
+    metrics.reset()
+
+    self.assertEqual(metrics.expose(),
+                     '# HELP test_total A test counter.\n'
+                     '# TYPE test_total counter\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
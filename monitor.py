@@ -1,18 +1,74 @@
 import argparse
+import cProfile
 import collections
 import datetime
+import event_log
 import flask
+import hashlib
+import history
+import hmac
+import jinja2
+import json
 import logging
 import logging.handlers
+import log_index
+import log_queue
+import marshal
+import memory
+import mesh
+import metrics
+import os
+import outbox
+import pstats
 import re
-import requests
+import signal
+import state
+import StringIO
 import sys
 import threading
 import time
 import traceback
+import wsgi_server
 
-name, args, server, poll_fns, poll_timer, silence_timer, is_alive = (
-    '', None, None, [], None, None, False)
+name, args, server, poll_fns, poll_timer, silence_timer, is_alive, poll_id = (
+    '', None, None, [], None, None, False, 0)
+http_server, mesh_timer, is_stopping = None, None, False
+# The arg defs of flags that --config_file and /config may change, and the functions notified when
+# they do.
+reloadable_arg_defs, config_fns, pending_config, config_mtime = [], [], {}, None
+
+FRAGMENT_CACHE_SIZE = 10000
+# The period covered by each /history view, and the size of the buckets it's downsampled into.
+HISTORY_VIEWS = {
+  'hour': (60 * 60, None),
+  'day': (24 * 60 * 60, 5 * 60),
+  'week': (7 * 24 * 60 * 60, 60 * 60),
+}
+LOG_CHUNK_SIZE = 64 * 1024
+SHUTDOWN_GRACE_PERIOD_S = 10
+
+alert_lock, render_lock, profile_lock = threading.Lock(), threading.Lock(), threading.Lock()
+memory_lock = threading.Lock()
+schedule_lock, poll_lock, config_lock = threading.Lock(), threading.Lock(), threading.Lock()
+alert_buckets, suppressed_alerts = {}, collections.Counter()
+templates, fragment_cache = {}, collections.OrderedDict()
+profiler, profile_cycles_left, profile_stats = None, 0, None
+memory_baseline, memory_cycles_left, memory_cycles, memory_report = None, 0, [], None
+restored_alerts = {}
+# The latest poll's results, published to /status as an immutable (JSON, ETag) snapshot that's
+# swapped in whole, so readers never see a partial update or touch the polling thread.
+cycle_details, last_poll_status, status_snapshot = {}, None, None
+cycle_counts, poll_history = collections.Counter(), None
+ready = threading.Event()
+
+poll_duration_s = metrics.Histogram(
+    'monitor_poll_duration_seconds', 'Time spent in each poll function.', ['poll_fn'])
+poll_slack_s = metrics.Gauge(
+    'monitor_poll_slack_seconds', 'Time left in the polling period after the last poll.')
+alerts_total = metrics.Counter(
+    'monitor_alerts_total', 'Alerts by template and outcome.', ['template', 'outcome'])
+mailgun_duration_s = metrics.Histogram(
+    'monitor_mailgun_request_duration_seconds', 'Latency of Mailgun message requests.')
 
 server = flask.Flask(__name__)
 server.config.from_envvar('FLASKR_SETTINGS', silent=True)
@@ -20,11 +76,12 @@ logger = logging.getLogger('monitor')
 
 
 def parse_args(raw_name, raw_description, raw_arg_defs=[], raw_args=sys.argv[1:]):
-  global name, args
+  global name, args, reloadable_arg_defs
   name = raw_name
   parser = argparse.ArgumentParser(description=raw_description)
   name_slug = name.lower().replace(' ', '_')
-  raw_arg_defs += [{
+  # Concatenated rather than extended, which would grow the default list with every call.
+  raw_arg_defs = raw_arg_defs + [{
     'name': 'monitor_url',
     'help': 'The URL by which this monitor can be reached, used for convenience status/management '
             'links in the alert emails',
@@ -33,6 +90,7 @@ def parse_args(raw_name, raw_description, raw_arg_defs=[], raw_args=sys.argv[1:]
     'dest': 'alert_emails',
     'default': ['Cameron Behar <0x24a537r9@gmail.com>'],
     'type': lambda s: re.split(r'\s*,\s*', s),
+    'reloadable': True,
     'help': 'The email addresses to alert if needed',
   }, {
     'name': '--monitor_email',
@@ -44,12 +102,14 @@ def parse_args(raw_name, raw_description, raw_arg_defs=[], raw_args=sys.argv[1:]
     'dest': 'poll_period_s',
     'default': 5 * 60.0,
     'type': float,
+    'reloadable': True,
     'help': 'The period (in seconds) with which to poll for status updates',
   }, {
     'name': '--min_poll_padding_period_s',
     'dest': 'min_poll_padding_period_s',
     'default': 10.0,
     'type': float,
+    'reloadable': True,
     'help': 'The minimum period (in seconds) between when one polling operation finishes and the '
             'next one begins. Used for alerting in case the polling method is slow and in danger '
             'of overrunning the configured --poll_period_s.',
@@ -64,17 +124,152 @@ def parse_args(raw_name, raw_description, raw_arg_defs=[], raw_args=sys.argv[1:]
     'dest': 'mailgun_api_key',
     'default': '',
     'help': 'The API key for the mailgun account used to send alert emails',
+  }, {
+    'name': '--alert_burst',
+    'dest': 'alert_burst',
+    'default': 5,
+    'type': int,
+    'help': 'The maximum number of alerts using the same template that may be sent in a burst '
+            'before rate limiting kicks in',
+  }, {
+    'name': '--alert_refill_period_s',
+    'dest': 'alert_refill_period_s',
+    'default': 5 * 60.0,
+    'type': float,
+    'help': 'The period (in seconds) after which a rate-limited template may send another alert',
+  }, {
+    'name': '--global_alert_burst',
+    'dest': 'global_alert_burst',
+    'default': 20,
+    'type': int,
+    'help': 'The maximum number of alerts across all templates that may be sent in a burst before '
+            'rate limiting kicks in',
+  }, {
+    'name': '--global_alert_refill_period_s',
+    'dest': 'global_alert_refill_period_s',
+    'default': 60.0,
+    'type': float,
+    'help': 'The period (in seconds) after which another alert may be sent once the global alert '
+            'burst has been used up',
+  }, {
+    'name': '--peers',
+    'dest': 'peers',
+    'default': [],
+    'type': lambda s: re.split(r'\s*,\s*', s),
+    'help': 'The URLs of other monitors with which to form a health mesh, in which each monitor '
+            'gossips with a few random peers every --mesh_period_s and one elected member alerts '
+            'if any go quiet. Each should match its monitor_url.',
+  }, {
+    'name': '--mesh_period_s',
+    'dest': 'mesh_period_s',
+    'default': 10.0,
+    'type': float,
+    'help': 'The period (in seconds) between gossip rounds with mesh --peers',
+  }, {
+    'name': '--mesh_fanout',
+    'dest': 'mesh_fanout',
+    'default': 3,
+    'type': int,
+    'help': 'The number of random mesh --peers to gossip with each round',
+  }, {
+    'name': '--mesh_fail_period_s',
+    'dest': 'mesh_fail_period_s',
+    'default': 60.0,
+    'type': float,
+    'help': 'The period (in seconds) after which a mesh peer that no member has heard from is '
+            'considered down',
+  }, {
+    'name': '--mesh_token',
+    'dest': 'mesh_token',
+    'help': 'The bearer token that mesh --peers present to each other\'s /mesh/gossip, which '
+            'refuses gossip without it. Required with --peers.',
+  }, {
+    'name': '--history_size',
+    'dest': 'history_size',
+    'default': 7 * 24 * 60,
+    'type': positive(int),
+    'help': 'The number of poll cycles to keep in the in-memory history served by /history',
+  }, {
+    'name': '--state_file',
+    'dest': 'state_file',
+    'default': '%s.state' % name_slug,
+    'help': 'The SQLite file in which silence state, the polling schedule, recent alerts, and '
+            'per-car verdicts are checkpointed so that restarts resume where they left off',
+  }, {
+    'name': '--config_file',
+    'dest': 'config_file',
+    'help': 'A JSON object of reloadable flags by name (e.g. {"poll_period_s": 600}) that is '
+            'checked for changes before each poll, so that they can be changed without restarting',
+  }, {
+    'name': '--admin_token',
+    'dest': 'admin_token',
+    'help': 'The bearer token that authorizes POST /config requests to change reloadable flags, '
+            'which are refused without one',
   }, {
     'name': '--port',
     'dest': 'port',
     'default': 5000,
     'type': int,
     'help': 'The port to use for the monitoring HTTP server',
+  }, {
+    'name': '--server',
+    'dest': 'server',
+    'default': 'threaded',
+    'choices': ('threaded', 'development'),
+    'help': 'The HTTP server to use: "threaded" serves requests concurrently on a bounded number of '
+            'workers, while "development" serves one request at a time',
+  }, {
+    'name': '--server_workers',
+    'dest': 'server_workers',
+    'default': 8,
+    'type': int,
+    'help': 'The maximum number of requests the threaded HTTP server handles at once. /ok requests '
+            "don't count towards this, so that they're never stuck behind slower requests.",
+  }, {
+    'name': '--server_max_connections',
+    'dest': 'server_max_connections',
+    'default': 64,
+    'type': int,
+    'help': 'The maximum number of connections, each with a thread of its own, that the threaded '
+            'HTTP server keeps open at once, including idle kept-alive ones. Any more get a 503',
+  }, {
+    'name': '--request_timeout_s',
+    'dest': 'request_timeout_s',
+    'default': 30.0,
+    'type': float,
+    'help': 'The period (in seconds) after which a stalled HTTP request, or one waiting for a free '
+            'worker, is abandoned',
+  }, {
+    'name': '--keep_alive_s',
+    'dest': 'keep_alive_s',
+    'default': 5.0,
+    'type': float,
+    'help': 'The period (in seconds) for which idle HTTP connections are kept open for reuse',
   }, {
     'name': '--log_file_prefix',
     'dest': 'log_file_prefix',
     'default': name_slug,
     'help': 'The prefix for the file used for logging',
+  }, {
+    'name': '--outbox_file',
+    'dest': 'outbox_file',
+    'default': '%s.outbox' % name_slug,
+    'help': 'The journal file to which alerts are durably written before sending, and from which '
+            'undelivered alerts are replayed on restart',
+  }, {
+    'name': '--outbox_fsync_period_s',
+    'dest': 'outbox_fsync_period_s',
+    'default': 1.0,
+    'type': float,
+    'help': 'The maximum period (in seconds) for which outbox journal writes are batched before '
+            'being synced to disk',
+  }, {
+    'name': '--log_format',
+    'dest': 'log_format',
+    'default': 'text',
+    'choices': ('text', 'jsonl'),
+    'help': 'The format for log files: "text" writes INFO, WARNING, and ERROR log files, while '
+            '"jsonl" writes each event once to a structured, gzip-rotated events log',
   }, {
     'name': '--log',
     'dest': 'log_level',
@@ -83,73 +278,283 @@ def parse_args(raw_name, raw_description, raw_arg_defs=[], raw_args=sys.argv[1:]
     'choices': (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL),
     'help': 'The logging level to use',
   }]
+  reloadable_arg_defs = []
   for arg_def in raw_arg_defs:
+    if arg_def.pop('reloadable', False):
+      reloadable_arg_defs.append(dict(arg_def))
     parser.add_argument(arg_def.pop('name'), **arg_def)
   args = parser.parse_args(raw_args)
+  if args.peers and not args.mesh_token:
+    # Otherwise anyone could gossip heartbeats for a dead peer and keep it from being reported.
+    parser.error('--mesh_token is required with --peers')
+
+
+class ConfigParser(argparse.ArgumentParser):
+  # Raises a ValueError for any invalid config rather than exiting. argparse only reports TypeErrors
+  # and ValueErrors from a flag's type, so anything else (e.g. a ZeroDivisionError from
+  # --max_query_qps=0) is turned into a ValueError too.
+  def add_argument(self, *raw_args, **kwargs):
+    if 'type' in kwargs:
+      kwargs['type'] = checked_type(kwargs['type'])
+    return argparse.ArgumentParser.add_argument(self, *raw_args, **kwargs)
+
+  def error(self, message):
+    raise ValueError(message)
+
+
+def checked_type(arg_type):
+  def parse_value(arg):
+    try:
+      return arg_type(arg)
+    except Exception as e:
+      raise ValueError(str(e))
+  parse_value.__name__ = getattr(arg_type, '__name__', 'value')
+  return parse_value
+
+
+def positive(arg_type):
+  # Wraps a flag's type to reject zero and negative values, e.g. for sizes and divisors.
+  def parse_positive(arg):
+    value = arg_type(arg)
+    if value <= 0:
+      raise ValueError('%s is not positive' % arg)
+    return value
+  parse_positive.__name__ = 'positive %s' % arg_type.__name__
+  return parse_positive
+
 
+def parse_config(config):
+  # Parses a dict of reloadable flags by name with the flags' own types, raising a ValueError if any
+  # is unknown or invalid. Lists are passed as multiple values, as on the command line.
+  if not isinstance(config, dict):
+    raise ValueError('The config must be a JSON object')
+  parser = ConfigParser()
+  for arg_def in reloadable_arg_defs:
+    arg_def = dict(arg_def, default=argparse.SUPPRESS)
+    arg_name = arg_def.pop('name').lstrip('-')
+    arg_def.setdefault('dest', arg_name)
+    parser.add_argument('--%s' % arg_name, **arg_def)
+  raw_args = []
+  for arg_name, value in config.iteritems():
+    raw_args.append('--%s' % arg_name)
+    raw_args += ['%s' % item for item in (value if isinstance(value, list) else [value])]
+  return vars(parser.parse_args(raw_args))
 
-def start(raw_poll_fns=None):
-  global poll_fns, poll_timer, is_alive
+
+def start(raw_poll_fns=None, raw_config_fns=None):
+  global poll_fns, config_fns, is_alive, http_server, poll_history
   is_alive = True
+  poll_history = history.RingBuffer(args.history_size)
   set_up_logging()
+  load_templates()
+  outbox.open_journal(args.outbox_file, send_email, args.outbox_fsync_period_s)
+  state.open_state(args.state_file)
   if raw_poll_fns:
     poll_fns += raw_poll_fns if isinstance(raw_poll_fns, collections.Iterable) else [raw_poll_fns]
-  # Delay so that the Flask server is up before polling begins.
-  poll_timer = threading.Timer(1, poll)
-  poll_timer.start()
+  if raw_config_fns:
+    config_fns += (raw_config_fns if isinstance(raw_config_fns, collections.Iterable)
+                   else [raw_config_fns])
   if not server.config.get('TESTING'):
-    server.run(port=args.port)
+    # Bind the port up front rather than waiting a fixed delay for the server to come up, so that
+    # the first poll can start as soon as the monitor is reachable.
+    http_server = wsgi_server.make_server(
+        args.server, '127.0.0.1', args.port, server, args.server_workers, args.request_timeout_s,
+        args.keep_alive_s, args.server_max_connections)
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown())
+  if args.peers:
+    mesh.join(args.monitor_url, args.peers, args.mesh_fanout, args.mesh_token)
+    schedule_gossip()
+  # Poll straight away, or resume the previous process's polling schedule if it's restarting.
+  schedule_poll(restore_state())
+  publish_status()
+  ready.set()
+  logger.info('Ready on port %s.', args.port)
+  if http_server:
+    http_server.serve_forever()
+    # Only reached once shutdown() has stopped the server from accepting new connections.
+    http_server.drain(SHUTDOWN_GRACE_PERIOD_S)
+    stop_polling()
+    reset()
+    logging.shutdown()
+
+
+def shutdown():
+  logger.info('Shutting down...')
+  if http_server:
+    # Stopping blocks until the server loop exits, so it can't happen on the loop's own thread
+    # (e.g. from a signal handler).
+    threading.Thread(target=http_server.stop, name='shutdown').start()
+
+
+def stop_polling():
+  # Stops any more cycles from being scheduled and waits for a running one to finish, so that
+  # reset() doesn't pull args out from under it.
+  global is_alive, is_stopping
+  with schedule_lock:
+    is_alive, is_stopping = False, True
+    if poll_timer:
+      poll_timer.cancel()
+    if silence_timer:
+      silence_timer.cancel()
+  with poll_lock:
+    pass
+
+
+def restore_state():
+  now = time.time()
+  restored_alerts.update(state.get('alerts', {}))
+
+  silence_until = state.get('silence_until')
+  if silence_until and silence_until > now:
+    silence(silence_until - now)
+
+  last_poll_time = state.get('last_poll_time')
+  if last_poll_time:
+    return max(0, last_poll_time + args.poll_period_s - now)
+  return 0
 
 
 def set_up_logging():
-  logger.handlers = []  # Clean up past handlers when repeatedly starting up in unit tests.
+  # Clean up past handlers when repeatedly starting up in unit tests.
+  for handler in logger.handlers:
+    handler.close()
+  logger.handlers = []
   logger.setLevel(args.log_level)
+  queue_handler = log_queue.QueueHandler(create_log_handlers())
+  queue_handler.addFilter(PollIdFilter())
+  logger.addHandler(queue_handler)
+
+
+class PollIdFilter(logging.Filter):
+  def filter(self, record):
+    record.poll_id = poll_id
+    return True
+
+
+def create_log_handlers():
   formatter = logging.Formatter('%(levelname)-8s %(asctime)s [%(name)s]: %(message)s')
 
   stdout = logging.StreamHandler(stream=sys.stdout)
   stdout.setLevel(args.log_level)
   stdout.setFormatter(formatter)
-  logger.addHandler(stdout)
 
-  info = logging.handlers.TimedRotatingFileHandler(
+  if args.log_format == 'jsonl':
+    events = event_log.EventLogHandler(
+        '%s.events.jsonl' % args.log_file_prefix, when='d', interval=1, backupCount=7)
+    events.setLevel(logging.INFO)
+    return [stdout, events]
+
+  info = log_index.IndexedFileHandler(
       '%s.INFO.log' % args.log_file_prefix, when='d', interval=1, backupCount=7)
   info.setLevel(logging.INFO)
   info.setFormatter(formatter)
-  logger.addHandler(info)
 
   warning = logging.handlers.TimedRotatingFileHandler(
       '%s.WARNING.log' % args.log_file_prefix, when='d', interval=1, backupCount=7)
   warning.setLevel(logging.WARNING)
   warning.setFormatter(formatter)
-  logger.addHandler(warning)
 
   error = logging.handlers.TimedRotatingFileHandler(
       '%s.ERROR.log' % args.log_file_prefix, when='d', interval=1, backupCount=7)
   error.setLevel(logging.ERROR)
   error.setFormatter(formatter)
-  logger.addHandler(error)
+
+  return [stdout, info, warning, error]
+
+
+def schedule_poll(delay_s):
+  # Replaces any pending poll rather than adding to it, so that there's only ever one polling loop.
+  global poll_timer
+  with schedule_lock:
+    if poll_timer:
+      poll_timer.cancel()
+    if is_stopping:
+      return
+    poll_timer = threading.Timer(delay_s, poll)
+    poll_timer.start()
 
 
 def poll():
-  if not is_alive:
+  # Never let polls overlap. A poll that fires while another is running is dropped, since the
+  # running one schedules the next when it finishes.
+  if not poll_lock.acquire(False):
+    logger.warning('Skipping poll, since another is still running.')
     return
+  try:
+    poll_delay_s = run_poll()
+  finally:
+    poll_lock.release()
+  # Scheduled only once the lock is released, since an overrunning cycle's successor fires straight
+  # away and would otherwise be dropped as overlapping, stopping polling for good.
+  if poll_delay_s is not None:
+    schedule_poll(poll_delay_s)
+
 
+def run_poll():
+  # Returns the delay until the next poll, or None if there shouldn't be one.
+  global poll_id, last_poll_status
+  if not is_alive:
+    return None
+
+  try:
+    apply_config()
+  except Exception:
+    # A bad config must never stop polling, so the previous config is kept.
+    logger.exception('Failed to apply config.')
+  poll_id += 1
+  cycle_details.clear()
+  cycle_counts.clear()
   logger.info('Polling...')
   start_time = time.time()
 
   if not poll_fns:
     logger.critical('No polling poll_fns implemented.')
     raise NotImplementedError('No polling poll_fns implemented.')
+
+  # Only profile when armed via /profile, so unarmed polls pay nothing but this check.
+  cycle_profiler = profiler if profile_cycles_left else None
+  if cycle_profiler:
+    cycle_profiler.enable()
+  # Likewise, memory is only traced when armed via /memory.
+  is_memory_cycle = memory_cycles_left > 0
+  if is_memory_cycle:
+    start_memory_cycle()
+  poll_fn_statuses = []
   for poll_fn in poll_fns:
+    poll_fn_name = getattr(poll_fn, '__name__', type(poll_fn).__name__)
+    poll_fn_start_time = time.time()
+    outcome = 'ok'
     try:
       poll_fn()
     except Exception as e:
+      outcome = 'exception'
+      cycle_counts['errors'] += 1
       traceback_str = ''.join(traceback.format_exception(*sys.exc_info()))
       logger.exception('Unhandled exception in delegate poll function.')
       alert('%s encountered an exception' % name, 'monitor_exception', {'traceback': traceback_str})
+    poll_fn_duration_s = time.time() - poll_fn_start_time
+    poll_duration_s.labels(poll_fn_name).observe(poll_fn_duration_s)
+    poll_fn_statuses.append(
+        {'name': poll_fn_name, 'outcome': outcome, 'duration_s': poll_fn_duration_s})
+  if cycle_profiler:
+    cycle_profiler.disable()
+    finish_profiled_cycle(cycle_profiler)
+
+  poll_latency_s = time.time() - start_time
+  logger.info('Finished polling in %.3fs.', poll_latency_s, extra={'latency_s': poll_latency_s})
+  state.put('last_poll_time', start_time)
+  try:
+    state.checkpoint()
+  except Exception:
+    # Unsaved values stay dirty and are retried at the next checkpoint, so polling carries on.
+    logger.exception('Failed to checkpoint state.')
+  last_poll_status = dict(cycle_details, poll_id=poll_id, start_time=start_time,
+                          duration_s=poll_latency_s, poll_fns=poll_fn_statuses)
+  publish_status()
 
+  poll_delay_s = args.poll_period_s - (time.time() - start_time)
   if is_alive:
-    poll_delay_s = args.poll_period_s - (time.time() - start_time)
+    poll_slack_s.set(poll_delay_s)
     if poll_delay_s < 0:
       logger.error('Overran polling period by %ss.', abs(poll_delay_s))
       alert('%s is overrunning' % name, 'monitor_overrunning',
@@ -159,36 +564,253 @@ def poll():
                      poll_delay_s)
       alert('%s is in danger of overrunning' % name, 'monitor_in_danger_of_overrunning',
             {'poll_delay_s': poll_delay_s, 'poll_period_s': args.poll_period_s})
+  try:
+    poll_history.record(start_time, poll_latency_s, poll_delay_s, cycle_counts['alerts'],
+                        cycle_counts['errors'], cycle_counts['cars'])
+    if is_memory_cycle:
+      finish_memory_cycle()
+  except Exception:
+    # Bookkeeping mustn't stop polling, since the next poll is only scheduled once this returns.
+    logger.exception('Failed to record poll cycle.')
+
+  if is_alive:
+    # Measured again, since sending the alerts above takes time that would otherwise push every
+    # later cycle back.
+    return max(0, args.poll_period_s - (time.time() - start_time))
+  return None
+
+
+def apply_config():
+  # Applies changes to the --config_file and updates from /config between cycles, so that no cycle
+  # sees half of a change.
+  global config_mtime
+  updates = {}
+  if args.config_file:
+    try:
+      mtime = os.path.getmtime(args.config_file)
+      if mtime != config_mtime:
+        config_mtime = mtime
+        with open(args.config_file, 'r') as f:
+          updates.update(parse_config(json.load(f)))
+    except (EnvironmentError, ValueError) as e:
+      logger.error('Failed to load config file "%s": %s', args.config_file, e)
+  with config_lock:
+    updates.update(pending_config)
+    pending_config.clear()
+
+  changes = dict((dest, (getattr(args, dest), value)) for dest, value in updates.iteritems()
+                 if getattr(args, dest) != value)
+  if not changes:
+    return
+  for dest, (old_value, value) in changes.iteritems():
+    setattr(args, dest, value)
+  logger.info('Reloaded %s.', ', '.join(sorted(changes)))
+  for config_fn in config_fns:
+    try:
+      config_fn(changes)
+    except Exception:
+      logger.exception('Failed to apply reloaded %s.', ', '.join(sorted(changes)))
+
+
+def report_status(key, value):
+  # Lets poll functions add JSON-serializable details to the current cycle's /status snapshot.
+  cycle_details[key] = value
+
+
+def add_cycle_count(key, count=1):
+  # Lets poll functions add to the current cycle's 'errors' and 'cars' counts in /history.
+  cycle_counts[key] += count
+
+
+def publish_status():
+  global status_snapshot
+  body = json.dumps({'name': name, 'silenced': not is_alive, 'last_poll': last_poll_status},
+                    sort_keys=True)
+  status_snapshot = (body, hashlib.sha1(body).hexdigest())
+
+
+def schedule_gossip():
+  # Gossip runs on its own timer, so that silenced or slow-polling monitors still heartbeat.
+  global mesh_timer
+  mesh_timer = threading.Timer(args.mesh_period_s, gossip)
+  mesh_timer.start()
+
+
+def gossip():
+  try:
+    mesh.gossip(args.mesh_period_s)
+    failed_peers = mesh.failed_members(args.mesh_fail_period_s)
+    leader = mesh.leader([url for url, quiet_s in failed_peers])
+    if failed_peers:
+      logger.error('Mesh peers are down: %s', ', '.join(url for url, quiet_s in failed_peers))
+    # Only the elected leader alerts, so a failure produces one alert rather than one per member.
+    if failed_peers and leader == args.monitor_url and is_alive:
+      alert('%s mesh peer(s) down' % len(failed_peers), 'mesh_peers_down',
+            {'failed_peers': failed_peers})
+  except Exception:
+    logger.exception('Failed to gossip with mesh peers.')
+  finally:
+    if mesh_timer:
+      schedule_gossip()
 
-    global poll_timer
-    poll_timer = threading.Timer(max(0, poll_delay_s), poll)
-    poll_timer.start()
 
+def arm_profiler(cycles):
+  global profiler, profile_cycles_left, profile_stats
+  with profile_lock:
+    profiler, profile_cycles_left, profile_stats = cProfile.Profile(), cycles, None
+  logger.info('Profiling the next %s poll cycle(s).', cycles)
+
+
+def finish_profiled_cycle(cycle_profiler):
+  global profiler, profile_cycles_left, profile_stats
+  with profile_lock:
+    # Ignore cycles profiled by a profiler that has since been re-armed.
+    if cycle_profiler is not profiler:
+      return
+    profile_cycles_left -= 1
+    if profile_cycles_left <= 0:
+      profile_stats = pstats.Stats(profiler)
+      profiler, profile_cycles_left = None, 0
+      logger.info('Finished profiling.')
+
+
+def arm_memory_tracing(cycles):
+  global memory_baseline, memory_cycles_left, memory_cycles, memory_report
+  with memory_lock:
+    memory_baseline, memory_cycles_left, memory_cycles, memory_report = None, cycles, [], None
+  logger.info('Tracing memory over the next %s poll cycle(s).', cycles)
+
+
+def start_memory_cycle():
+  global memory_baseline
+  with memory_lock:
+    if not memory_baseline:
+      memory_baseline = memory.Snapshot(keep_ids=True)
+
+
+def finish_memory_cycle():
+  global memory_baseline, memory_cycles_left, memory_cycles, memory_report
+  with memory_lock:
+    # Ignore cycles traced from a baseline that has since been re-armed.
+    if not memory_baseline:
+      return
+    snapshot = memory.Snapshot()
+    memory_cycles.append((poll_id, snapshot.rss_bytes, len(snapshot)))
+    memory_cycles_left -= 1
+    if memory_cycles_left <= 0:
+      memory_report = {
+        'baseline': (memory_baseline.rss_bytes, len(memory_baseline)),
+        'cycles': memory_cycles,
+        'growth': snapshot.compare_to(memory_baseline),
+        'retainers': memory.find_retainers(memory_baseline),
+        'counts': snapshot.counts.most_common(30),
+      }
+      memory_baseline, memory_cycles_left, memory_cycles = None, 0, []
+      logger.info('Finished tracing memory.')
+
+
+def alert(subject, template, template_args=None):
+  if template[-5:] != '.html':
+    template += '_alert.html'
+  # Rate limit before rendering so that suppressed alerts cost next to nothing.
+  with alert_lock:
+    if not consume_alert_tokens(template):
+      suppressed_alerts[subject] += 1
+      alerts_total.labels(template, 'suppressed').inc()
+      logger.warning('Rate limited alert: "%s"', subject)
+      return
+    suppressed_alert_counts = sorted(suppressed_alerts.iteritems())
+    suppressed_alerts.clear()
 
-def alert(subject, template, template_args={}):
   logger.info('Sending alert: "%s"', subject)
+  template_args = dict(template_args or {},
+                       monitor_name=name,
+                       monitor_url=args.monitor_url,
+                       suppressed_alert_counts=suppressed_alert_counts)
   try:
-    if template[-5:] != '.html':
-      template += '_alert.html'
-    template_args.update({
-      'monitor_name': name,
-      'monitor_url': args.monitor_url,
-    })
-    with server.app_context():
-      requests.post(
-          args.mailgun_messages_url,
-          auth=('api', args.mailgun_api_key),
-          data={
-            'from': args.monitor_email,
-            'to': ', '.join(args.alert_emails),
-            'subject': '[ALERT] %s' % subject,
-            'html': flask.render_template(template, **template_args),
-          },
-          timeout=10)
+    html = render_template(template, template_args)
   except:
     traceback_str = ''.join(traceback.format_exception(*sys.exc_info()))
-    logger.exception('Failed to send alert "%s" with template "%s" and args: %s' %
+    logger.exception('Failed to render alert "%s" with template "%s" and args: %s' %
                      (subject, template, template_args))
+    alerts_total.labels(template, 'failed').inc()
+    return
+
+  # Don't repeat an alert that the previous process already sent before restarting.
+  digest = hashlib.sha1(html.encode('utf-8')).hexdigest()
+  restored_alert = restored_alerts.pop(template, None)
+  if (restored_alert and restored_alert[0] == digest and
+      time.time() - restored_alert[1] < args.poll_period_s):
+    logger.info('Skipping alert "%s", which was already sent before restarting.', subject)
+    # Nothing was sent, so the tokens and the suppressed alerts' summary carry over to the next.
+    with alert_lock:
+      refund_alert_tokens(template)
+      suppressed_alerts.update(dict(suppressed_alert_counts))
+    return
+  # Persisted by the end-of-poll checkpoint rather than on every alert.
+  state.put('alerts', dict(state.get('alerts', {}), **{template: (digest, time.time())}))
+
+  # Journal the alert so that it survives Mailgun outages and restarts, then leave sending to the
+  # outbox's sender rather than waiting on Mailgun here.
+  try:
+    outbox.put({
+      'from': args.monitor_email,
+      'to': ', '.join(args.alert_emails),
+      'subject': '[ALERT] %s' % subject,
+      'html': html,
+    })
+    outbox.wake()
+  except Exception:
+    # Alerts are sent from the polling thread, which mustn't stop over one that can't be queued.
+    logger.exception('Failed to queue alert "%s".', subject)
+    alerts_total.labels(template, 'failed').inc()
+    return
+  cycle_counts['alerts'] += 1
+  alerts_total.labels(template, 'queued').inc()
+
+
+def consume_alert_tokens(template):
+  now = time.time()
+  buckets = [
+    (template, args.alert_burst, args.alert_refill_period_s),
+    ('', args.global_alert_burst, args.global_alert_refill_period_s),
+  ]
+  tokens = {}
+  for key, burst, refill_period_s in buckets:
+    bucket_tokens, last_time = alert_buckets.get(key, (burst, now))
+    tokens[key] = min(burst, bucket_tokens + (now - last_time) / refill_period_s)
+    alert_buckets[key] = (tokens[key], now)
+  if any(bucket_tokens < 1 for bucket_tokens in tokens.itervalues()):
+    return False
+  for key, bucket_tokens in tokens.iteritems():
+    alert_buckets[key] = (bucket_tokens - 1, now)
+  return True
+
+
+def refund_alert_tokens(template):
+  for key, burst in ((template, args.alert_burst), ('', args.global_alert_burst)):
+    bucket_tokens, last_time = alert_buckets[key]
+    alert_buckets[key] = (min(burst, bucket_tokens + 1), last_time)
+
+
+def send_email(data):
+  # Deferred, since the requests stack is slow to import and isn't needed until the first alert.
+  import requests
+  start_time = time.time()
+  try:
+    response = requests.post(
+        args.mailgun_messages_url,
+        auth=('api', args.mailgun_api_key),
+        data=data,
+        timeout=10)
+  finally:
+    mailgun_duration_s.observe(time.time() - start_time)
+  # Mailgun won't accept a message it rejected with a 4xx however often it's retried, except when
+  # rate limiting or timing out the request.
+  if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+    raise outbox.PermanentError('Mailgun responded with a %s: "%s"' %
+                                (response.status_code, response.text))
+  response.raise_for_status()
 
 
 def silence(duration_s):
@@ -199,6 +821,9 @@ def silence(duration_s):
   is_alive = False
   silence_timer = threading.Timer(duration_s, unsilence)
   silence_timer.start()
+  state.put('silence_until', time.time() + duration_s)
+  state.checkpoint()
+  publish_status()
   logger.info('Silenced for %ss.', duration_s)
 
 
@@ -212,39 +837,113 @@ def unsilence():
 
   logger.info('Unsilenced.')
   is_alive = True
-  poll()
+  state.delete('silence_until')
+  state.checkpoint()
+  publish_status()
+  # Poll on the polling thread rather than the caller's, e.g. an HTTP request that shouldn't wait
+  # for a whole cycle.
+  schedule_poll(0)
   return True
 
 
-def render_page(template, title, template_args={}):
+def render_page(template, title, template_args=None):
+  if template[-5:] != '.html':
+    template += '_page.html'
+  template_args = dict(template_args or {},
+                       monitor_name=name,
+                       monitor_url=args.monitor_url,
+                       title=title)
   try:
-    if template[-5:] != '.html':
-      template += '_page.html'
-    template_args.update({
-      'monitor_name': name,
-      'monitor_url': args.monitor_url,
-      'title': title,
-    })
-    return flask.render_template(template, **template_args)
+    return render_template(template, template_args)
   except:
     traceback_str = ''.join(traceback.format_exception(*sys.exc_info()))
     logger.exception('Failed to render template "%s" with args: %s' % (template, template_args))
-    return flask.render_template(
-        'error_page.html',
-        monitor_name=name,
-        title='Error',
-        message='Failed to render template "%s" with args: %s' % (template, template_args),
-        traceback=traceback_str)
+    return render_template('error_page.html', {
+      'monitor_name': name,
+      'title': 'Error',
+      'message': 'Failed to render template "%s" with args: %s' % (template, template_args),
+      'traceback': traceback_str,
+    })
+
+
+def stream_page(template, title, template_args=None):
+  # Like render_page, but streams the page as it's generated so large pages use constant memory.
+  if template[-5:] != '.html':
+    template += '_page.html'
+  template_args = dict(template_args or {},
+                       monitor_name=name,
+                       monitor_url=args.monitor_url,
+                       title=title)
+  return flask.Response(get_template(template).generate(**template_args))
+
+
+def load_templates():
+  # Compile every template up front so that alerts and pages never pay for parsing.
+  server.jinja_env.globals['render_fragment'] = render_fragment
+  for template in server.jinja_env.list_templates(extensions=['html']):
+    get_template(template)
+
+
+def get_template(template):
+  compiled_template = templates.get(template)
+  if not compiled_template:
+    compiled_template = templates[template] = server.jinja_env.get_template(template)
+  return compiled_template
+
+
+def render_template(template, template_args):
+  # Renders directly from the compiled template, avoiding an app context push per render.
+  return get_template(template).render(**template_args)
+
+
+def render_fragment(template, key, **template_args):
+  cache_key = (template, key)
+  with render_lock:
+    fragment = fragment_cache.pop(cache_key, None)
+    if fragment is not None:
+      fragment_cache[cache_key] = fragment
+      return fragment
+
+  fragment = jinja2.Markup(render_template(template, template_args))
+  with render_lock:
+    fragment_cache[cache_key] = fragment
+    while len(fragment_cache) > FRAGMENT_CACHE_SIZE:
+      fragment_cache.popitem(last=False)
+  return fragment
 
 
 def reset():
-  global name, args, poll_fns, poll_timer, silence_timer, is_alive
+  global name, args, poll_fns, poll_timer, silence_timer, is_alive, poll_id, http_server, mesh_timer
+  global is_stopping
+  global profiler, profile_cycles_left, profile_stats, last_poll_status, status_snapshot
+  global poll_history, reloadable_arg_defs, config_fns, config_mtime
+  global memory_baseline, memory_cycles_left, memory_cycles, memory_report
   if poll_timer:
     poll_timer.cancel()
   if silence_timer:
     silence_timer.cancel()
-  name, args, poll_fns, poll_timer, silence_timer, is_alive = (
-      '', None, [], None, None, False)
+  if mesh_timer:
+    mesh_timer.cancel()
+  mesh.leave()
+  ready.clear()
+  outbox.close()
+  state.close()
+  restored_alerts.clear()
+  alert_buckets.clear()
+  suppressed_alerts.clear()
+  fragment_cache.clear()
+  cycle_details.clear()
+  last_poll_status, status_snapshot = None, None
+  cycle_counts.clear()
+  poll_history = None
+  reloadable_arg_defs, config_fns, config_mtime = [], [], None
+  pending_config.clear()
+  metrics.reset()
+  profiler, profile_cycles_left, profile_stats = None, 0, None
+  memory_baseline, memory_cycles_left, memory_cycles, memory_report = None, 0, [], None
+  name, args, poll_fns, poll_timer, silence_timer, is_alive, poll_id, http_server, mesh_timer = (
+      '', None, [], None, None, False, 0, None, None)
+  is_stopping = False
 
 
 @server.route('/ok')
@@ -275,11 +974,56 @@ def handle_unsilence():
 
 @server.route('/args')
 def handle_args():
-  sorted_args = sorted(vars(args).iteritems(), key=lambda item: item[0])
+  # The admin token is hidden, since anyone who can see this page could otherwise use it.
+  sorted_args = sorted(dict(vars(args), admin_token=args.admin_token and '***',
+                            mesh_token=args.mesh_token and '***').iteritems(),
+                       key=lambda item: item[0])
   logger.info('\n'.join('%s=%s' % arg_value for arg_value in sorted_args))
   return render_page('args', 'Args', {'args': sorted_args})
 
 
+@server.route('/logs/search')
+def handle_logs_search():
+  query = flask.request.args
+  level = query.get('level', 'INFO').upper()
+  if not level in ('INFO', 'WARNING', 'ERROR'):
+    logger.error('Received invalid log level: "%s"', level)
+    return render_page('error', 'Error', {'message': 'Invalid log level: "%s". Choose between '
+                                                     '"INFO", "WARNING", or "ERROR".' % level})
+  try:
+    start_time, end_time = (parse_search_time(query.get(bound)) for bound in ('start', 'end'))
+  except ValueError:
+    return render_page('error', 'Error', {'message': 'Invalid search time. Use "YYYY-MM-DD" or '
+                                                     '"YYYY-MM-DD HH:MM:SS".'})
+
+  for handler in logger.handlers:
+    handler.flush()
+  index_handler = next(handler for queue_handler in logger.handlers
+                       for handler in queue_handler.handlers
+                       if isinstance(handler, log_index.IndexedFileHandler))
+  results = index_handler.search(car_id=query.get('car_id', type=int),
+                                 start_time=start_time,
+                                 end_time=end_time,
+                                 text=query.get('q'),
+                                 min_level=getattr(logging, level),
+                                 limit=query.get('limit', 1000, type=int))
+  return stream_page('logs_search', 'Log search', {
+    'query': query,
+    'results': ((path, record.decode('utf-8', 'replace')) for path, record in results),
+  })
+
+
+def parse_search_time(search_time):
+  if not search_time:
+    return None
+  for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+    try:
+      return time.mktime(time.strptime(search_time, time_format))
+    except ValueError:
+      pass
+  raise ValueError('Invalid search time: "%s"' % search_time)
+
+
 @server.route('/logs')
 @server.route('/logs/<level>')
 def handle_logs(level='INFO'):
@@ -291,18 +1035,261 @@ def handle_logs(level='INFO'):
 
   for handler in logger.handlers:
     handler.flush()
-  with open('%s.%s.log' % (args.log_file_prefix, level), 'r') as f:
-    logs_data = f.read()
-  return render_page('logs', '%s logs' % level, {'logs_data': logs_data})
+  line_filter = None
+  if args.log_format == 'jsonl':
+    # Events are written once, so level-filtered views are computed as the log is read.
+    min_level = getattr(logging, level)
+    line_filter = lambda line: event_log.filter_events(line, min_level)
+    f = open('%s.events.jsonl' % args.log_file_prefix, 'r')
+  else:
+    f = open('%s.%s.log' % (args.log_file_prefix, level), 'r')
+
+  range_header = flask.request.headers.get('Range')
+  if range_header and line_filter:
+    # Byte ranges would skip the level filter, returning other levels' events.
+    f.close()
+    return flask.Response('Range requests aren\'t supported for JSONL logs, since they can\'t be '
+                          'filtered by level. Use ?tail or ?offset instead.', status=400)
+  if range_header:
+    return stream_log_range(f, range_header)
+
+  tail = flask.request.args.get('tail', type=int)
+  offset = flask.request.args.get('offset', 0, type=int)
+  limit = flask.request.args.get('limit', type=int)
+  if tail is not None:
+    offset = find_tail_offset(f, max(0, tail), line_filter)
+  cursor = {'next_offset': None}
+  return stream_page('logs', '%s logs' % level, {
+    'logs_chunks': read_log_chunks(f, offset, limit, cursor, line_filter),
+    'cursor': cursor,
+    'limit': limit,
+  })
+
+
+def find_tail_offset(f, lines, line_filter=None):
+  # Scan backwards from the end of the file, skipping the final line's trailing newline. Only lines
+  # passing the filter are counted, with lines split across blocks carried over in line_tail.
+  f.seek(0, 2)
+  end_offset = f.tell()
+  if not lines:
+    return end_offset
+  position = max(0, end_offset - 1)
+  line_tail = ''
+  while position > 0:
+    block_offset = max(0, position - LOG_CHUNK_SIZE)
+    f.seek(block_offset)
+    block = f.read(position - block_offset)
+    index = len(block)
+    while True:
+      newline_index = block.rfind('\n', 0, index)
+      if newline_index < 0:
+        break
+      if not line_filter or line_filter(block[newline_index + 1:index] + line_tail):
+        lines -= 1
+        if not lines:
+          return block_offset + newline_index + 1
+      line_tail = ''
+      index = newline_index
+    line_tail = block[:index] + line_tail if line_filter else ''
+    position = block_offset
+  return 0
+
+
+def read_log_chunks(f, offset, limit, cursor, line_filter=None):
+  try:
+    # Align arbitrary offsets to the start of the next line.
+    if offset > 0:
+      f.seek(offset - 1)
+      if f.read(1) != '\n':
+        f.readline()
+    else:
+      f.seek(0)
+
+    chunk, chunk_size, line_count = [], 0, 0
+    while limit is None or line_count < limit:
+      line = f.readline()
+      if not line:
+        break
+      if line_filter and not line_filter(line):
+        continue
+      chunk.append(line)
+      chunk_size += len(line)
+      line_count += 1
+      if chunk_size >= LOG_CHUNK_SIZE:
+        yield ''.join(chunk).decode('utf-8', 'replace')
+        chunk, chunk_size = [], 0
+    if chunk:
+      yield ''.join(chunk).decode('utf-8', 'replace')
+    if limit is not None and line_count >= limit:
+      next_offset = f.tell()
+      if f.read(1):
+        cursor['next_offset'] = next_offset
+  finally:
+    f.close()
+
+
+def stream_log_range(f, range_header):
+  f.seek(0, 2)
+  size = f.tell()
+  range_match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+  if not range_match or not any(range_match.groups()):
+    f.close()
+    return flask.Response(status=416, headers={'Content-Range': 'bytes */%s' % size})
+
+  start, end = range_match.groups()
+  if not start:
+    # A suffix range, e.g. "bytes=-500" for the last 500 bytes.
+    start, end = max(0, size - int(end)), size - 1
+  else:
+    start, end = int(start), min(size - 1, int(end) if end else size - 1)
+  if start > end:
+    f.close()
+    return flask.Response(status=416, headers={'Content-Range': 'bytes */%s' % size})
+
+  def read_range():
+    try:
+      f.seek(start)
+      remaining = end - start + 1
+      while remaining > 0:
+        data = f.read(min(LOG_CHUNK_SIZE, remaining))
+        if not data:
+          break
+        remaining -= len(data)
+        yield data
+    finally:
+      f.close()
+
+  return flask.Response(read_range(), status=206, mimetype='text/plain', headers={
+    'Accept-Ranges': 'bytes',
+    'Content-Range': 'bytes %s-%s/%s' % (start, end, size),
+    'Content-Length': str(end - start + 1),
+  })
+
+
+@server.route('/status')
+def handle_status():
+  snapshot = status_snapshot
+  if not snapshot:
+    flask.abort(503)
+  body, etag = snapshot
+  if flask.request.if_none_match.contains(etag):
+    response = flask.Response(status=304)
+  else:
+    response = flask.Response(body, mimetype='application/json')
+  response.set_etag(etag)
+  response.headers['Cache-Control'] = 'no-cache'
+  return response
+
+
+@server.route('/history')
+@server.route('/history/<view>')
+def handle_history(view='hour'):
+  if view not in HISTORY_VIEWS or not poll_history:
+    flask.abort(404)
+  period_s, bucket_s = HISTORY_VIEWS[view]
+  since = time.time() - period_s
+  cycles = (poll_history.downsample(bucket_s, since) if bucket_s else poll_history.cycles(since))
+  return flask.Response(json.dumps({'view': view, 'bucket_s': bucket_s, 'cycles': cycles}),
+                        mimetype='application/json')
+
+
+def is_authorized(token):
+  # Compared in constant time, so that the token can't be guessed from response times.
+  authorization = flask.request.headers.get('Authorization', '').encode('utf-8')
+  return hmac.compare_digest(authorization, 'Bearer %s' % token)
+
+
+@server.route('/mesh/gossip', methods=['POST'])
+def handle_mesh_gossip():
+  if not mesh.members:
+    flask.abort(404)
+  if not is_authorized(args.mesh_token):
+    logger.warning('Refused unauthorized mesh gossip.')
+    flask.abort(401)
+  mesh.merge(flask.request.get_json(force=True).get('heartbeats', {}))
+  return flask.jsonify(heartbeats=mesh.heartbeats())
+
+
+@server.route('/mesh')
+def handle_mesh():
+  if not mesh.members:
+    flask.abort(404)
+  failed_peers = mesh.failed_members(args.mesh_fail_period_s)
+  return flask.jsonify(heartbeats=mesh.heartbeats(), failed_peers=failed_peers,
+                       leader=mesh.leader([url for url, quiet_s in failed_peers]))
+
+
+@server.route('/config', methods=['POST'])
+def handle_config():
+  # Queues changes to reloadable flags, given as a JSON object like --config_file's, to be applied
+  # before the next poll.
+  if not args.admin_token:
+    flask.abort(403)
+  if not is_authorized(args.admin_token):
+    logger.warning('Refused unauthorized config update.')
+    flask.abort(401)
+  try:
+    updates = parse_config(json.loads(flask.request.get_data()))
+  except ValueError as e:
+    return flask.jsonify(error=str(e)), 400
+  with config_lock:
+    pending_config.update(updates)
+  logger.info('Queued config update of %s.', ', '.join(sorted(updates)))
+  return flask.jsonify(pending=sorted(updates)), 202
+
+
+@server.route('/metrics')
+def handle_metrics():
+  return flask.Response(metrics.expose(), mimetype='text/plain; version=0.0.4')
+
+
+@server.route('/profile')
+@server.route('/profile/<int:cycles>')
+def handle_profile(cycles=None):
+  if cycles is not None:
+    arm_profiler(max(1, cycles))
+
+  stats_data = ''
+  with profile_lock:
+    if profile_stats:
+      stream = StringIO.StringIO()
+      profile_stats.stream = stream
+      profile_stats.sort_stats('cumulative').print_stats(50)
+      profile_stats.print_callers(20)
+      stats_data = stream.getvalue()
+  return render_page('profile', 'Profile', {
+    'cycles_left': profile_cycles_left,
+    'stats_data': stats_data,
+  })
+
+
+@server.route('/profile.pstats')
+def handle_profile_download():
+  if not profile_stats:
+    flask.abort(404)
+  response = flask.Response(marshal.dumps(profile_stats.stats),
+                            mimetype='application/octet-stream')
+  response.headers['Content-Disposition'] = (
+      'attachment; filename=%s.pstats' % args.log_file_prefix.split('/')[-1])
+  return response
+
+
+@server.route('/memory')
+@server.route('/memory/<int:cycles>')
+def handle_memory(cycles=None):
+  if cycles is not None:
+    arm_memory_tracing(max(1, cycles))
+  return render_page('memory', 'Memory', {
+    'rss_bytes': memory.rss_bytes(),
+    'cycles_left': memory_cycles_left,
+    'report': memory_report,
+  })
 
 
 @server.route('/kill')
 def handle_kill():
-  logger.info('Received kill request. Shutting down...')
-  func = flask.request.environ.get('werkzeug.server.shutdown')
-  if func is None:
+  if not http_server:
     flask.abort(404)
-  func()
-  reset()
-  logging.shutdown()
-  exit(-1)
+  logger.info('Received kill request.')
+  shutdown()
+  return 'Shutting down...'
@@ -1,9 +1,16 @@
 import io
+import json
 import logging
 import mock
 import mocks
 import monitor
+import os
 import re
+import requests
+import shutil
+import sqlite3
+import tempfile
+import threading
 import time
 import unittest
 
@@ -18,7 +25,23 @@ class MonitorTest(unittest.TestCase):
   def tearDown(self):
     self.server = None
     mock.patch.stopall()
+    state_file = monitor.args and monitor.args.state_file
+    outbox_file = monitor.args and monitor.args.outbox_file
     monitor.reset()
+    for path in (state_file, outbox_file, outbox_file and '%s.dead' % outbox_file):
+      if path and os.path.exists(path):
+        os.remove(path)
+
+  def send_alerts(self):
+    # Alerts are sent by the outbox's sender pass rather than by alert() itself.
+    if monitor.outbox.retry_timer:
+      monitor.outbox.retry_timer.mock_tick(0)
+
+  def test_parse_args_with_empty_history(self):
+    with self.assertRaises(SystemExit) as e:
+      monitor.parse_args('Test monitor', 'Test description', [],
+                         ['http://test.com', '--history_size=0'])
+    self.assertEqual(e.exception.code, 2)
 
   def test_parse_args_defaults(self):
     monitor.parse_args('Test monitor', 'Test description', [], ['http://test.com'])
@@ -33,8 +56,26 @@ class MonitorTest(unittest.TestCase):
                      '.org/messages')
     self.assertEqual(monitor.args.mailgun_api_key, '')
     self.assertEqual(monitor.args.port, 5000)
+    self.assertEqual(monitor.args.server, 'threaded')
+    self.assertEqual(monitor.args.server_workers, 8)
+    self.assertEqual(monitor.args.server_max_connections, 64)
+    self.assertEqual(monitor.args.request_timeout_s, 30.0)
+    self.assertEqual(monitor.args.keep_alive_s, 5.0)
     self.assertEqual(monitor.args.log_file_prefix, 'test_monitor')
     self.assertEqual(monitor.args.log_level, logging.INFO)
+    self.assertEqual(monitor.args.outbox_file, 'test_monitor.outbox')
+    self.assertEqual(monitor.args.outbox_fsync_period_s, 1.0)
+    self.assertEqual(monitor.args.alert_burst, 5)
+    self.assertEqual(monitor.args.alert_refill_period_s, 300.0)
+    self.assertEqual(monitor.args.global_alert_burst, 20)
+    self.assertEqual(monitor.args.global_alert_refill_period_s, 60.0)
+    self.assertEqual(monitor.args.log_format, 'text')
+    self.assertEqual(monitor.args.state_file, 'test_monitor.state')
+    self.assertEqual(monitor.args.history_size, 7 * 24 * 60)
+    self.assertEqual(monitor.args.peers, [])
+    self.assertEqual(monitor.args.mesh_period_s, 10.0)
+    self.assertEqual(monitor.args.mesh_fanout, 3)
+    self.assertEqual(monitor.args.mesh_fail_period_s, 60.0)
 
   def test_parse_args_with_complex_args(self):
     monitor.parse_args('Test monitor', 'Test description', [], [
@@ -95,10 +136,8 @@ class MonitorTest(unittest.TestCase):
     ])
     monitor.start()
 
-    monitor.poll_timer.mock_tick(0.5)
-
     with self.assertRaises(NotImplementedError):
-      monitor.poll_timer.mock_tick(0.5)
+      monitor.poll_timer.mock_tick(0)
 
   def test_polling_with_one_poll_fn(self):
     poll = mock.Mock()
@@ -109,11 +148,9 @@ class MonitorTest(unittest.TestCase):
     ])
     monitor.start(poll)
 
+    self.assertTrue(monitor.ready.is_set())
     poll.assert_not_called()
-    monitor.poll_timer.mock_tick(0.5)
-    poll.assert_not_called()
-
-    monitor.poll_timer.mock_tick(0.5)
+    monitor.poll_timer.mock_tick(0)
     poll.assert_called_once()
 
     for i in xrange(3):
@@ -135,11 +172,7 @@ class MonitorTest(unittest.TestCase):
 
     poll_0.assert_not_called()
     poll_1.assert_not_called()
-    monitor.poll_timer.mock_tick(0.5)
-    poll_0.assert_not_called()
-    poll_1.assert_not_called()
-
-    monitor.poll_timer.mock_tick(0.5)
+    monitor.poll_timer.mock_tick(0)
     poll_0.assert_called_once()
     poll_1.assert_called_once()
 
@@ -173,6 +206,7 @@ class MonitorTest(unittest.TestCase):
         monitor.start(slow_operation)
 
         monitor.poll_timer.mock_tick(1)
+        self.send_alerts()
         mock_post.assert_called_once_with(
             'http://test.com/send_email',
             auth=('api', '1234567890'),
@@ -206,6 +240,7 @@ class MonitorTest(unittest.TestCase):
         monitor.start(slow_operation)
 
         monitor.poll_timer.mock_tick(1)
+        self.send_alerts()
         mock_post.assert_called_once_with(
             'http://test.com/send_email',
             auth=('api', '1234567890'),
@@ -220,6 +255,31 @@ class MonitorTest(unittest.TestCase):
         self.assertIn('the polling method is taking only 2.0s less than the polling period',
                       filtered_html)
 
+  def test_polling_schedule_excludes_alert_time(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      def slow_operation():
+        mock_time.mock_tick(8)
+
+      def slow_send(*args, **kwargs):
+        mock_time.mock_tick(1)
+        return mock.Mock(status_code=200)
+
+      with mock.patch('requests.post', side_effect=slow_send) as mock_post:
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+          'http://test.com',
+          '--poll_period_s=10',
+          '--min_poll_padding_period_s=5',
+        ])
+        monitor.start(slow_operation)
+
+        # The alert is sent by the outbox's sender afterwards, not on the polling thread.
+        monitor.poll_timer.mock_tick(0)
+        self.assertEqual(monitor.poll_timer.seconds, 2)
+        mock_post.assert_not_called()
+        self.send_alerts()
+        self.assertEqual(mock_post.call_count, 1)
+
   def test_polling_unhandled_exception_alert(self):
     def unhandled_exception():
       raise Exception('unhandled exception')
@@ -237,6 +297,7 @@ class MonitorTest(unittest.TestCase):
       monitor.start(unhandled_exception)
 
       monitor.poll_timer.mock_tick(1)
+      self.send_alerts()
       mock_post.assert_called_once_with(
           'http://test.com/send_email',
           auth=('api', '1234567890'),
@@ -257,7 +318,7 @@ class MonitorTest(unittest.TestCase):
       filtered_html = re.sub(r'File\s&#34;[^&]+&#34;', 'File &#34;/home/script.py&#34;', filtered_html)
       self.assertIn('Unhandled exception in Test monitor\'s poll function:', filtered_html)
       self.assertIn('Traceback (most recent call last): '
-                    'File &#34;/home/script.py&#34;, line #, in poll '
+                    'File &#34;/home/script.py&#34;, line #, in run_poll '
                     'poll_fn() '
                     'File &#34;/home/script.py&#34;, line #, in unhandled_exception '
                     'raise Exception(&#39;unhandled exception&#39;) '
@@ -277,6 +338,8 @@ class MonitorTest(unittest.TestCase):
       monitor.start(lambda: None)
 
       monitor.alert('Test subject', 'test', {'a': 'string'})
+      mock_post.assert_not_called()
+      self.send_alerts()
 
       mock_post.assert_called_once_with(
           'http://test.com/send_email',
@@ -294,6 +357,141 @@ class MonitorTest(unittest.TestCase):
       self.assertIn('Silence this alert for', filtered_html)
       self.assertIn('Unsilence this alert', filtered_html)
 
+  def test_alert_retries_after_failed_send(self):
+    with mock.patch('requests.post', side_effect=Exception('Mailgun is down')) as mock_post:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--mailgun_messages_url=http://test.com/send_email',
+        '--outbox_file=/tmp/test_monitor.outbox',
+      ])
+      monitor.start(lambda: None)
+
+      monitor.alert('Test subject', 'test', {'a': 'string'})
+      self.send_alerts()
+      self.assertEqual(mock_post.call_count, 1)
+      self.assertEqual(len(monitor.outbox.entries), 1)
+
+      mock_post.side_effect = None
+      monitor.outbox.retry_timer.mock_tick(monitor.outbox.MIN_RETRY_PERIOD_S)
+      self.assertEqual(mock_post.call_count, 2)
+      self.assertEqual(mock_post.call_args[1]['data']['subject'], '[ALERT] Test subject')
+      self.assertEqual(len(monitor.outbox.entries), 0)
+
+  def test_rejected_alert_doesnt_block_later_alerts(self):
+    rejected, accepted = requests.Response(), requests.Response()
+    rejected.status_code, accepted.status_code = 400, 200
+    rejected._content = '{"message": "Invalid to address"}'
+    outbox_file = os.path.join(tempfile.mkdtemp(), 'test_monitor.outbox')
+    with mock.patch('requests.post', side_effect=[rejected, accepted, accepted]) as mock_post:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--outbox_file=%s' % outbox_file,
+      ])
+      monitor.start(lambda: None)
+
+      monitor.alert('Rejected subject', 'test', {'a': 'string'})
+      monitor.alert('Second subject', 'test', {'a': 'string'})
+      monitor.alert('Third subject', 'test', {'a': 'string'})
+      self.send_alerts()
+
+    self.assertEqual(mock_post.call_count, 3)
+    self.assertEqual(monitor.outbox.entries, {})
+    self.assertIsNone(monitor.outbox.retry_timer)
+    with open(outbox_file + '.dead', 'r') as f:
+      dead_letter = json.loads(f.read())
+    self.assertEqual(dead_letter['message']['subject'], '[ALERT] Rejected subject')
+    self.assertEqual(dead_letter['error'],
+                     'Mailgun responded with a 400: "{"message": "Invalid to address"}"')
+    shutil.rmtree(os.path.dirname(outbox_file))
+
+  def test_alert_that_cant_be_queued_keeps_polling(self):
+    with mock.patch('time.time', new=mocks.MockTime().time):
+      with mock.patch('monitor.outbox.put', side_effect=IOError('No space left on device')):
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+          'http://test.com',
+          '--poll_period_s=10',
+        ])
+        monitor.start(lambda: monitor.alert('Test subject', 'test', {'a': 'string'}))
+
+        monitor.poll_timer.mock_tick(0)
+        self.assertEqual(monitor.poll_timer.seconds, 10)
+        self.assertFalse(monitor.poll_timer.has_stopped)
+
+  def test_failed_checkpoint_keeps_polling(self):
+    with mock.patch('time.time', new=mocks.MockTime().time):
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--poll_period_s=10',
+      ])
+      monitor.start(lambda: None)
+
+      with mock.patch('state.checkpoint', side_effect=sqlite3.OperationalError('disk is full')):
+        with mock.patch.object(monitor.poll_history, 'record', side_effect=IndexError()):
+          monitor.poll_timer.mock_tick(0)
+      self.assertEqual(monitor.poll_timer.seconds, 10)
+      self.assertFalse(monitor.poll_timer.has_stopped)
+
+  def test_alert_rate_limiting_per_template(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      with mock.patch('requests.post') as mock_post:
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+          'http://test.com',
+          '--alert_burst=2',
+          '--alert_refill_period_s=60',
+        ])
+        monitor.start(lambda: None)
+
+        with mock.patch('monitor.render_template', return_value='html') as mock_render:
+          for i in xrange(4):
+            monitor.alert('Test subject', 'test', {'a': 'string'})
+          self.send_alerts()
+          self.assertEqual(mock_post.call_count, 2)
+          self.assertEqual(mock_render.call_count, 2)
+
+          # Other templates have their own buckets, and summarize what was suppressed.
+          monitor.alert('Other subject', 'other', {})
+          self.send_alerts()
+          self.assertEqual(mock_post.call_count, 3)
+          self.assertEqual(mock_render.call_args[0][1]['suppressed_alert_counts'],
+                           [('Test subject', 2)])
+
+          mock_time.mock_tick(60)
+          monitor.alert('Test subject', 'test', {'a': 'string'})
+          self.send_alerts()
+          self.assertEqual(mock_post.call_count, 4)
+          self.assertEqual(mock_render.call_args[0][1]['suppressed_alert_counts'], [])
+
+          monitor.alert('Test subject', 'test', {'a': 'string'})
+          self.send_alerts()
+          self.assertEqual(mock_post.call_count, 4)
+
+  def test_alert_rate_limiting_globally(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      with mock.patch('requests.post') as mock_post:
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+          'http://test.com',
+          '--global_alert_burst=2',
+          '--global_alert_refill_period_s=10',
+        ])
+        monitor.start(lambda: None)
+
+        monitor.alert('Subject a', 'test', {'a': 'a'})
+        monitor.alert('Subject b', 'test', {'a': 'b'})
+        monitor.alert('Subject c', 'test', {'a': 'c'})
+        self.send_alerts()
+        self.assertEqual(mock_post.call_count, 2)
+
+        mock_time.mock_tick(10)
+        monitor.alert('Subject d', 'test', {'a': 'd'})
+        self.send_alerts()
+        self.assertEqual(mock_post.call_count, 3)
+        filtered_html = re.sub(r'\s+', ' ', mock_post.call_args[1]['data']['html'])
+        self.assertIn('The following alerts were rate limited since the last alert was sent:',
+                      filtered_html)
+        self.assertIn('<li>Subject c (1x)', filtered_html)
+
   def test_render_page(self):
     monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
                        raw_args=['http://test.com'])
@@ -306,6 +504,38 @@ class MonitorTest(unittest.TestCase):
           '<!DOCTYPE html> <html> <head> <title>Test monitor - Error</title> </head> <body> '
           'message <pre>traceback</pre> </body> </html>')
 
+  def test_alert_does_not_mutate_template_args(self):
+    with mock.patch('requests.post'):
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                         raw_args=['http://test.com'])
+      monitor.start(lambda: None)
+
+      template_args = {'a': 'string'}
+      monitor.alert('Test subject', 'test', template_args)
+      self.assertEqual(template_args, {'a': 'string'})
+
+  def test_load_templates(self):
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                       raw_args=['http://test.com'])
+    monitor.start(lambda: None)
+
+    self.assertIn('base_alert.html', monitor.templates)
+    self.assertIn('test_alert.html', monitor.templates)
+    self.assertIn('error_page.html', monitor.templates)
+
+  def test_render_fragment_is_cached(self):
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                       raw_args=['http://test.com'])
+    monitor.start(lambda: None)
+
+    with mock.patch('monitor.render_template', return_value='fragment') as mock_render:
+      self.assertEqual(monitor.render_fragment('test_alert.html', (1, 2), a='b'), 'fragment')
+      self.assertEqual(monitor.render_fragment('test_alert.html', (1, 2), a='b'), 'fragment')
+      mock_render.assert_called_once_with('test_alert.html', {'a': 'b'})
+
+      monitor.render_fragment('test_alert.html', (1, 3), a='b')
+      self.assertEqual(mock_render.call_count, 2)
+
   def test_silence(self):
     poll = mock.Mock()
     monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
@@ -332,6 +562,9 @@ class MonitorTest(unittest.TestCase):
 
     monitor.poll_timer.mock_tick(5)
     monitor.silence_timer.mock_tick(5)
+    poll.assert_not_called()
+
+    monitor.poll_timer.mock_tick(0)
     poll.assert_called_once()
 
   def test_unsilence_when_silenced(self):
@@ -359,12 +592,86 @@ class MonitorTest(unittest.TestCase):
     poll.assert_not_called()
 
     self.assertTrue(monitor.unsilence())
+    poll.assert_not_called()
+
+    monitor.poll_timer.mock_tick(0)
+    poll.assert_called_once()
+
+    poll.reset_mock()
+    monitor.poll_timer.mock_tick(10)
+    poll.assert_called_once()
+
+  def test_unsilence_replaces_pending_poll(self):
+    poll = mock.Mock()
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=5',
+    ])
+    monitor.start(poll)
+
+    monitor.poll_timer.mock_tick(0)
+    poll.assert_called_once()
+
+    poll.reset_mock()
+    pending_poll_timer = monitor.poll_timer
+    pending_poll_timer.mock_tick(5)
+    monitor.silence(60 * 60)
+    self.assertTrue(monitor.unsilence())
+
+    # The pending poll is cancelled, so only the immediate poll and its successors remain.
+    self.assertTrue(pending_poll_timer.has_stopped)
+    monitor.poll_timer.mock_tick(0)
     poll.assert_called_once()
 
     poll.reset_mock()
+    pending_poll_timer.mock_tick(5)
+    poll.assert_not_called()
     monitor.poll_timer.mock_tick(10)
     poll.assert_called_once()
 
+  def test_polls_never_overlap(self):
+    poll = mock.Mock(side_effect=lambda: monitor.poll())
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=5',
+    ])
+    monitor.start(poll)
+
+    monitor.poll_timer.mock_tick(0)
+    poll.assert_called_once()
+
+  def test_overrunning_polls_keep_polling_with_real_timers(self):
+    # Each cycle overruns, so its successor is due straight away and must not be dropped as
+    # overlapping the cycle that scheduled it.
+    polled = threading.Event()
+    poll_count = [0]
+    def slow_poll():
+      time.sleep(0.02)
+      poll_count[0] += 1
+      if poll_count[0] >= 10:
+        polled.set()
+
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=0.01',
+      '--min_poll_padding_period_s=0',
+    ])
+    with mock.patch('threading.Timer', threading._Timer):
+      with mock.patch('monitor.alert'):
+        with mock.patch.object(monitor.logger, 'warning') as mock_warning:
+          monitor.start(slow_poll)
+
+          polled.wait(5)
+          monitor.is_alive = False
+          with monitor.poll_lock:
+            monitor.poll_timer.cancel()
+
+    self.assertGreaterEqual(poll_count[0], 10)
+    self.assertNotIn(mock.call('Skipping poll, since another is still running.'),
+                     mock_warning.call_args_list)
+
   def test_unsilence_when_already_unsilenced(self):
     poll = mock.Mock()
     monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
@@ -418,8 +725,94 @@ class MonitorTest(unittest.TestCase):
 
     monitor.poll_timer.mock_tick(5)
     monitor.silence_timer.mock_tick(5)
+    poll.assert_not_called()
+
+    monitor.poll_timer.mock_tick(0)
     poll.assert_called_once()
 
+  def test_restart_resumes_polling_schedule(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      poll = mock.Mock()
+      raw_args = ['http://test.com', '--poll_period_s=10', '--min_poll_padding_period_s=0']
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+      monitor.start(poll)
+      mock_time.mock_tick(1)
+      monitor.poll_timer.mock_tick(1)
+      poll.assert_called_once()
+
+      mock_time.mock_tick(3)
+      monitor.reset()
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+      monitor.start(poll)
+      self.assertEqual(monitor.poll_timer.seconds, 7)
+
+  def test_restart_restores_silence(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      poll = mock.Mock()
+      raw_args = ['http://test.com', '--poll_period_s=10', '--min_poll_padding_period_s=0']
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+      monitor.start(poll)
+      monitor.silence(60 * 60)
+
+      mock_time.mock_tick(30 * 60)
+      monitor.reset()
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+      monitor.start(poll)
+      self.assertFalse(monitor.is_alive)
+      self.assertEqual(monitor.silence_timer.seconds, 30 * 60)
+
+      monitor.poll_timer.mock_tick(1)
+      poll.assert_not_called()
+      monitor.silence_timer.mock_tick(30 * 60)
+      monitor.poll_timer.mock_tick(0)
+      poll.assert_called_once()
+
+  def test_restart_skips_alerts_already_sent(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      with mock.patch('requests.post') as mock_post:
+        raw_args = ['http://test.com', '--poll_period_s=10']
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+        monitor.start(lambda: None)
+        monitor.alert('Test subject', 'test', {'a': 'string'})
+        self.send_alerts()
+        self.assertEqual(mock_post.call_count, 1)
+
+        mock_time.mock_tick(5)
+        monitor.reset()
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+        monitor.start(lambda: None)
+        monitor.alert('Test subject', 'test', {'a': 'string'})
+        self.send_alerts()
+        self.assertEqual(mock_post.call_count, 1)
+
+        # Only the first matching alert after restarting is skipped.
+        monitor.alert('Test subject', 'test', {'a': 'string'})
+        self.send_alerts()
+        self.assertEqual(mock_post.call_count, 2)
+
+  def test_restart_skipped_alert_doesnt_use_a_token(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      with mock.patch('requests.post') as mock_post:
+        raw_args = ['http://test.com', '--poll_period_s=10', '--alert_burst=1']
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+        monitor.start(lambda: None)
+        monitor.alert('Test subject', 'test', {'a': 'string'})
+
+        mock_time.mock_tick(5)
+        monitor.reset()
+        monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=raw_args)
+        monitor.start(lambda: None)
+        monitor.alert('Test subject', 'test', {'a': 'string'})
+        monitor.alert('Other subject', 'test', {'a': 'other'})
+        self.send_alerts()
+
+    self.assertEqual(mock_post.call_count, 2)
+    self.assertEqual(mock_post.call_args[1]['data']['subject'], '[ALERT] Other subject')
+
   def test_handle_ok(self):
     response = self.server.get('/ok')
     self.assertEqual(response.data, 'ok')
@@ -500,25 +893,114 @@ class MonitorTest(unittest.TestCase):
       '--port=8080',
       '--log_file_prefix=other_monitor',
       '--log=DEBUG',
+      '--admin_token=secret',
     ])
 
     response = self.server.get('/args')
     self.assertIn(
+        '--admin_token=***\n'
+        '--alert_burst=5\n'
         '--alert_emails=[&#39;test1@test.com&#39;, &#39;test2@test.com&#39;]\n'
+        '--alert_refill_period_s=300.0\n'
         '--arg_a=non-default-a\n'
         '--arg_c=default\n'
+        '--config_file=None\n'
+        '--global_alert_burst=20\n'
+        '--global_alert_refill_period_s=60.0\n'
+        '--history_size=10080\n'
+        '--keep_alive_s=5.0\n'
         '--log_file_prefix=other_monitor\n'
+        '--log_format=text\n'
         '--log_level=10\n'
         '--mailgun_api_key=123456789\n'
         '--mailgun_messages_url=http://test.com/send_email\n'
+        '--mesh_fail_period_s=60.0\n'
+        '--mesh_fanout=3\n'
+        '--mesh_period_s=10.0\n'
+        '--mesh_token=None\n'
         '--min_poll_padding_period_s=0.0\n'
         '--monitor_email=other_monitor@test.com\n'
         '--monitor_url=http://test.com\n'
+        '--outbox_file=test_monitor.outbox\n'
+        '--outbox_fsync_period_s=1.0\n'
+        '--peers=[]\n'
         '--poll_period_s=10.0\n'
         '--port=8080\n'
-        '--renamed_arg_b=1.618\n',
+        '--renamed_arg_b=1.618\n'
+        '--request_timeout_s=30.0\n'
+        '--server=threaded\n'
+        '--server_max_connections=64\n'
+        '--server_workers=8\n'
+        '--state_file=test_monitor.state\n',
         response.data)
 
+  def test_reloading_config_file(self):
+    config_file = os.path.join(tempfile.mkdtemp(), 'config.json')
+    with open(config_file, 'w') as f:
+      f.write('{"poll_period_s": 20, "alert_emails": "a@test.com, b@test.com"}')
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[{
+      'name': '--max_qps',
+      'dest': 'delay_s',
+      'default': 1,
+      'type': lambda arg: 1 / float(arg),
+      'reloadable': True,
+    }], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=0',
+      '--config_file=%s' % config_file,
+    ])
+    config_fn = mock.Mock()
+    monitor.start(lambda: None, config_fn)
+
+    monitor.poll_timer.mock_tick(0)
+
+    self.assertEqual(monitor.args.poll_period_s, 20)
+    self.assertEqual(monitor.args.alert_emails, ['a@test.com', 'b@test.com'])
+    config_fn.assert_called_once_with({
+      'poll_period_s': (10, 20),
+      'alert_emails': (['Cameron Behar <0x24a537r9@gmail.com>'], ['a@test.com', 'b@test.com']),
+    })
+    self.assertAlmostEqual(monitor.poll_timer.seconds, 20, places=2)
+
+    # Invalid configs are logged and ignored, leaving the last one in place.
+    configs = ('{"poll_period_s": "soon"}', '{"max_qps": 0}', '{"port": 8080}', '[20]', '{')
+    for i, config in enumerate(configs):
+      with open(config_file, 'w') as f:
+        f.write(config)
+      os.utime(config_file, (0, i))
+      with mock.patch.object(monitor.logger, 'error') as mock_error:
+        monitor.poll_timer.mock_tick(20)
+      mock_error.assert_called_once_with('Failed to load config file "%s": %s', config_file,
+                                         mock.ANY)
+    self.assertEqual(monitor.args.poll_period_s, 20)
+    self.assertEqual(monitor.args.delay_s, 1)
+    self.assertEqual(config_fn.call_count, 1)
+    self.assertFalse(monitor.poll_timer.has_stopped)
+    shutil.rmtree(os.path.dirname(config_file))
+
+  def test_failing_config_fn_keeps_polling(self):
+    poll = mock.Mock()
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=0',
+      '--admin_token=secret',
+    ])
+    monitor.start(poll, [mock.Mock(side_effect=ZeroDivisionError), mock.Mock()])
+    monitor.poll_timer.mock_tick(0)
+
+    response = self.server.post('/config', data='{"poll_period_s": 20}',
+                                headers={'Authorization': 'Bearer secret'})
+    self.assertEqual(response.status_code, 202)
+    with mock.patch.object(monitor.logger, 'exception') as mock_exception:
+      monitor.poll_timer.mock_tick(10)
+
+    mock_exception.assert_called_once_with('Failed to apply reloaded %s.', 'poll_period_s')
+    monitor.config_fns[1].assert_called_once_with({'poll_period_s': (10, 20)})
+    self.assertEqual(poll.call_count, 2)
+    self.assertAlmostEqual(monitor.poll_timer.seconds, 20, places=2)
+
   def test_handle_logs_invalid_level(self):
     monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
                        raw_args=['http://test.com'])
@@ -572,10 +1054,456 @@ class MonitorTest(unittest.TestCase):
       filtered_html = re.sub(r'\s+', ' ', response.data)    
       self.assertIn('logs record', filtered_html)
 
+  def test_handle_metrics(self):
+    with mock.patch('requests.post'):
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--poll_period_s=10',
+        '--min_poll_padding_period_s=0',
+      ])
+      monitor.start(lambda: None)
+
+      monitor.poll_timer.mock_tick(1)
+      monitor.alert('Test subject', 'test', {'a': 'string'})
+      self.send_alerts()
+
+    response = self.server.get('/metrics')
+    self.assertEqual(response.mimetype, 'text/plain')
+    self.assertIn('monitor_poll_duration_seconds_count{poll_fn="<lambda>"} 1', response.data)
+    self.assertIn('monitor_alerts_total{template="test_alert.html",outcome="queued"} 1.0',
+                  response.data)
+    self.assertIn('monitor_mailgun_request_duration_seconds_count 1', response.data)
+    self.assertIn('monitor_poll_slack_seconds ', response.data)
+
+  def test_handle_status(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      def poll():
+        monitor.report_status('cars', [1, 2])
+        mock_time.mock_tick(2)
+
+      def failing_poll():
+        raise Exception('Poll failed')
+
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--poll_period_s=10',
+        '--min_poll_padding_period_s=0',
+      ])
+      with mock.patch('requests.post'):
+        monitor.start([poll, failing_poll])
+
+        response = self.server.get('/status')
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(json.loads(response.data),
+                         {'name': 'Test monitor', 'silenced': False, 'last_poll': None})
+
+        monitor.poll_timer.mock_tick(0)
+
+      response = self.server.get('/status')
+      self.assertEqual(json.loads(response.data), {
+        'name': 'Test monitor',
+        'silenced': False,
+        'last_poll': {
+          'poll_id': 1,
+          'start_time': 0.0,
+          'duration_s': 2.0,
+          'cars': [1, 2],
+          'poll_fns': [
+            {'name': 'poll', 'outcome': 'ok', 'duration_s': 2.0},
+            {'name': 'failing_poll', 'outcome': 'exception', 'duration_s': 0.0},
+          ],
+        },
+      })
+      etag = response.headers['ETag']
+
+      response = self.server.get('/status', headers={'If-None-Match': etag})
+      self.assertEqual(response.status_code, 304)
+      self.assertEqual(response.data, '')
+
+      monitor.silence(60)
+      response = self.server.get('/status', headers={'If-None-Match': etag})
+      self.assertEqual(response.status_code, 200)
+      self.assertTrue(json.loads(response.data)['silenced'])
+      self.assertNotEqual(response.headers['ETag'], etag)
+
+  def test_handle_history(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      def poll():
+        monitor.add_cycle_count('cars', 3)
+        mock_time.mock_tick(2)
+
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--poll_period_s=600',
+        '--min_poll_padding_period_s=0',
+      ])
+      monitor.start(poll)
+      for i in xrange(12):
+        monitor.poll_timer.mock_tick(600)
+        mock_time.mock_tick(598)
+
+      cycles = json.loads(self.server.get('/history').data)['cycles']
+      self.assertEqual(len(cycles), 6)
+      self.assertEqual(cycles[-1], {
+        'start_time': 11 * 600.0,
+        'duration_s': 2.0,
+        'slack_s': 598.0,
+        'alerts': 0,
+        'errors': 0,
+        'cars': 3,
+      })
+
+      history = json.loads(self.server.get('/history/day').data)
+      self.assertEqual(history['bucket_s'], 5 * 60)
+      self.assertEqual(len(history['cycles']), 12)
+
+      history = json.loads(self.server.get('/history/week').data)
+      self.assertEqual(history['bucket_s'], 60 * 60)
+      self.assertEqual([bucket['cycles'] for bucket in history['cycles']], [6, 6])
+
+      self.assertEqual(self.server.get('/history/year').status_code, 404)
+
+  def test_mesh_leader_alerts_when_a_peer_goes_quiet(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://a.com',
+        '--peers=http://b.com,http://c.com',
+        '--mesh_token=secret',
+        '--mesh_period_s=10',
+        '--mesh_fail_period_s=30',
+      ])
+      monitor.start(lambda: None)
+
+      def post(url, json=None, headers=None, timeout=None):
+        if url == 'http://b.com/mesh/gossip':
+          raise Exception('Connection refused')
+        response = requests.Response()
+        response.status_code = 200
+        response.json = lambda: {'heartbeats': {'http://c.com': mock_time.time()}}
+        return response
+
+      with mock.patch('monitor.alert') as mock_alert:
+        with mock.patch('requests.post', side_effect=post) as mock_post:
+          for i in xrange(3):
+            mock_time.mock_tick(10)
+            monitor.mesh_timer.mock_tick(10)
+          mock_alert.assert_not_called()
+          self.assertEqual(mock_post.call_count, 6)
+
+          mock_time.mock_tick(10)
+          monitor.mesh_timer.mock_tick(10)
+        mock_alert.assert_called_once_with(
+            '1 mesh peer(s) down', 'mesh_peers_down', {'failed_peers': [('http://b.com', 40.0)]})
+
+      mesh = json.loads(self.server.get('/mesh').data)
+      self.assertEqual(mesh['leader'], 'http://a.com')
+      self.assertEqual(mesh['failed_peers'], [['http://b.com', 40.0]])
+
+  def test_mesh_only_leader_alerts(self):
+    mock_time = mocks.MockTime()
+    with mock.patch('time.time', new=mock_time.time):
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://b.com',
+        '--peers=http://a.com,http://c.com',
+        '--mesh_token=secret',
+        '--mesh_period_s=10',
+        '--mesh_fail_period_s=30',
+      ])
+      monitor.start(lambda: None)
+
+      with mock.patch('monitor.alert') as mock_alert:
+        with mock.patch('requests.post', side_effect=Exception('Connection refused')):
+          for i in xrange(4):
+            mock_time.mock_tick(10)
+            monitor.mesh_timer.mock_tick(10)
+        # With every peer down, the remaining member leads.
+        mock_alert.assert_called_once_with('2 mesh peer(s) down', 'mesh_peers_down', mock.ANY)
+
+  def test_handle_mesh_gossip(self):
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://a.com',
+      '--peers=http://b.com',
+      '--mesh_token=secret',
+    ])
+    monitor.start(lambda: None)
+
+    gossip = json.dumps({'heartbeats': {'http://b.com': 7, 'http://unknown.com': 1}})
+    for authorization in (None, 'Bearer wrong'):
+      headers = {'Authorization': authorization} if authorization else {}
+      response = self.server.post('/mesh/gossip', data=gossip, headers=headers,
+                                  content_type='application/json')
+      self.assertEqual(response.status_code, 401)
+    self.assertEqual(monitor.mesh.heartbeats()['http://b.com'], 0)
+
+    response = self.server.post('/mesh/gossip', data=gossip,
+                                headers={'Authorization': 'Bearer secret'},
+                                content_type='application/json')
+    self.assertEqual(json.loads(response.data),
+                     {'heartbeats': {'http://a.com': 0, 'http://b.com': 7}})
+
+  def test_parse_args_with_peers_but_no_mesh_token(self):
+    with self.assertRaises(SystemExit) as e:
+      monitor.parse_args('Test monitor', 'Test description', [],
+                         ['http://a.com', '--peers=http://b.com'])
+    self.assertEqual(e.exception.code, 2)
+
+  def test_handle_mesh_without_peers(self):
+    self.assertEqual(self.server.get('/mesh').status_code, 404)
+    self.assertEqual(self.server.post('/mesh/gossip', data='{}').status_code, 404)
+
+  def test_handle_profile(self):
+    def slow_operation():
+      sum(i * i for i in xrange(1000))
+
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=0',
+    ])
+    monitor.start(slow_operation)
+
+    response = self.server.get('/profile')
+    self.assertIn('Not profiling.', response.data)
+    self.assertEqual(self.server.get('/profile.pstats').status_code, 404)
+
+    response = self.server.get('/profile/2')
+    self.assertIn('Profiling the next 2 poll cycle(s).', response.data)
+
+    monitor.poll_timer.mock_tick(1)
+    response = self.server.get('/profile')
+    self.assertIn('Profiling the next 1 poll cycle(s).', response.data)
+
+    monitor.poll_timer.mock_tick(10)
+    response = self.server.get('/profile')
+    self.assertIn('Profiled poll cycles, by cumulative time', response.data)
+    self.assertIn('slow_operation', response.data)
+
+    response = self.server.get('/profile.pstats')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.headers['Content-Disposition'],
+                     'attachment; filename=test_monitor.pstats')
+    self.assertIsNone(monitor.profiler)
+
+  def test_handle_memory(self):
+    leaked = []
+    def leaky_operation():
+      leaked.extend([i] for i in xrange(1000))
+
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+      '--min_poll_padding_period_s=0',
+    ])
+    monitor.start(leaky_operation)
+    monitor.poll_timer.mock_tick(1)
+
+    response = self.server.get('/memory')
+    self.assertIn('Not tracing memory.', response.data)
+    self.assertIn('Resident set size:', response.data)
+
+    response = self.server.get('/memory/2')
+    self.assertIn('Tracing memory over the next 2 poll cycle(s).', response.data)
+
+    monitor.poll_timer.mock_tick(10)
+    response = self.server.get('/memory')
+    self.assertIn('Tracing memory over the next 1 poll cycle(s).', response.data)
+
+    monitor.poll_timer.mock_tick(10)
+    response = self.server.get('/memory')
+    filtered_html = re.sub(r' +', ' ', response.data)
+    self.assertIn('Types whose counts changed the most:', filtered_html)
+    self.assertIn('+2000', filtered_html)
+    self.assertRegexpMatches(filtered_html, r'\d{4} list held by list')
+    self.assertEqual(len(re.findall(r'^\d+ +[\d.]+ +\d+$', filtered_html, re.MULTILINE)), 2)
+    self.assertIsNone(monitor.memory_baseline)
+
+  def test_handle_logs_tail(self):
+    with mock.patch('monitor.open',
+                    return_value=io.BytesIO(b'line 1\nline 2\nline 3\nline 4\n')) as mock_open:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                         raw_args=['http://test.com', '--log_file_prefix=/tmp/test_monitor'])
+      monitor.start(lambda: None)
+
+      with mock.patch('monitor.LOG_CHUNK_SIZE', 4):
+        response = self.server.get('/logs?tail=2')
+      self.assertIn('<pre>line 3\nline 4\n</pre>', response.data)
+
+  def test_handle_logs_tail_longer_than_file(self):
+    with mock.patch('monitor.open', return_value=io.BytesIO(b'line 1\nline 2')) as mock_open:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                         raw_args=['http://test.com', '--log_file_prefix=/tmp/test_monitor'])
+      monitor.start(lambda: None)
+
+      response = self.server.get('/logs?tail=5')
+      self.assertIn('<pre>line 1\nline 2</pre>', response.data)
+
+  def test_handle_logs_pagination(self):
+    logs = b'line 1\nline 2\nline 3\n'
+    with mock.patch('monitor.open', side_effect=lambda *a: io.BytesIO(logs)) as mock_open:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                         raw_args=['http://test.com', '--log_file_prefix=/tmp/test_monitor'])
+      monitor.start(lambda: None)
+
+      response = self.server.get('/logs?limit=2')
+      self.assertIn('<pre>line 1\nline 2\n</pre>', response.data)
+      self.assertIn('<a href="?offset=14&amp;limit=2">Next page</a>', response.data)
+
+      response = self.server.get('/logs?offset=14&limit=2')
+      self.assertIn('<pre>line 3\n</pre>', response.data)
+      self.assertNotIn('Next page', response.data)
+
+      # Offsets in the middle of a line skip to the start of the next line.
+      response = self.server.get('/logs?offset=3&limit=1')
+      self.assertIn('<pre>line 2\n</pre>', response.data)
+
+  def test_handle_logs_range(self):
+    logs = b'line 1\nline 2\nline 3\n'
+    with mock.patch('monitor.open', side_effect=lambda *a: io.BytesIO(logs)) as mock_open:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[],
+                         raw_args=['http://test.com', '--log_file_prefix=/tmp/test_monitor'])
+      monitor.start(lambda: None)
+
+      response = self.server.get('/logs', headers={'Range': 'bytes=7-12'})
+      self.assertEqual(response.status_code, 206)
+      self.assertEqual(response.headers['Content-Range'], 'bytes 7-12/21')
+      self.assertEqual(response.data, 'line 2')
+
+      response = self.server.get('/logs', headers={'Range': 'bytes=-7'})
+      self.assertEqual(response.status_code, 206)
+      self.assertEqual(response.data, 'line 3\n')
+
+      response = self.server.get('/logs', headers={'Range': 'bytes=14-'})
+      self.assertEqual(response.data, 'line 3\n')
+
+      response = self.server.get('/logs', headers={'Range': 'bytes=100-'})
+      self.assertEqual(response.status_code, 416)
+      self.assertEqual(response.headers['Content-Range'], 'bytes */21')
+
+  def test_handle_logs_search(self):
+    log_dir = tempfile.mkdtemp()
+    try:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--log_file_prefix=%s/test_monitor' % log_dir,
+      ])
+      monitor.start(lambda: None)
+      monitor.logger.info('Car 1234 was found outside of its geofences.')
+      monitor.logger.error('Request for car 1234 timed out after 10s.')
+      monitor.logger.info('Car 5 was found outside of its geofences.')
+
+      response = self.server.get('/logs/search?car_id=1234')
+      self.assertIn('Car 1234 was found outside of its geofences.', response.data)
+      self.assertIn('Request for car 1234 timed out after 10s.', response.data)
+      self.assertNotIn('Car 5 was found', response.data)
+
+      response = self.server.get('/logs/search?car_id=1234&level=error')
+      self.assertNotIn('Car 1234 was found outside of its geofences.', response.data)
+      self.assertIn('Request for car 1234 timed out after 10s.', response.data)
+
+      response = self.server.get('/logs/search?q=Car+5')
+      self.assertIn('Car 5 was found outside of its geofences.', response.data)
+      self.assertNotIn('1234', response.data)
+
+      response = self.server.get('/logs/search?start=yesterday')
+      self.assertIn('Invalid search time.', response.data)
+    finally:
+      monitor.reset()
+      shutil.rmtree(log_dir)
+
+  def test_handle_logs_jsonl_filters_by_level(self):
+    log_dir = tempfile.mkdtemp()
+    try:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--log_file_prefix=%s/test_monitor' % log_dir,
+        '--log_format=jsonl',
+      ])
+      monitor.start(lambda: None)
+      monitor.logger.info('Info event.')
+      monitor.logger.warning('Warning event.')
+      monitor.logger.error('Error event.')
+
+      response = self.server.get('/logs/warning')
+      self.assertNotIn('Info event.', response.data)
+      self.assertIn('&#34;message&#34;: &#34;Warning event.&#34;', response.data)
+      self.assertIn('&#34;message&#34;: &#34;Error event.&#34;', response.data)
+      self.assertEqual(os.listdir(log_dir), ['test_monitor.events.jsonl'])
+    finally:
+      monitor.reset()
+      shutil.rmtree(log_dir)
+
+  def test_handle_logs_jsonl_tail_counts_filtered_events(self):
+    log_dir = tempfile.mkdtemp()
+    try:
+      monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+        'http://test.com',
+        '--log_file_prefix=%s/test_monitor' % log_dir,
+        '--log_format=jsonl',
+      ])
+      monitor.start(lambda: None)
+      monitor.logger.error('First error event.')
+      monitor.logger.error('Second error event.')
+      for i in xrange(100):
+        monitor.logger.info('Info event %s.', i)
+
+      with mock.patch('monitor.LOG_CHUNK_SIZE', 64):
+        response = self.server.get('/logs/error?tail=1')
+      self.assertNotIn('First error event.', response.data)
+      self.assertIn('Second error event.', response.data)
+      self.assertNotIn('Info event', response.data)
+
+      response = self.server.get('/logs/error', headers={'Range': 'bytes=0-99'})
+      self.assertEqual(response.status_code, 400)
+    finally:
+      monitor.reset()
+      shutil.rmtree(log_dir)
+
+  def test_stop_polling_waits_for_the_running_cycle(self):
+    poll_started, release_poll = threading.Event(), threading.Event()
+    def slow_poll():
+      poll_started.set()
+      release_poll.wait(5)
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+      '--poll_period_s=10',
+    ])
+    monitor.start(slow_poll)
+    poll_thread = threading.Thread(target=monitor.poll_timer.mock_tick, args=(0,))
+    poll_thread.start()
+    self.assertTrue(poll_started.wait(5))
+
+    stop_thread = threading.Thread(target=monitor.stop_polling)
+    stop_thread.start()
+    stop_thread.join(0.1)
+    self.assertTrue(stop_thread.is_alive())
+
+    release_poll.set()
+    stop_thread.join(5)
+    poll_thread.join(5)
+    self.assertFalse(stop_thread.is_alive())
+    # The cycle finished with its args intact, and didn't schedule another.
+    self.assertEqual(monitor.poll_id, 1)
+    self.assertTrue(monitor.poll_timer.has_stopped)
+
   def test_kill_in_prod(self):
     response = self.server.get('/kill')
     self.assertEquals(response.status_code, 404)
 
+  def test_kill_stops_server(self):
+    monitor.parse_args('Test monitor', 'Test description', raw_arg_defs=[], raw_args=[
+      'http://test.com',
+    ])
+    monitor.start(lambda: None)
+    monitor.http_server = mock.Mock()
+    with mock.patch('threading.Thread') as mock_thread:
+      response = self.server.get('/kill')
+    self.assertEquals(response.status_code, 200)
+    mock_thread.assert_called_once_with(target=monitor.http_server.stop, name='shutdown')
+    mock_thread.return_value.start.assert_called_once()
+
 
 if __name__ == '__main__':
   unittest.main()
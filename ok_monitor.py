@@ -1,54 +1,258 @@
 import flask
+import latency
 import logging
+import metrics
 import monitor
-import requests
-import requests.exceptions
+import Queue
 import sys
+import threading
+import time
 
 
 server, logger = monitor.server, logging.getLogger('monitor.ok_monitor')
 
+# Each server's (recent, baseline) latency histograms. Samples that age out of the recent window move
+# into the baseline, so a regression is compared against strictly older behavior.
+latencies = {}
+# Probe threads, kept across cycles rather than started for each, and the queue of (results queue,
+# index, server URL) probes they take from.
+probe_queue, probers = Queue.Queue(), []
+
+probe_duration_s = metrics.Histogram(
+    'ok_monitor_probe_duration_seconds', 'Latency of /ok probes by server.', ['server_url'])
+
 
 def start(raw_args=sys.argv[1:]):
   monitor.parse_args(
       'Ok monitor',
-      "Monitors another monitor's /ok endpoint, triggering an email alert if for any reason it "
+      "Monitors other monitors' /ok endpoints, triggering an email alert if for any reason they "
       "can't be reached.",
       raw_arg_defs=[{
-        'name': 'server_url',
-        'help': 'The URL of the server to be monitored',
+        'name': 'server_urls',
+        'nargs': '*',
+        'help': 'The URLs of the servers to be monitored',
+      }, {
+        'name': '--targets_file',
+        'dest': 'targets_file',
+        'help': 'A file listing more server URLs to be monitored, one per line. Blank lines and '
+                'lines starting with "#" are ignored.',
       }, {
         'name': '--ok_timeout_s',
         'dest': 'ok_timeout_s',
         'default': 10,
         'type': float,
         'help': 'The maximum period (in seconds) before timing out an /ok request',
+      }, {
+        'name': '--max_concurrent_probes',
+        'dest': 'max_concurrent_probes',
+        'default': 1024,
+        'type': int,
+        'help': 'The maximum number of servers to probe at once, each on a thread kept across '
+                'cycles. Any more wait for a free thread, so each further batch can add up to '
+                '--ok_timeout_s to a cycle',
+      }, {
+        'name': '--latency_window',
+        'dest': 'latency_window',
+        'default': 30,
+        'type': int,
+        'help': 'The number of recent probes per server over which latency percentiles are computed',
+      }, {
+        'name': '--latency_baseline_window',
+        'dest': 'latency_baseline_window',
+        'default': 1000,
+        'type': int,
+        'help': 'The number of older probes per server against which recent latencies are compared',
+      }, {
+        'name': '--latency_percentile',
+        'dest': 'latency_percentile',
+        'default': 95.0,
+        'type': float,
+        'help': 'The latency percentile checked for regressions',
+      }, {
+        'name': '--latency_threshold_s',
+        'dest': 'latency_threshold_s',
+        'type': float,
+        'help': 'The latency (in seconds) above which the --latency_percentile of recent probes '
+                'triggers an alert. Defaults to half of --ok_timeout_s.',
+      }, {
+        'name': '--latency_regression_multiplier',
+        'dest': 'latency_regression_multiplier',
+        'default': 3.0,
+        'type': float,
+        'help': 'The multiple of the baseline --latency_percentile above which the recent '
+                '--latency_percentile triggers an alert',
       }],
       raw_args=raw_args)
+  if monitor.args.latency_threshold_s is None:
+    monitor.args.latency_threshold_s = monitor.args.ok_timeout_s / 2
+  if monitor.args.targets_file:
+    monitor.args.server_urls += read_targets_file(monitor.args.targets_file)
+  if not monitor.args.server_urls:
+    sys.stderr.write('error: at least one server URL or a --targets_file is required\n')
+    sys.exit(2)
+  latencies.clear()
+  stop_probers()
   monitor.start(poll)
 
 
+def read_targets_file(path):
+  with open(path, 'r') as f:
+    return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
 def poll():
-  url = '%s/ok' % monitor.args.server_url
+  # Probe every server at once, so that a cycle takes about as long as the slowest probe rather than
+  # the sum of them all.
+  results = probe_all(monitor.args.server_urls)
+  failures = [failure for latency_s, failure in results if failure]
+  for server_url, (latency_s, failure) in zip(monitor.args.server_urls, results):
+    if latency_s is not None:
+      record_latency(server_url, latency_s)
+
+  monitor.add_cycle_count('errors', len(failures))
+  monitor.report_status('failing_server_urls', [server_url for server_url, _, _ in failures])
+  if len(failures) == 1:
+    server_url, template, template_args = failures[0]
+    subject = {
+      'ok_monitor_timing_out': '%s is timing out',
+      'ok_monitor_unreachable': '%s is unreachable',
+      'ok_monitor_not_ok': '%s is not ok',
+    }[template] % server_url
+    monitor.alert(subject, template, template_args)
+  elif failures:
+    monitor.alert('%s servers are failing' % len(failures), 'ok_monitor_failures',
+                  {'failures': failures})
+
+  monitor.report_status('latencies', summarize_latencies())
+  regressions = find_latency_regressions()
+  if regressions:
+    subject = ('%s is slowing down' % regressions[0][0] if len(regressions) == 1
+               else '%s servers are slowing down' % len(regressions))
+    monitor.alert(subject, 'ok_monitor_latency_regression', {
+      'regressions': regressions,
+      'percentile': monitor.args.latency_percentile,
+      'latency_threshold_s': monitor.args.latency_threshold_s,
+      'latency_regression_multiplier': monitor.args.latency_regression_multiplier,
+    })
+
+
+def record_latency(server_url, latency_s):
+  probe_duration_s.labels(server_url).observe(latency_s)
+  if server_url not in latencies:
+    latencies[server_url] = (latency.RollingHistogram(monitor.args.latency_window),
+                             latency.RollingHistogram(monitor.args.latency_baseline_window))
+  recent, baseline = latencies[server_url]
+  evicted_index = recent.add(latency_s)
+  if evicted_index is not None:
+    baseline.add_bucket(evicted_index)
+
+
+def summarize_latencies():
+  return dict((server_url, {
+    'samples': len(recent),
+    'p50_s': recent.percentile(50),
+    'p95_s': recent.percentile(95),
+    'p99_s': recent.percentile(99),
+    'baseline_s': baseline.percentile(monitor.args.latency_percentile),
+  }) for server_url, (recent, baseline) in latencies.iteritems())
+
+
+def find_latency_regressions():
+  regressions = []
+  for server_url in monitor.args.server_urls:
+    recent, baseline = latencies.get(server_url, (None, None))
+    # Wait for a full window so that a single slow probe can't trigger an alert on its own.
+    if not recent or len(recent) < monitor.args.latency_window:
+      continue
+    recent_s = recent.percentile(monitor.args.latency_percentile)
+    baseline_s = (baseline.percentile(monitor.args.latency_percentile)
+                  if len(baseline) >= monitor.args.latency_window else None)
+    if (recent_s > monitor.args.latency_threshold_s or
+        (baseline_s and recent_s > baseline_s * monitor.args.latency_regression_multiplier)):
+      logger.warning('The p%g latency of "%s" has regressed to %.3fs (baseline: %s).',
+                     monitor.args.latency_percentile, server_url, recent_s,
+                     '%.3fs' % baseline_s if baseline_s else 'unknown')
+      regressions.append((server_url, recent_s, baseline_s))
+  return regressions
+
+
+def probe_all(server_urls):
+  # Runs every probe on the pool at once, re-raising the first unexpected exception (if any) once
+  # they've all finished.
+  start_probers(min(monitor.args.max_concurrent_probes, len(server_urls)))
+  probe_results = Queue.Queue()
+  for i, server_url in enumerate(server_urls):
+    probe_queue.put((probe_results, i, server_url))
+  results, first_exc_info = [None] * len(server_urls), None
+  for _ in server_urls:
+    i, result, exc_info = probe_results.get()
+    results[i] = result
+    first_exc_info = first_exc_info or exc_info
+  if first_exc_info:
+    raise first_exc_info[0], first_exc_info[1], first_exc_info[2]
+  return results
+
+
+def start_probers(count):
+  while len(probers) < count:
+    prober = threading.Thread(target=run_prober, args=(probe_queue,),
+                              name='prober-%s' % len(probers))
+    prober.daemon = True
+    prober.start()
+    probers.append(prober)
+
+
+def stop_probers():
+  # Each prober exits once it reaches the end of its queue, and later probes go to a new pool.
+  global probe_queue
+  for _ in probers:
+    probe_queue.put(None)
+  probe_queue, probers[:] = Queue.Queue(), []
+
+
+def run_prober(queue):
+  while True:
+    job = queue.get()
+    if job is None:
+      return
+    probe_results, i, server_url = job
+    try:
+      probe_results.put((i, probe(server_url), None))
+    except Exception:
+      probe_results.put((i, None, sys.exc_info()))
+
+
+def probe(server_url):
+  # Returns the probe's latency (if the server responded) and its failure (if any).
+  # Deferred until the first poll, since the requests stack is slow to import.
+  import requests
+  import requests.exceptions
+
+  url = '%s/ok' % server_url
+  start_time = time.time()
   try:
     response = requests.get(url, timeout=monitor.args.ok_timeout_s)
   except requests.exceptions.Timeout:
     logger.error('Request for "%s" timed out after %ss.', url, monitor.args.ok_timeout_s)
-    monitor.alert('%s is timing out' % monitor.args.server_url, 'ok_monitor_timing_out',
-                  {'url': url, 'ok_timeout_s': monitor.args.ok_timeout_s})
-    return
+    return None, (server_url, 'ok_monitor_timing_out', {
+      'url': url,
+      'ok_timeout_s': monitor.args.ok_timeout_s,
+    })
   except Exception:
     logger.error('Failed to connect to "%s".', url)
-    monitor.alert('%s is unreachable' % monitor.args.server_url, 'ok_monitor_unreachable',
-                  {'url': url})
-    return
+    return None, (server_url, 'ok_monitor_unreachable', {'url': url})
+  latency_s = time.time() - start_time
 
   if response.status_code != 200 or response.text != 'ok':
-    logger.error('Received %s HTTP code with response: "%s"', response.status_code, response.text)
-    monitor.alert('%s is not ok' % monitor.args.server_url, 'ok_monitor_not_ok',
-                  {'status_code': response.status_code, 'url': url, 'text': response.text})
-    return
+    logger.error('Received %s HTTP code from "%s" with response: "%s"', response.status_code, url,
+                 response.text)
+    return latency_s, (server_url, 'ok_monitor_not_ok', {
+      'status_code': response.status_code,
+      'url': url,
+      'text': response.text,
+    })
+  return latency_s, None
 
 
 if __name__ == '__main__':
-  start()
\ No newline at end of file
+  start()
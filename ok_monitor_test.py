@@ -1,9 +1,16 @@
+import json
 import ok_monitor
 import mock
 import mocks
 import monitor
+import os
+import re
 import requests
+import shutil
 import StringIO
+import tempfile
+import threading
+import time
 import unittest
 
 
@@ -30,25 +37,63 @@ class OkMonitorTest(unittest.TestCase):
   def tearDown(self):
     self.server = None
     mock.patch.stopall()
+    self.reset_monitor()
+
+  def reset_monitor(self):
+    state_file = monitor.args and monitor.args.state_file
+    outbox_file = monitor.args and monitor.args.outbox_file
     monitor.reset()
+    for path in (state_file, outbox_file, outbox_file and '%s.dead' % outbox_file):
+      if path and os.path.exists(path):
+        os.remove(path)
 
   def test_parse_args_without_server_url(self):
     with self.assertRaises(SystemExit) as e:
       ok_monitor.start([])
     self.assertEqual(e.exception.code, 2)
 
+  def test_parse_args_with_only_monitor_url(self):
+    with self.assertRaises(SystemExit) as e:
+      ok_monitor.start(['http://test.com'])
+    self.assertEqual(e.exception.code, 2)
+
   def test_parse_args_defaults(self):
     ok_monitor.start(['http://localhost:5000', 'http://test.com',])
     
-    self.assertEqual(monitor.args.server_url, 'http://localhost:5000')
+    self.assertEqual(monitor.args.server_urls, ['http://localhost:5000'])
     self.assertEqual(monitor.args.ok_timeout_s, 10.0)
+    self.assertEqual(monitor.args.max_concurrent_probes, 1024)
+    self.assertEqual(monitor.args.latency_window, 30)
+    self.assertEqual(monitor.args.latency_baseline_window, 1000)
+    self.assertEqual(monitor.args.latency_percentile, 95.0)
+    self.assertEqual(monitor.args.latency_threshold_s, 5.0)
+    self.assertEqual(monitor.args.latency_regression_multiplier, 3.0)
 
   def test_parse_args_with_server_url_and_args(self):
     ok_monitor.start(['http://localhost:5000', 'http://test.com', '--ok_timeout_s=5'])
 
-    self.assertEqual(monitor.args.server_url, 'http://localhost:5000')
+    self.assertEqual(monitor.args.server_urls, ['http://localhost:5000'])
     self.assertEqual(monitor.args.ok_timeout_s, 5.0)
 
+  def test_parse_args_with_multiple_server_urls_and_targets_file(self):
+    targets_dir = tempfile.mkdtemp()
+    try:
+      targets_file = os.path.join(targets_dir, 'targets.txt')
+      with open(targets_file, 'w') as f:
+        f.write('# Geofence monitors\nhttp://localhost:5002\n\n  http://localhost:5003  \n')
+      ok_monitor.start(['http://localhost:5000', 'http://localhost:5001', 'http://test.com',
+                        '--targets_file=%s' % targets_file])
+    finally:
+      shutil.rmtree(targets_dir)
+
+    self.assertEqual(monitor.args.server_urls, [
+      'http://localhost:5000',
+      'http://localhost:5001',
+      'http://localhost:5002',
+      'http://localhost:5003',
+    ])
+    self.assertEqual(monitor.args.monitor_url, 'http://test.com')
+
   def test_polling_with_server_timing_out(self):
     def time_out(url, timeout=999):
       raise requests.exceptions.Timeout('Request timed out')
@@ -116,6 +161,164 @@ class OkMonitorTest(unittest.TestCase):
 
       mock_alert.assert_not_called()
 
+  def test_polling_multiple_servers_sends_one_alert(self):
+    def get(url, timeout=999):
+      if url == 'http://localhost:5001/ok':
+        raise requests.exceptions.Timeout('Request timed out')
+      if url == 'http://localhost:5002/ok':
+        raise Exception('Failed to establish a new connection')
+      return OK_RESPONSE
+
+    with mock.patch('monitor.alert') as mock_alert:
+      with mock.patch('requests.get', side_effect=get) as mock_get:
+        ok_monitor.start(['http://localhost:5000', 'http://localhost:5001', 'http://localhost:5002',
+                          'http://test.com', '--ok_timeout_s=5'])
+
+        monitor.poll_timer.mock_tick(1.0)
+        mock_get.assert_has_calls([
+          mock.call('http://localhost:5000/ok', timeout=5.0),
+          mock.call('http://localhost:5001/ok', timeout=5.0),
+          mock.call('http://localhost:5002/ok', timeout=5.0),
+        ], any_order=True)
+
+      mock_alert.assert_called_once_with('2 servers are failing', 'ok_monitor_failures', {
+        'failures': [
+          ('http://localhost:5001', 'ok_monitor_timing_out',
+           {'url': 'http://localhost:5001/ok', 'ok_timeout_s': 5.0}),
+          ('http://localhost:5002', 'ok_monitor_unreachable', {'url': 'http://localhost:5002/ok'}),
+        ],
+      })
+
+  def test_polling_probes_servers_concurrently(self):
+    lock = threading.Lock()
+    active_probes = [0, 0]
+    def get(url, timeout=999):
+      with lock:
+        active_probes[0] += 1
+        active_probes[1] = max(active_probes)
+      time.sleep(0.2)
+      with lock:
+        active_probes[0] -= 1
+      return OK_RESPONSE
+
+    server_urls = ['http://localhost:%s' % port for port in xrange(5000, 5020)]
+    with mock.patch('monitor.alert') as mock_alert:
+      with mock.patch('requests.get', side_effect=get):
+        ok_monitor.start(server_urls + ['http://test.com', '--max_concurrent_probes=10'])
+
+        start_time = time.time()
+        monitor.poll_timer.mock_tick(1.0)
+        self.assertLess(time.time() - start_time, 2 * 0.2 + 0.3)
+        self.assertEqual(active_probes[1], 10)
+
+        # The same probers are reused by later cycles.
+        probers = list(ok_monitor.probers)
+        monitor.poll_timer.mock_tick(monitor.poll_timer.seconds)
+        self.assertEqual(ok_monitor.probers, probers)
+        self.assertEqual(active_probes[1], 10)
+
+      mock_alert.assert_not_called()
+
+  def test_polling_reraises_unexpected_probe_exceptions(self):
+    with mock.patch('monitor.alert') as mock_alert:
+      with mock.patch('ok_monitor.probe', side_effect=ValueError('unexpected')):
+        ok_monitor.start(['http://localhost:5000', 'http://localhost:5001', 'http://test.com'])
+
+        monitor.poll_timer.mock_tick(1.0)
+
+    mock_alert.assert_called_once_with('Ok monitor encountered an exception', 'monitor_exception',
+                                       mock.ANY)
+    self.assertIn('ValueError: unexpected', mock_alert.call_args[0][2]['traceback'])
+
+  def run_polls(self, raw_args, probe_latencies_s):
+    self.reset_monitor()
+    mock_time = mocks.MockTime()
+    def get(url, timeout=999):
+      mock_time.mock_tick(probe_latencies_s.pop(0))
+      return OK_RESPONSE
+
+    with mock.patch('time.time', new=mock_time.time):
+      with mock.patch('requests.get', side_effect=get):
+        ok_monitor.start(['http://localhost:5000', 'http://test.com', '--poll_period_s=10',
+                          '--min_poll_padding_period_s=0'] + raw_args)
+        while probe_latencies_s:
+          monitor.poll_timer.mock_tick(10)
+
+  def test_polling_alerts_on_latency_regression_over_baseline(self):
+    with mock.patch('monitor.alert') as mock_alert:
+      self.run_polls(['--latency_window=3', '--latency_percentile=50'], [0.02] * 7)
+      self.run_polls(['--latency_window=3', '--latency_percentile=50'], [0.02] * 6 + [0.2])
+      mock_alert.assert_not_called()
+
+      self.run_polls(['--latency_window=3', '--latency_percentile=50'], [0.02] * 6 + [0.2] * 2)
+      mock_alert.assert_called_once_with(
+          'http://localhost:5000 is slowing down', 'ok_monitor_latency_regression', {
+            'regressions': [('http://localhost:5000', mock.ANY, mock.ANY)],
+            'percentile': 50.0,
+            'latency_threshold_s': 5.0,
+            'latency_regression_multiplier': 3.0,
+          })
+      server_url, recent_s, baseline_s = mock_alert.call_args[0][2]['regressions'][0]
+      self.assertAlmostEqual(recent_s, 0.2, delta=0.01)
+      self.assertAlmostEqual(baseline_s, 0.02, delta=0.001)
+
+  def test_polling_alerts_on_latency_over_threshold(self):
+    with mock.patch('monitor.alert') as mock_alert:
+      self.run_polls(['--latency_window=3', '--ok_timeout_s=1'], [0.6] * 2)
+      mock_alert.assert_not_called()
+
+      self.run_polls(['--latency_window=3', '--ok_timeout_s=1'], [0.6] * 3)
+      mock_alert.assert_called_once_with(
+          'http://localhost:5000 is slowing down', 'ok_monitor_latency_regression', mock.ANY)
+
+  def test_latencies_are_exposed(self):
+    self.run_polls(['--latency_window=10'], [0.01 * i for i in xrange(1, 11)])
+
+    latencies = json.loads(self.server.get('/status').data)['last_poll']['latencies']
+    self.assertEqual(latencies.keys(), ['http://localhost:5000'])
+    self.assertEqual(latencies['http://localhost:5000']['samples'], 10)
+    self.assertAlmostEqual(latencies['http://localhost:5000']['p50_s'], 0.05, delta=0.003)
+    self.assertAlmostEqual(latencies['http://localhost:5000']['p99_s'], 0.1, delta=0.005)
+    self.assertIsNone(latencies['http://localhost:5000']['baseline_s'])
+
+    response = self.server.get('/metrics')
+    self.assertIn('ok_monitor_probe_duration_seconds_count{server_url="http://localhost:5000"} 10',
+                  response.data)
+
+  def test_handle_latency_regression_alert(self):
+    with mock.patch('requests.post') as mock_post:
+      ok_monitor.start(['http://localhost:5000', 'http://test.com'])
+      monitor.alert('2 servers are slowing down', 'ok_monitor_latency_regression', {
+        'regressions': [('http://localhost:5001', 0.25, 0.0201), ('http://localhost:5002', 6, None)],
+        'percentile': 95.0,
+        'latency_threshold_s': 5.0,
+        'latency_regression_multiplier': 3.0,
+      })
+      monitor.outbox.retry_timer.mock_tick(0)
+
+    html = re.sub(r'\s+', ' ', mock_post.call_args[1]['data']['html'])
+    self.assertIn('The p95 latency', html)
+    self.assertIn('<td>http://localhost:5001</td> <td>0.250s</td> <td>0.020s</td>', html)
+    self.assertIn('<td>http://localhost:5002</td> <td>6.000s</td> <td>Not enough samples yet</td>',
+                  html)
+
+  def test_handle_failures_alert(self):
+    with mock.patch('requests.post') as mock_post:
+      ok_monitor.start(['http://localhost:5000', 'http://test.com'])
+      monitor.alert('2 servers are failing', 'ok_monitor_failures', {
+        'failures': [
+          ('http://localhost:5001', 'ok_monitor_timing_out',
+           {'url': 'http://localhost:5001/ok', 'ok_timeout_s': 5.0}),
+          ('http://localhost:5002', 'ok_monitor_not_ok',
+           {'url': 'http://localhost:5002/ok', 'status_code': 500, 'text': 'server error'}),
+        ],
+      })
+      monitor.outbox.retry_timer.mock_tick(0)
+
+    html = mock_post.call_args[1]['data']['html']
+    self.assertIn('Request for "http://localhost:5001/ok" timed out after 5.0s.', html)
+    self.assertIn('Received 500 HTTP code from "http://localhost:5002/ok"', html)
+
 
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,221 @@
+import collections
+import json
+import logging
+import os
+import threading
+import uuid
+
+MIN_RETRY_PERIOD_S = 1.0
+MAX_RETRY_PERIOD_S = 60 * 60.0
+# The number of times a message may fail while others are delivered before it's dead-lettered.
+MAX_ATTEMPTS = 10
+# The number of failures in a row after which delivery stops until the next retry, since the service
+# is then likely down and each further message would only wait out a timeout.
+MAX_CONSECUTIVE_FAILURES = 2
+
+path, send_fn, fsync_period_s, journal, entries, retry_period_s, retry_timer, fsync_timer = (
+    '', None, 0.0, None, collections.OrderedDict(), MIN_RETRY_PERIOD_S, None, None)
+
+attempts = collections.Counter()
+
+lock = threading.RLock()
+# Held for a whole sender pass, so that passes never overlap.
+send_lock = threading.Lock()
+logger = logging.getLogger('monitor.outbox')
+
+
+# Raised by send functions for messages that will never be accepted, e.g. on a 4xx from Mailgun, so
+# that they're dead-lettered rather than retried.
+class PermanentError(Exception):
+  pass
+
+
+def open_journal(raw_path, raw_send_fn, raw_fsync_period_s=1.0):
+  global path, send_fn, fsync_period_s, journal
+  close()
+  path, send_fn, fsync_period_s = raw_path, raw_send_fn, raw_fsync_period_s
+  with lock:
+    replay()
+    journal = open(path, 'a')
+  if entries:
+    logger.warning('Replaying %s undelivered message(s) from "%s".', len(entries), path)
+    schedule_retry(0)
+
+
+def replay():
+  # Rebuild the set of undelivered entries from the journal, then compact it so that delivered
+  # entries don't accumulate across restarts.
+  entries.clear()
+  if os.path.exists(path):
+    with open(path, 'r') as f:
+      for line in f:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          # A torn write from a crash can only affect the final line, which was never delivered.
+          logger.warning('Skipping corrupt outbox record: "%s"', line.rstrip())
+          continue
+        if record.get('delivered') or record.get('dead'):
+          entries.pop(record['id'], None)
+        else:
+          entries[record['id']] = record['message']
+
+  compacted_path = '%s.tmp' % path
+  with open(compacted_path, 'w') as f:
+    for entry_id, message in entries.iteritems():
+      f.write(json.dumps({'id': entry_id, 'message': message}) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+  os.rename(compacted_path, path)
+
+
+def put(message):
+  entry_id = uuid.uuid4().hex
+  with lock:
+    entries[entry_id] = message
+    write({'id': entry_id, 'message': message})
+  return entry_id
+
+
+def wake():
+  # Starts a sender pass for newly put messages, unless one is already scheduled or running, in
+  # which case that pass picks them up. Callers never wait on sending.
+  with lock:
+    if not retry_timer:
+      schedule_retry(0)
+
+
+def deliver():
+  # Returns whether every message was delivered. A message that fails is moved to the back of the
+  # queue so that it can't hold up the others. Messages are sent outside the lock, so that put() and
+  # sync() don't wait on the service.
+  global retry_period_s, retry_timer
+  with send_lock:
+    with lock:
+      pending_entries, sender = entries.items(), send_fn
+    delivered_count, failed_entry_ids, is_all_delivered = 0, [], True
+    consecutive_failures = 0
+    for entry_id, message in pending_entries:
+      try:
+        sender(message)
+      except PermanentError as e:
+        logger.error('Outbox message %s was rejected: %s', entry_id, e)
+        is_all_delivered = False
+        with lock:
+          if entry_id in entries:
+            dead_letter(entry_id, str(e))
+        continue
+      except Exception:
+        logger.exception('Failed to deliver outbox message %s. Retrying in %ss.',
+                         entry_id, retry_period_s)
+        is_all_delivered = False
+        with lock:
+          if entry_id in entries:
+            entries[entry_id] = entries.pop(entry_id)
+            failed_entry_ids.append(entry_id)
+        consecutive_failures += 1
+        if consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+          break
+        continue
+
+      delivered_count += 1
+      consecutive_failures = 0
+      with lock:
+        if entry_id in entries:
+          remove(entry_id, {'id': entry_id, 'delivered': True})
+
+    with lock:
+      # Failures while other messages are delivered are down to the message rather than the service.
+      if delivered_count:
+        for entry_id in failed_entry_ids:
+          attempts[entry_id] += 1
+          if attempts[entry_id] >= MAX_ATTEMPTS and entry_id in entries:
+            logger.error('Giving up on outbox message %s after %s attempts.', entry_id,
+                         attempts[entry_id])
+            dead_letter(entry_id, 'Failed %s delivery attempts' % attempts[entry_id])
+
+      # Only failed passes back off, however many messages are put in the meantime.
+      if any(entry_id in entries for entry_id in failed_entry_ids):
+        schedule_retry(retry_period_s)
+        retry_period_s = min(retry_period_s * 2, MAX_RETRY_PERIOD_S)
+      else:
+        retry_period_s = MIN_RETRY_PERIOD_S
+        if entries:
+          # Messages put while this pass was sending.
+          schedule_retry(0)
+        elif retry_timer:
+          retry_timer.cancel()
+          retry_timer = None
+      return is_all_delivered
+
+
+def dead_letter(entry_id, error):
+  # Keeps undeliverable messages in a separate file for inspection, out of the journal's way.
+  try:
+    with open('%s.dead' % path, 'a') as f:
+      f.write(json.dumps({'id': entry_id, 'message': entries[entry_id], 'error': error}) + '\n')
+  except EnvironmentError:
+    logger.exception('Failed to dead-letter outbox message %s.', entry_id)
+  remove(entry_id, {'id': entry_id, 'dead': True})
+
+
+def remove(entry_id, record):
+  del entries[entry_id]
+  attempts.pop(entry_id, None)
+  if entries:
+    write(record)
+  elif journal:
+    # Nothing left to replay, so the whole journal can be dropped.
+    journal.truncate(0)
+
+
+def write(record):
+  global fsync_timer
+  if not journal:
+    return
+  try:
+    journal.write(json.dumps(record) + '\n')
+    journal.flush()
+  except EnvironmentError:
+    # Messages are still held and sent from memory, but won't survive a restart, e.g. on a full disk.
+    logger.exception('Failed to journal outbox record for message %s.', record['id'])
+    return
+  # Batch fsyncs so that a burst of alerts costs one disk sync rather than one per alert.
+  if not fsync_timer:
+    fsync_timer = threading.Timer(fsync_period_s, sync)
+    fsync_timer.start()
+
+
+def sync():
+  global fsync_timer
+  with lock:
+    fsync_timer = None
+    if journal:
+      journal.flush()
+      os.fsync(journal.fileno())
+
+
+def schedule_retry(delay_s):
+  global retry_timer
+  with lock:
+    if retry_timer:
+      retry_timer.cancel()
+    retry_timer = threading.Timer(delay_s, deliver)
+    retry_timer.start()
+
+
+def close():
+  global path, send_fn, journal, retry_period_s, retry_timer, fsync_timer
+  with lock:
+    if retry_timer:
+      retry_timer.cancel()
+    if fsync_timer:
+      fsync_timer.cancel()
+    if journal:
+      journal.flush()
+      os.fsync(journal.fileno())
+      journal.close()
+    entries.clear()
+    attempts.clear()
+    path, send_fn, journal, retry_period_s, retry_timer, fsync_timer = (
+        '', None, None, MIN_RETRY_PERIOD_S, None, None)
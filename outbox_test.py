@@ -0,0 +1,217 @@
+import json
+import mock
+import mocks
+import os
+import outbox
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+
+class OutboxTest(unittest.TestCase):
+  def setUp(self):
+    mock.patch('threading.Timer', mocks.MockTimer).start()
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'test.outbox')
+    self.send = mock.Mock()
+
+  def tearDown(self):
+    mock.patch.stopall()
+    outbox.close()
+    shutil.rmtree(self.dir)
+
+  def read_records(self):
+    with open(self.path, 'r') as f:
+      return [json.loads(line) for line in f]
+
+  def test_put_journals_before_sending(self):
+    outbox.open_journal(self.path, self.send)
+
+    entry_id = outbox.put({'subject': 'a'})
+    self.send.assert_not_called()
+    self.assertEqual(self.read_records(), [{'id': entry_id, 'message': {'subject': 'a'}}])
+
+  def test_deliver_sends_in_order_and_truncates_journal(self):
+    outbox.open_journal(self.path, self.send)
+
+    outbox.put({'subject': 'a'})
+    outbox.put({'subject': 'b'})
+    self.assertTrue(outbox.deliver())
+    self.send.assert_has_calls([mock.call({'subject': 'a'}), mock.call({'subject': 'b'})])
+    self.assertEqual(self.read_records(), [])
+
+  def test_deliver_failure_retries_with_backoff(self):
+    self.send.side_effect = Exception('send failed')
+    outbox.open_journal(self.path, self.send)
+
+    outbox.put({'subject': 'a'})
+    self.assertFalse(outbox.deliver())
+    self.assertEqual(outbox.retry_timer.seconds, 1.0)
+
+    outbox.retry_timer.mock_tick(1.0)
+    self.assertEqual(outbox.retry_timer.seconds, 2.0)
+    self.assertEqual(self.send.call_count, 2)
+
+    self.send.side_effect = None
+    outbox.retry_timer.mock_tick(2.0)
+    self.assertEqual(self.send.call_count, 3)
+    self.assertEqual(outbox.entries, {})
+    self.assertEqual(outbox.retry_period_s, outbox.MIN_RETRY_PERIOD_S)
+
+  def test_partial_delivery_marks_delivered_entries(self):
+    self.send.side_effect = [None, Exception('send failed')]
+    outbox.open_journal(self.path, self.send)
+
+    entry_id_a = outbox.put({'subject': 'a'})
+    entry_id_b = outbox.put({'subject': 'b'})
+    self.assertFalse(outbox.deliver())
+    self.assertEqual(self.read_records(), [
+      {'id': entry_id_a, 'message': {'subject': 'a'}},
+      {'id': entry_id_b, 'message': {'subject': 'b'}},
+      {'id': entry_id_a, 'delivered': True},
+    ])
+
+  def read_dead_letters(self):
+    with open(self.path + '.dead', 'r') as f:
+      return [json.loads(line) for line in f]
+
+  def test_rejected_messages_are_dead_lettered(self):
+    def send(message):
+      if message['subject'] == 'rejected':
+        raise outbox.PermanentError('400: bad address')
+    self.send.side_effect = send
+    outbox.open_journal(self.path, self.send)
+
+    rejected_entry_id = outbox.put({'subject': 'rejected'})
+    self.assertFalse(outbox.deliver())
+    for subject in 'abcde':
+      outbox.put({'subject': subject})
+      self.assertTrue(outbox.deliver())
+
+    self.assertEqual(self.send.call_count, 6)
+    self.assertEqual(outbox.entries, {})
+    self.assertIsNone(outbox.retry_timer)
+    self.assertEqual(self.read_dead_letters(), [{
+      'id': rejected_entry_id,
+      'message': {'subject': 'rejected'},
+      'error': '400: bad address',
+    }])
+    outbox.close()
+    outbox.open_journal(self.path, self.send)
+    self.assertEqual(outbox.entries, {})
+
+  def test_failing_message_doesnt_hold_up_others(self):
+    def send(message):
+      if message['subject'] == 'failing':
+        raise Exception('500: internal error')
+    self.send.side_effect = send
+    outbox.open_journal(self.path, self.send)
+
+    failing_entry_id = outbox.put({'subject': 'failing'})
+    self.assertFalse(outbox.deliver())
+    for i in xrange(outbox.MAX_ATTEMPTS - 1):
+      outbox.put({'subject': str(i)})
+      self.assertFalse(outbox.deliver())
+      self.assertEqual(outbox.entries.keys(), [failing_entry_id])
+
+    outbox.put({'subject': 'last'})
+    self.assertFalse(outbox.deliver())
+
+    self.assertEqual(outbox.entries, {})
+    self.assertEqual([record['id'] for record in self.read_dead_letters()], [failing_entry_id])
+    self.assertEqual(self.read_records(), [])
+
+  def test_outage_stops_at_first_failure(self):
+    self.send.side_effect = Exception('connection refused')
+    outbox.open_journal(self.path, self.send)
+
+    entry_ids = [outbox.put({'subject': subject}) for subject in 'abc']
+    self.assertFalse(outbox.deliver())
+
+    self.send.assert_has_calls([mock.call({'subject': 'a'}), mock.call({'subject': 'b'})])
+    self.assertEqual(self.send.call_count, 2)
+    # Messages aren't given up on while nothing can be delivered.
+    for _ in xrange(outbox.MAX_ATTEMPTS):
+      outbox.retry_timer.mock_tick(outbox.MAX_RETRY_PERIOD_S)
+    self.assertEqual(sorted(outbox.entries.keys()), sorted(entry_ids))
+    self.assertFalse(os.path.exists(self.path + '.dead'))
+
+  def test_wake_only_backs_off_on_failed_passes(self):
+    self.send.side_effect = Exception('connection refused')
+    outbox.open_journal(self.path, self.send)
+
+    outbox.put({'subject': 'a'})
+    outbox.wake()
+    self.send.assert_not_called()
+    outbox.retry_timer.mock_tick(0)
+    self.assertEqual(self.send.call_count, 1)
+    retry_timer = outbox.retry_timer
+    self.assertEqual(retry_timer.seconds, 1.0)
+
+    # Later messages wait for the pending retry rather than resetting it.
+    for subject in 'bcdef':
+      outbox.put({'subject': subject})
+      outbox.wake()
+    self.assertIs(outbox.retry_timer, retry_timer)
+    self.assertEqual(outbox.retry_period_s, 2.0)
+    self.assertEqual(self.send.call_count, 1)
+
+  def test_put_doesnt_wait_on_sending(self):
+    def send(message):
+      put_thread = threading.Thread(target=outbox.put, args=({'subject': 'b'},))
+      put_thread.start()
+      put_thread.join(1.0)
+      self.assertFalse(put_thread.is_alive())
+    self.send.side_effect = send
+    outbox.open_journal(self.path, self.send)
+
+    outbox.put({'subject': 'a'})
+    self.assertTrue(outbox.deliver())
+    # The message put while sending is picked up by a pass of its own.
+    self.assertEqual(outbox.entries.values(), [{'subject': 'b'}])
+    self.assertEqual(outbox.retry_timer.seconds, 0)
+
+  def test_journal_failure_still_sends_from_memory(self):
+    outbox.open_journal(self.path, self.send)
+
+    journal = mock.Mock(**{'write.side_effect': IOError('No space left on device')})
+    with mock.patch('outbox.journal', journal):
+      outbox.put({'subject': 'a'})
+    self.assertTrue(outbox.deliver())
+    self.send.assert_called_once_with({'subject': 'a'})
+
+  def test_open_replays_undelivered_entries(self):
+    with open(self.path, 'w') as f:
+      f.write(json.dumps({'id': '1', 'message': {'subject': 'a'}}) + '\n')
+      f.write(json.dumps({'id': '2', 'message': {'subject': 'b'}}) + '\n')
+      f.write(json.dumps({'id': '1', 'delivered': True}) + '\n')
+      f.write('{"id": "3", "mess')
+
+    outbox.open_journal(self.path, self.send)
+    self.assertEqual(outbox.entries.keys(), ['2'])
+    self.assertEqual(self.read_records(), [{'id': '2', 'message': {'subject': 'b'}}])
+
+    outbox.retry_timer.mock_tick(0)
+    self.send.assert_called_once_with({'subject': 'b'})
+    self.assertEqual(self.read_records(), [])
+
+  def test_writes_share_one_batched_fsync(self):
+    outbox.open_journal(self.path, self.send, 5.0)
+
+    with mock.patch('os.fsync') as mock_fsync:
+      outbox.put({'subject': 'a'})
+      fsync_timer = outbox.fsync_timer
+      outbox.put({'subject': 'b'})
+      outbox.put({'subject': 'c'})
+      self.assertIs(outbox.fsync_timer, fsync_timer)
+      mock_fsync.assert_not_called()
+
+      fsync_timer.mock_tick(5.0)
+      self.assertEqual(mock_fsync.call_count, 1)
+      self.assertIsNone(outbox.fsync_timer)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,342 @@
+# Simulates a geofence monitor polling a fleet under a virtual clock, so that --poll_period_s,
+# --max_query_qps and --min_poll_padding_period_s can be tuned offline. The monitor's own scheduling,
+# silencing, throttling, rate limiting and alert dispatch all run for real; only the car status
+# server and Mailgun are simulated, and they advance the clock rather than taking wall time.
+#
+#   python simulation.py --cars=10000 --days=7 --poll_period_s=600 --max_query_qps=20
+import argparse
+import bisect
+import functools
+import geofence_monitor
+import heapq
+import history
+import itertools
+import json
+import mock
+import mocks
+import monitor
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+SIMULATION_EPOCH = 1500000000.0
+# Matches the timeout of geofence_monitor.poll's status requests.
+FETCH_TIMEOUT_S = 10.0
+MIN_POOL_SIZE = 2 ** 16
+
+OK, OUT_OF_BOUNDS, ERROR, TIMEOUT = range(4)
+
+
+# A MockTime that also keeps the pending MockTimers in a queue, firing them in time order. Everything
+# runs on the thread calling run_until, so a timer that comes due while a poll is running fires as
+# soon as the poll finishes.
+class Clock(mocks.MockTime):
+  def __init__(self, now=SIMULATION_EPOCH):
+    mocks.MockTime.__init__(self)
+    self.now = now
+    self.timers = []
+    self.timer_ids = itertools.count()
+
+  def sleep(self, seconds):
+    self.mock_tick(max(0, seconds))
+
+  def Timer(self, seconds, fn):
+    return Timer(self, seconds, fn)
+
+  def run_until(self, end_time):
+    while self.timers and self.timers[0][0] < end_time:
+      fire_time, _, timer = heapq.heappop(self.timers)
+      if not timer.has_stopped:
+        self.now = max(self.now, fire_time)
+        timer.fire()
+    self.now = max(self.now, end_time)
+
+
+class Timer(mocks.MockTimer):
+  def __init__(self, clock, seconds, fn):
+    mocks.MockTimer.__init__(self, seconds, fn)
+    self.clock = clock
+
+  def start(self):
+    mocks.MockTimer.start(self)
+    heapq.heappush(self.clock.timers,
+                   (self.clock.now + self.seconds, next(self.clock.timer_ids), self))
+
+  def fire(self):
+    self.has_stopped = True
+    self.fn()
+
+
+class Response(object):
+  def __init__(self, status_code, geojson=None):
+    self.status_code = status_code
+    self.geojson = geojson
+    self.text = json.dumps(geojson) if geojson else 'Internal Server Error'
+
+  def json(self):
+    return self.geojson
+
+
+# Stands in for shapely geometry, taking each geofence's verdict from the simulated response.
+class Shape(object):
+  def __init__(self, geometry):
+    self.geometry = geometry
+
+  def contains(self, other):
+    return self.geometry.get('contains_car', False)
+
+
+# Simulates the car status server and Mailgun. Each status request's outcome and latency (from a
+# log-normal distribution, plus the monitor's own processing time) are drawn up front into a pool,
+# and each cycle consumes a run of the pool starting at a random offset. That lets the model poll
+# sum a whole cycle's throttled request times from prefix sums rather than stepping through cars.
+class Fleet(object):
+  def __init__(self, clock, cars, median_fetch_s=0.2, fetch_sigma=0.5, processing_s=0.001,
+               error_rate=0.001, timeout_rate=0.0001, out_of_bounds_share=0.001, mailgun_s=0.5,
+               seed=0):
+    self.clock = clock
+    self.cars = cars
+    self.median_fetch_s = median_fetch_s
+    self.fetch_sigma = fetch_sigma
+    self.processing_s = processing_s
+    self.error_rate = error_rate
+    self.timeout_rate = timeout_rate
+    self.out_of_bounds_share = out_of_bounds_share
+    self.mailgun_s = mailgun_s
+    self.random = random.Random(seed)
+    self.emails = []
+    self.offset, self.next_index = 0, 0
+
+  def fill_pool(self, query_delay_s):
+    pool_size = max(MIN_POOL_SIZE, 2 * self.cars)
+    self.outcomes, self.request_times_s = [], []
+    for _ in xrange(pool_size):
+      request_s = self.random.lognormvariate(0, self.fetch_sigma) * self.median_fetch_s
+      draw = self.random.random()
+      if draw < self.timeout_rate or request_s >= FETCH_TIMEOUT_S:
+        self.outcomes.append(TIMEOUT)
+        self.request_times_s.append(FETCH_TIMEOUT_S)
+        continue
+      draw -= self.timeout_rate
+      self.outcomes.append(ERROR if draw < self.error_rate else
+                           OUT_OF_BOUNDS if draw < self.error_rate + self.out_of_bounds_share else
+                           OK)
+      self.request_times_s.append(request_s + self.processing_s)
+    # Wrap around so that any run of up to pool_size requests is contiguous.
+    self.outcomes += self.outcomes
+    self.request_times_s += self.request_times_s
+
+    # Errors and timeouts skip geofence_monitor.poll's throttling.
+    self.cumulative_times_s = [0.0]
+    for outcome, request_s in itertools.izip(self.outcomes, self.request_times_s):
+      cycle_s = max(request_s, query_delay_s) if outcome in (OK, OUT_OF_BOUNDS) else request_s
+      self.cumulative_times_s.append(self.cumulative_times_s[-1] + cycle_s)
+    self.failure_indexes = [i for i, outcome in enumerate(self.outcomes) if outcome != OK]
+
+  def start_cycle(self):
+    self.offset, self.next_index = self.random.randrange(len(self.outcomes) / 2), 0
+
+  def model_poll(self):
+    # Equivalent to geofence_monitor.poll against this fleet, but O(failures) rather than O(cars).
+    self.start_cycle()
+    car_ids = monitor.args.car_ids
+    end = self.offset + len(car_ids)
+    self.clock.now += self.cumulative_times_s[end] - self.cumulative_times_s[self.offset]
+
+    out_of_bounds_car_coords, car_errors = [], []
+    for i in self.failure_indexes[bisect.bisect_left(self.failure_indexes, self.offset):
+                                  bisect.bisect_left(self.failure_indexes, end)]:
+      car_id = car_ids[i - self.offset]
+      if self.outcomes[i] == OUT_OF_BOUNDS:
+        out_of_bounds_car_coords.append((car_id, self.car_coords(car_id)))
+      else:
+        car_errors.append((car_id, 'FETCH_TIMED_OUT' if self.outcomes[i] == TIMEOUT
+                                   else 'INVALID_FETCH_RESPONSE'))
+    geofence_monitor.finish_poll(out_of_bounds_car_coords, car_errors)
+
+  def get(self, url, timeout=None):
+    # Replaces requests.get for geofence_monitor.poll, returning the pool's next outcome.
+    import requests.exceptions
+
+    i = self.offset + self.next_index
+    self.next_index += 1
+    car_id = int(url.rsplit('/', 1)[-1])
+    self.clock.sleep(self.request_times_s[i])
+    if self.outcomes[i] == TIMEOUT:
+      raise requests.exceptions.Timeout()
+    if self.outcomes[i] == ERROR:
+      return Response(500)
+    return Response(200, {
+      'type': 'FeatureCollection',
+      'features': [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': self.car_coords(car_id)},
+        'properties': {'id': car_id},
+      }, {
+        'type': 'Feature',
+        'geometry': {'type': 'Polygon', 'contains_car': self.outcomes[i] == OK},
+        'properties': {},
+      }],
+    })
+
+  def car_coords(self, car_id):
+    return [-122.42 + car_id % 100 * 0.001, 37.77 + car_id / 100 % 100 * 0.001]
+
+  def post(self, url, auth=None, data={}, timeout=None):
+    # Replaces requests.post for Mailgun.
+    self.clock.sleep(self.mailgun_s)
+    self.emails.append((self.clock.now, data['subject']))
+    return mock.Mock(status_code=200)
+
+
+def simulate(raw_args, fleet, duration_s, mode='model', silences=()):
+  # Runs geofence_monitor with raw_args against the fleet for duration_s of virtual time, silencing
+  # it for each (offset_s, duration_s) in silences, and returns a summary of how it kept up.
+  clock = fleet.clock
+  start_time = clock.now
+  work_dir = tempfile.mkdtemp()
+  monitor.server.config['TESTING'] = True
+  patches = [
+    mock.patch('threading.Timer', clock.Timer),
+    mock.patch('monitor.time', clock),
+    mock.patch('geofence_monitor.time', clock),
+    mock.patch('requests.post', fleet.post),
+  ]
+  if mode == 'model':
+    patches.append(mock.patch('geofence_monitor.poll', fleet.model_poll))
+  else:
+    @functools.wraps(geofence_monitor.poll)
+    def poll(poll=geofence_monitor.poll):
+      fleet.start_cycle()
+      poll()
+    patches += [
+      mock.patch('geofence_monitor.poll', poll),
+      mock.patch('requests.get', fleet.get),
+      mock.patch('shapely.geometry.shape', Shape),
+    ]
+  for patch in patches:
+    patch.start()
+  try:
+    geofence_monitor.start([
+      '0-%s' % (fleet.cars - 1),
+      'http://localhost:5000',
+      '--log=WARNING',
+      '--log_file_prefix=%s' % os.path.join(work_dir, 'simulation'),
+      '--outbox_file=%s' % os.path.join(work_dir, 'simulation.outbox'),
+      '--state_file=:memory:',
+      '--track_dir=',
+    ] + raw_args)
+    fleet.fill_pool(monitor.args.query_delay_s)
+    # Cycles start at most once per period, besides the immediate poll after each unsilence.
+    monitor.poll_history = history.RingBuffer(
+        int(duration_s / monitor.args.poll_period_s) + len(silences) + 2)
+    silenced_periods = []
+    for offset_s, silence_s in silences:
+      clock.Timer(offset_s, functools.partial(monitor.silence, silence_s)).start()
+      silenced_periods.append((start_time + offset_s, start_time + offset_s + silence_s))
+
+    wall_start_time = time.time()
+    clock.run_until(start_time + duration_s)
+    wall_time_s = time.time() - wall_start_time
+    return summarize(monitor.poll_history.cycles(), monitor.args.poll_period_s,
+                     monitor.args.min_poll_padding_period_s, silenced_periods, fleet.emails,
+                     dict(monitor.alerts_total.children), wall_time_s)
+  finally:
+    monitor.reset()
+    for patch in reversed(patches):
+      patch.stop()
+    shutil.rmtree(work_dir)
+
+
+def summarize(cycles, poll_period_s, min_poll_padding_period_s, silenced_periods, emails,
+              alert_counters, wall_time_s):
+  # A deadline is missed for each whole poll period that passes without a poll starting, other than
+  # while silenced.
+  deadline_misses = 0
+  for cycle, next_cycle in zip(cycles, cycles[1:]):
+    if any(start < next_cycle['start_time'] and end > cycle['start_time']
+           for start, end in silenced_periods):
+      continue
+    gap_s = next_cycle['start_time'] - cycle['start_time']
+    deadline_misses += int(gap_s / poll_period_s - 1e-9)
+
+  overruns = sum(1 for cycle in cycles if cycle['slack_s'] < 0)
+  alerts = {}
+  for (template, outcome), counter in alert_counters.iteritems():
+    alerts.setdefault(template[:-len('_alert.html')], {})[outcome] = int(counter.value)
+  return {
+    'cycles': len(cycles),
+    'overruns': overruns,
+    'overrun_frequency': float(overruns) / len(cycles) if cycles else 0.0,
+    'near_overruns': sum(1 for cycle in cycles
+                         if 0 <= cycle['slack_s'] <= min_poll_padding_period_s),
+    'deadline_misses': deadline_misses,
+    'mean_duration_s': sum(cycle['duration_s'] for cycle in cycles) / len(cycles) if cycles else 0.0,
+    'max_duration_s': max(cycle['duration_s'] for cycle in cycles) if cycles else 0.0,
+    'min_slack_s': min(cycle['slack_s'] for cycle in cycles) if cycles else 0.0,
+    'car_errors': sum(cycle['errors'] for cycle in cycles),
+    'alerts': alerts,
+    'emails': len(emails),
+    'wall_time_s': wall_time_s,
+  }
+
+
+def parse_silence(arg):
+  offset_s, duration_s = arg.split(':')
+  return float(offset_s), float(duration_s)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Simulates a geofence monitor under a virtual clock. Any other arguments (e.g. '
+                  '--poll_period_s and --max_query_qps) are passed to the monitor.')
+  parser.add_argument('--cars', type=int, default=10000, help='The number of cars to poll')
+  parser.add_argument('--days', type=float, default=7, help='The number of days to simulate')
+  parser.add_argument('--mode', choices=('model', 'full'), default='model',
+                      help='Whether to model each cycle from prefix sums or run '
+                           'geofence_monitor.poll car by car')
+  parser.add_argument('--median_fetch_s', type=float, default=0.2,
+                      help='The median latency (in seconds) of a car status request')
+  parser.add_argument('--fetch_sigma', type=float, default=0.5,
+                      help='The log-normal shape of car status request latencies')
+  parser.add_argument('--processing_s', type=float, default=0.001,
+                      help='The time (in seconds) the monitor spends processing each status')
+  parser.add_argument('--error_rate', type=float, default=0.001,
+                      help='The share of car status requests that fail')
+  parser.add_argument('--timeout_rate', type=float, default=0.0001,
+                      help='The share of car status requests that time out')
+  parser.add_argument('--out_of_bounds_share', type=float, default=0.001,
+                      help='The share of car statuses that are outside their geofences')
+  parser.add_argument('--mailgun_s', type=float, default=0.5,
+                      help='The time (in seconds) that sending an alert email takes')
+  parser.add_argument('--silence', type=parse_silence, action='append', default=[],
+                      dest='silences', metavar='OFFSET_S:DURATION_S',
+                      help='Silences the monitor OFFSET_S into the simulation for DURATION_S')
+  parser.add_argument('--seed', type=int, default=0, help='The random seed')
+  parser.add_argument('--output', help='A file to which to write the summary as JSON')
+  simulation_args, monitor_args = parser.parse_known_args()
+
+  fleet = Fleet(Clock(), simulation_args.cars, simulation_args.median_fetch_s,
+                simulation_args.fetch_sigma, simulation_args.processing_s,
+                simulation_args.error_rate, simulation_args.timeout_rate,
+                simulation_args.out_of_bounds_share, simulation_args.mailgun_s,
+                simulation_args.seed)
+  # Keep the monitor's own log output out of the summary.
+  sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+  try:
+    summary = simulate(monitor_args, fleet, simulation_args.days * 24 * 60 * 60,
+                       simulation_args.mode, simulation_args.silences)
+  finally:
+    sys.stdout = stdout
+  print(json.dumps(summary, indent=2, sort_keys=True))
+  if simulation_args.output:
+    with open(simulation_args.output, 'w') as f:
+      json.dump(dict(summary, simulation_args=vars(simulation_args), monitor_args=monitor_args), f,
+                indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,111 @@
+import mock
+import monitor
+import simulation
+import unittest
+
+
+class SimulationTest(unittest.TestCase):
+  def setUp(self):
+    mock.patch('sys.stdout').start()
+
+  def tearDown(self):
+    mock.patch.stopall()
+
+  def test_clock_fires_timers_in_order(self):
+    clock = simulation.Clock(now=0.0)
+    fired = []
+    clock.Timer(2, lambda: fired.append(('b', clock.time()))).start()
+    clock.Timer(1, lambda: fired.append(('a', clock.time()))).start()
+    cancelled = clock.Timer(1.5, lambda: fired.append(('cancelled', clock.time())))
+    cancelled.start()
+    cancelled.cancel()
+    clock.Timer(5, lambda: fired.append(('late', clock.time()))).start()
+
+    clock.run_until(3)
+
+    self.assertEqual(fired, [('a', 1), ('b', 2)])
+    self.assertEqual(clock.time(), 3)
+
+  def test_clock_fires_timers_due_during_a_sleep_afterwards(self):
+    clock = simulation.Clock(now=0.0)
+    fired = []
+    clock.Timer(1, lambda: clock.sleep(5)).start()
+    clock.Timer(2, lambda: fired.append(clock.time())).start()
+
+    clock.run_until(10)
+
+    self.assertEqual(fired, [6])
+
+  def test_model_matches_full(self):
+    def run(mode):
+      fleet = simulation.Fleet(simulation.Clock(), 200, error_rate=0.01, timeout_rate=0.005,
+                               out_of_bounds_share=0.02, seed=1)
+      summary = simulation.simulate(['--poll_period_s=60', '--max_query_qps=5'], fleet, 3600,
+                                    mode)
+      return summary, fleet.emails
+
+    model_summary, model_emails = run('model')
+    full_summary, full_emails = run('full')
+
+    for key in ('cycles', 'overruns', 'near_overruns', 'deadline_misses', 'car_errors', 'alerts',
+                'emails'):
+      self.assertEqual(model_summary[key], full_summary[key], key)
+    for key in ('mean_duration_s', 'max_duration_s', 'min_slack_s'):
+      self.assertAlmostEqual(model_summary[key], full_summary[key], places=3)
+    self.assertEqual([subject for _, subject in model_emails],
+                     [subject for _, subject in full_emails])
+
+  def test_keeping_up(self):
+    fleet = simulation.Fleet(simulation.Clock(), 1000, median_fetch_s=0.05, fetch_sigma=0.1,
+                             error_rate=0, timeout_rate=0, out_of_bounds_share=0)
+
+    summary = simulation.simulate(['--poll_period_s=300', '--max_query_qps=10'], fleet, 86400)
+
+    self.assertEqual(summary['cycles'], 288)
+    self.assertEqual(summary['overruns'], 0)
+    self.assertEqual(summary['near_overruns'], 0)
+    self.assertEqual(summary['deadline_misses'], 0)
+    self.assertEqual(summary['alerts'], {})
+    self.assertAlmostEqual(summary['mean_duration_s'], 100, delta=1)
+
+  def test_alerting_every_cycle_doesnt_delay_the_next(self):
+    fleet = simulation.Fleet(simulation.Clock(), 1000, median_fetch_s=0.05, fetch_sigma=0.1,
+                             error_rate=0, timeout_rate=0, out_of_bounds_share=0.01, mailgun_s=5)
+
+    summary = simulation.simulate(['--poll_period_s=300', '--max_query_qps=10'], fleet, 86400)
+
+    self.assertEqual(summary['cycles'], 288)
+    self.assertEqual(summary['deadline_misses'], 0)
+    self.assertEqual(summary['alerts']['geofence_monitor_geofence']['queued'], 288)
+
+  def test_overrunning(self):
+    fleet = simulation.Fleet(simulation.Clock(), 1000, median_fetch_s=0.05, fetch_sigma=0.1,
+                             error_rate=0, timeout_rate=0, out_of_bounds_share=0)
+
+    summary = simulation.simulate(['--poll_period_s=300', '--max_query_qps=2',
+                                   '--alert_refill_period_s=3600'], fleet, 86400)
+
+    # Each 500s cycle misses the deadline of the cycle after it, and the burst of 5 overrun alerts
+    # is followed by one an hour.
+    self.assertEqual(summary['cycles'], 173)
+    self.assertEqual(summary['overruns'], 173)
+    self.assertEqual(summary['overrun_frequency'], 1.0)
+    self.assertEqual(summary['deadline_misses'], 172)
+    self.assertEqual(summary['alerts']['monitor_overrunning'], {'queued': 28, 'suppressed': 145})
+    self.assertEqual(summary['emails'], 28)
+
+  def test_silences(self):
+    fleet = simulation.Fleet(simulation.Clock(), 1000, median_fetch_s=0.05, fetch_sigma=0.1,
+                             error_rate=0, timeout_rate=0, out_of_bounds_share=0)
+
+    summary = simulation.simulate(['--poll_period_s=300', '--max_query_qps=10'], fleet, 86400,
+                                  silences=[(3600, 7200)])
+
+    # The 24 cycles due while silenced are skipped, and polling resumes on unsilencing.
+    self.assertEqual(summary['cycles'], 288 - 24)
+    self.assertEqual(summary['deadline_misses'], 0)
+    self.assertFalse(monitor.args)
+
+
+if __name__ == '__main__':
+  unittest.main()
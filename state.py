@@ -0,0 +1,65 @@
+import json
+import logging
+import sqlite3
+import threading
+
+path, connection, values, dirty_keys = '', None, {}, set()
+
+lock = threading.RLock()
+logger = logging.getLogger('monitor.state')
+
+
+def open_state(raw_path):
+  global path, connection
+  close()
+  with lock:
+    path = raw_path
+    connection = sqlite3.connect(path, check_same_thread=False)
+    with connection:
+      connection.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+    for key, value in connection.execute('SELECT key, value FROM state'):
+      values[key] = json.loads(value)
+  if values:
+    logger.info('Restored %s state value(s) from "%s".', len(values), path)
+
+
+def get(key, default=None):
+  return values.get(key, default)
+
+
+def put(key, value):
+  with lock:
+    values[key] = value
+    dirty_keys.add(key)
+
+
+def delete(key):
+  put(key, None)
+
+
+def checkpoint():
+  # Writes every value changed since the last checkpoint in a single transaction, so a crash
+  # leaves either the previous checkpoint or this one, never a mix.
+  with lock:
+    if not connection or not dirty_keys:
+      return
+    with connection:
+      for key in dirty_keys:
+        if values.get(key) is None:
+          values.pop(key, None)
+          connection.execute('DELETE FROM state WHERE key = ?', (key,))
+        else:
+          connection.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                             (key, json.dumps(values[key])))
+    dirty_keys.clear()
+
+
+def close():
+  global path, connection
+  with lock:
+    if connection:
+      checkpoint()
+      connection.close()
+    values.clear()
+    dirty_keys.clear()
+    path, connection = '', None
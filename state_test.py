@@ -0,0 +1,70 @@
+import os
+import shutil
+import sqlite3
+import state
+import tempfile
+import unittest
+
+
+
+class StateTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'test.state')
+
+  def tearDown(self):
+    state.close()
+    shutil.rmtree(self.dir)
+
+  def test_values_survive_reopening(self):
+    state.open_state(self.path)
+    state.put('a', 1)
+    state.put('b', {'c': [1, 2]})
+    state.checkpoint()
+    state.close()
+
+    state.open_state(self.path)
+    self.assertEqual(state.get('a'), 1)
+    self.assertEqual(state.get('b'), {'c': [1, 2]})
+    self.assertEqual(state.get('d', 'default'), 'default')
+
+  def test_values_are_not_written_until_checkpointed(self):
+    state.open_state(self.path)
+    state.put('a', 1)
+
+    connection = sqlite3.connect(self.path)
+    self.assertEqual(connection.execute('SELECT COUNT(*) FROM state').fetchone(), (0,))
+    state.checkpoint()
+    self.assertEqual(connection.execute('SELECT key, value FROM state').fetchall(), [('a', '1')])
+
+  def test_delete(self):
+    state.open_state(self.path)
+    state.put('a', 1)
+    state.checkpoint()
+    state.delete('a')
+    state.checkpoint()
+    state.close()
+
+    state.open_state(self.path)
+    self.assertIsNone(state.get('a'))
+
+  def test_failed_checkpoint_leaves_previous_checkpoint(self):
+    state.open_state(self.path)
+    state.put('a', 1)
+    state.checkpoint()
+
+    state.put('a', 2)
+    state.put('b', object())
+    with self.assertRaises(TypeError):
+      state.checkpoint()
+    state.values.clear()
+    state.dirty_keys.clear()
+    state.close()
+
+    state.open_state(self.path)
+    self.assertEqual(state.get('a'), 1)
+    self.assertIsNone(state.get('b'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,311 @@
+import collections
+import logging
+import mmap
+import os
+import struct
+import threading
+
+# Each poll's positions are appended to a rows file for the current segment period. Once the period
+# is over, the rows are compacted into a columnar track file: an index of cars sorted by ID, then
+# each car's first position followed by columns of zigzag varints. Times are stored as deltas of
+# deltas, which are about 0 for a steady polling period, and coordinates as deltas, so most values
+# take a byte. Queries binary search the index through mmap and only decode one car.
+ROW = struct.Struct('<qqiiB')  # time_ms, car_id, lng_e6, lat_e6, verdict
+HEADER = struct.Struct('<4sqqI')  # magic, min_time_ms, max_time_ms, cars
+INDEX_ENTRY = struct.Struct('<qQI')  # car_id, block offset, rows
+BLOCK_HEADER = struct.Struct('<qii')  # first time_ms, lng_e6, lat_e6
+MAGIC = 'TRK1'
+COORD_SCALE = 1e6
+VERDICTS = ('OK', 'OUT_OF_BOUNDS')
+
+path, segment_period_s, retention_s = '', 3600.0, 30 * 24 * 3600.0
+active_file, active_start_ms, compactor, compaction_time = None, None, None, 0.0
+
+lock = threading.RLock()
+logger = logging.getLogger('monitor.tracks')
+
+
+def open_store(raw_path, raw_segment_period_s, raw_retention_s, now):
+  global path, segment_period_s, retention_s
+  close()
+  with lock:
+    path, segment_period_s, retention_s = raw_path, raw_segment_period_s, raw_retention_s
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    # Rows left by a previous process are compacted, unless they're for the current period, in which
+    # case they're appended to.
+    for start_ms in list_segments('.rows'):
+      if start_ms == segment_start_ms(now):
+        open_rows(start_ms)
+      else:
+        compact(start_ms)
+    expire(now)
+
+
+def append(positions, now):
+  # Writes a poll's (time, car_id, coords, verdict) positions with a single write.
+  with lock:
+    if not path:
+      return
+    start_ms = segment_start_ms(now)
+    if active_file and active_start_ms != start_ms:
+      close_rows()
+      start_compaction(now)
+    if not active_file:
+      open_rows(start_ms)
+    active_file.write(''.join(
+        ROW.pack(int(round(time * 1000)), car_id, int(round(coords[0] * COORD_SCALE)),
+                 int(round(coords[1] * COORD_SCALE)), VERDICTS.index(verdict))
+        for time, car_id, coords, verdict in positions))
+    active_file.flush()
+
+
+def query(car_id, start_time=None, end_time=None):
+  # Returns the car's (time, coords, verdict) positions between the times, oldest first.
+  start_ms = int(start_time * 1000) if start_time is not None else -2 ** 63
+  end_ms = int(end_time * 1000) if end_time is not None else 2 ** 63 - 1
+  period_ms = int(segment_period_s * 1000)
+  rows = []
+  with lock:
+    if not path:
+      return []
+    # Rows are filed under the period in which they were written, which may be up to a poll after
+    # they were fetched.
+    for segment_ms in list_segments('.track'):
+      if segment_ms <= end_ms and segment_ms + 2 * period_ms >= start_ms:
+        rows += query_track_file(segment_file(segment_ms, '.track'), car_id, start_ms, end_ms)
+    # Besides the active segment, rows still being compacted are read as they are.
+    for segment_ms in list_segments('.rows'):
+      if segment_ms <= end_ms and segment_ms + 2 * period_ms >= start_ms:
+        rows += query_rows_file(segment_file(segment_ms, '.rows'), car_id, start_ms, end_ms)
+  return [(time_ms / 1000.0, [lng / COORD_SCALE, lat / COORD_SCALE], VERDICTS[verdict])
+          for time_ms, lng, lat, verdict in sorted(rows)]
+
+
+def close():
+  global path
+  wait_for_compaction()
+  with lock:
+    close_rows()
+    path = ''
+
+
+def start_compaction(now):
+  # Finished segments are compacted on a thread of its own, since a large fleet's hour of rows takes
+  # seconds to encode, which would otherwise come out of a poll cycle. Called with the lock held.
+  global compactor, compaction_time
+  compaction_time = now
+  if not compactor:
+    compactor = threading.Thread(target=compact_finished_segments, args=(path,),
+                                 name='tracks-compaction')
+    compactor.daemon = True
+    compactor.start()
+
+
+def compact_finished_segments(compaction_path):
+  global compactor
+  while True:
+    with lock:
+      # Stop once nothing's left, or if the store was closed or reopened in the meantime.
+      finished_start_ms = [start_ms for start_ms in list_segments('.rows')
+                           if start_ms != active_start_ms] if path == compaction_path else []
+      if not finished_start_ms:
+        compactor = None
+        return
+      now = compaction_time
+    try:
+      for start_ms in finished_start_ms:
+        compact(start_ms)
+      expire(now)
+    except Exception:
+      # The rows are still queried as they are, and compacted when the store is next opened.
+      logger.exception('Failed to compact track segments %s.', finished_start_ms)
+      with lock:
+        compactor = None
+      return
+
+
+def wait_for_compaction():
+  # Must be called without the lock held, since compaction takes it to swap its files in.
+  thread = compactor
+  if thread:
+    thread.join()
+
+
+def segment_start_ms(now):
+  period_ms = int(segment_period_s * 1000)
+  now_ms = int(now * 1000)
+  return now_ms - now_ms % period_ms
+
+
+def segment_file(start_ms, extension):
+  return os.path.join(path, '%013d%s' % (start_ms, extension))
+
+
+def list_segments(extension):
+  return sorted(int(file_name[:-len(extension)]) for file_name in os.listdir(path)
+                if file_name.endswith(extension))
+
+
+def open_rows(start_ms):
+  global active_file, active_start_ms
+  active_file = open(segment_file(start_ms, '.rows'), 'ab')
+  # Drop any row that a crash left half written.
+  active_file.truncate(active_file.tell() - active_file.tell() % ROW.size)
+  active_start_ms = start_ms
+
+
+def close_rows():
+  global active_file, active_start_ms
+  if active_file:
+    active_file.close()
+  active_file, active_start_ms = None, None
+
+
+def compact(start_ms):
+  rows_path = segment_file(start_ms, '.rows')
+  with open(rows_path, 'rb') as f:
+    data = f.read()
+  car_rows = collections.defaultdict(list)
+  for offset in xrange(0, len(data) - len(data) % ROW.size, ROW.size):
+    time_ms, car_id, lng, lat, verdict = ROW.unpack_from(data, offset)
+    car_rows[car_id].append((time_ms, lng, lat, verdict))
+  if not car_rows:
+    with lock:
+      os.remove(rows_path)
+    return
+
+  car_ids = sorted(car_rows)
+  for rows in car_rows.itervalues():
+    rows.sort()
+  min_time_ms = min(rows[0][0] for rows in car_rows.itervalues())
+  max_time_ms = max(rows[-1][0] for rows in car_rows.itervalues())
+  index, blocks = bytearray(), bytearray()
+  blocks_offset = HEADER.size + len(car_ids) * INDEX_ENTRY.size
+  for car_id in car_ids:
+    rows = car_rows[car_id]
+    index += INDEX_ENTRY.pack(car_id, blocks_offset + len(blocks), len(rows))
+    times, lngs, lats = [[row[i] for row in rows] for i in xrange(3)]
+    blocks += BLOCK_HEADER.pack(times[0], lngs[0], lats[0])
+    blocks += encode_varints(deltas([0] + deltas(times)))
+    blocks += encode_varints(deltas(lngs))
+    blocks += encode_varints(deltas(lats))
+    blocks += bytearray(row[3] for row in rows)
+
+  # Written aside and renamed into place, so a crash leaves either the rows or the track file. The
+  # swap is locked so that queries never see both or neither.
+  track_path = segment_file(start_ms, '.track')
+  with open(track_path + '.tmp', 'wb') as f:
+    f.write(HEADER.pack(MAGIC, min_time_ms, max_time_ms, len(car_ids)))
+    f.write(index)
+    f.write(blocks)
+    f.flush()
+    os.fsync(f.fileno())
+  with lock:
+    os.rename(track_path + '.tmp', track_path)
+    os.remove(rows_path)
+  logger.info('Compacted %s rows for %s cars from %s bytes to %s.',
+              sum(map(len, car_rows.itervalues())), len(car_ids), len(data),
+              os.path.getsize(track_path))
+
+
+def expire(now):
+  cutoff_ms = int((now - retention_s - segment_period_s) * 1000)
+  with lock:
+    for start_ms in list_segments('.track'):
+      if start_ms < cutoff_ms:
+        os.remove(segment_file(start_ms, '.track'))
+
+
+def query_track_file(track_path, car_id, start_ms, end_ms):
+  with open(track_path, 'rb') as f:
+    track = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    magic, min_time_ms, max_time_ms, cars = HEADER.unpack_from(track, 0)
+    if magic != MAGIC:
+      logger.error('Skipping "%s", which isn\'t a track file.', track_path)
+      return []
+    if max_time_ms < start_ms or min_time_ms > end_ms:
+      return []
+
+    low, high = 0, cars
+    while low < high:
+      middle = (low + high) / 2
+      if INDEX_ENTRY.unpack_from(track, HEADER.size + middle * INDEX_ENTRY.size)[0] < car_id:
+        low = middle + 1
+      else:
+        high = middle
+    if low == cars:
+      return []
+    entry_car_id, offset, count = INDEX_ENTRY.unpack_from(
+        track, HEADER.size + low * INDEX_ENTRY.size)
+    if entry_car_id != car_id:
+      return []
+
+    time_ms, lng, lat = BLOCK_HEADER.unpack_from(track, offset)
+    offset += BLOCK_HEADER.size
+    time_delta_deltas, offset = decode_varints(track, offset, count - 1)
+    lng_deltas, offset = decode_varints(track, offset, count - 1)
+    lat_deltas, offset = decode_varints(track, offset, count - 1)
+    columns = (accumulate(time_ms, accumulate(0, time_delta_deltas)[1:]),
+               accumulate(lng, lng_deltas), accumulate(lat, lat_deltas))
+    verdicts = bytearray(track[offset:offset + count])
+    return [row + (verdict,) for row, verdict in zip(zip(*columns), verdicts)
+            if start_ms <= row[0] <= end_ms]
+  finally:
+    track.close()
+
+
+def query_rows_file(rows_path, car_id, start_ms, end_ms):
+  if not os.path.getsize(rows_path):
+    return []
+  with open(rows_path, 'rb') as f:
+    rows = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    results = []
+    for offset in xrange(0, len(rows) - len(rows) % ROW.size, ROW.size):
+      time_ms, row_car_id, lng, lat, verdict = ROW.unpack_from(rows, offset)
+      if row_car_id == car_id and start_ms <= time_ms <= end_ms:
+        results.append((time_ms, lng, lat, verdict))
+    return results
+  finally:
+    rows.close()
+
+
+def deltas(values):
+  return [value - previous for previous, value in zip(values, values[1:])]
+
+
+def accumulate(first, deltas):
+  values = [first]
+  for delta in deltas:
+    values.append(values[-1] + delta)
+  return values
+
+
+def encode_varints(values):
+  encoded = bytearray()
+  for value in values:
+    # Zigzag, so that small negative values are small too.
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+      encoded.append(value & 0x7f | 0x80)
+      value >>= 7
+    encoded.append(value)
+  return encoded
+
+
+def decode_varints(data, offset, count):
+  # Returns the count values starting at offset and the offset after them.
+  values = []
+  value, shift = 0, 0
+  while len(values) < count:
+    byte = ord(data[offset])
+    offset += 1
+    value |= (byte & 0x7f) << shift
+    if byte & 0x80:
+      shift += 7
+      continue
+    values.append(value / 2 if not value & 1 else -(value + 1) / 2)
+    value, shift = 0, 0
+  return values, offset
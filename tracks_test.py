@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import tracks
+import unittest
+
+
+class TracksTest(unittest.TestCase):
+  def setUp(self):
+    self.path = os.path.join(tempfile.mkdtemp(), 'test.tracks')
+    tracks.open_store(self.path, 3600, 24 * 3600, 0)
+
+  def tearDown(self):
+    tracks.close()
+    shutil.rmtree(os.path.dirname(self.path))
+
+  def append_polls(self, start_time, polls, period_s=300, car_ids=(1, 2, 3)):
+    for poll in xrange(polls):
+      poll_time = start_time + poll * period_s
+      tracks.append([(poll_time + i, car_id, [-122.4 + poll * 0.0001 * car_id, 37.7 - i * 0.001],
+                      'OUT_OF_BOUNDS' if poll % 5 == 0 else 'OK')
+                     for i, car_id in enumerate(car_ids)], poll_time + 60)
+
+  def test_query_active_segment(self):
+    self.append_polls(0, 3)
+
+    self.assertEqual(tracks.query(2), [
+      (1.0, [-122.4, 37.699], 'OUT_OF_BOUNDS'),
+      (301.0, [-122.3998, 37.699], 'OK'),
+      (601.0, [-122.3996, 37.699], 'OK'),
+    ])
+    self.assertEqual(os.listdir(self.path), ['0000000000000.rows'])
+
+  def test_compaction(self):
+    self.append_polls(0, 12, car_ids=range(100))
+    rows_size = os.path.getsize(os.path.join(self.path, '0000000000000.rows'))
+    active_positions = tracks.query(42)
+
+    # The first append of the next period compacts the last in the background, until which its rows
+    # are still queried.
+    self.append_polls(3600, 1, car_ids=range(100))
+    self.assertEqual(len(tracks.query(42)), 13)
+    tracks.wait_for_compaction()
+
+    self.assertEqual(sorted(os.listdir(self.path)), ['0000000000000.track', '0000003600000.rows'])
+    track_size = os.path.getsize(os.path.join(self.path, '0000000000000.track'))
+    self.assertLess(track_size, rows_size / 3)
+    self.assertEqual(tracks.query(42, end_time=3599), active_positions)
+    self.assertEqual(len(tracks.query(42)), 13)
+
+  def test_query_time_range(self):
+    self.append_polls(0, 36)
+
+    positions = tracks.query(3, 3000, 4500)
+
+    self.assertEqual([position[0] for position in positions],
+                     [3002.0, 3302.0, 3602.0, 3902.0, 4202.0])
+
+  def test_query_unknown_car(self):
+    self.append_polls(0, 12)
+    self.append_polls(3600, 1)
+
+    self.assertEqual(tracks.query(0), [])
+    self.assertEqual(tracks.query(4), [])
+    self.assertEqual(tracks.query(2, 100000), [])
+
+  def test_retention(self):
+    self.append_polls(0, 12 * 30)
+    tracks.wait_for_compaction()
+
+    # Segments ending more than a day ago have been deleted.
+    self.assertEqual(len(os.listdir(self.path)), 25)
+    self.assertEqual(tracks.query(1)[0][0], 5 * 3600.0)
+
+    self.append_polls(30 * 3600, 1)
+    tracks.wait_for_compaction()
+
+    self.assertEqual(len(os.listdir(self.path)), 25)
+    self.assertEqual(tracks.query(1)[0][0], 6 * 3600.0)
+
+  def test_reopening(self):
+    self.append_polls(0, 12)
+    self.append_polls(3600, 2)
+    tracks.close()
+    # Simulate a crash part way through writing a row.
+    with open(os.path.join(self.path, '0000003600000.rows'), 'ab') as f:
+      f.write('\x01\x02\x03')
+
+    tracks.open_store(self.path, 3600, 24 * 3600, 4200)
+    self.append_polls(4200, 1)
+
+    self.assertEqual(len(tracks.query(1)), 15)
+    tracks.close()
+    tracks.open_store(self.path, 3600, 24 * 3600, 10000)
+    self.assertEqual(sorted(os.listdir(self.path)), ['0000000000000.track', '0000003600000.track'])
+    self.assertEqual(len(tracks.query(1)), 15)
+
+  def test_closed(self):
+    tracks.close()
+
+    tracks.append([(0, 1, [0, 0], 'OK')], 0)
+
+    self.assertEqual(tracks.query(1), [])
+
+  def test_varints(self):
+    values = [5, 0, -1, 200, -100000, 2 ** 40, -2 ** 40, 63, -64, 64]
+
+    encoded = tracks.encode_varints(values)
+
+    self.assertEqual(tracks.decode_varints(str(encoded) + 'x', 0, len(values)),
+                     (values, len(encoded)))
+    self.assertEqual(len(tracks.encode_varints([63, -64])), 2)
+    self.assertEqual(len(tracks.encode_varints([64])), 2)
+
+if __name__ == '__main__':
+  unittest.main()
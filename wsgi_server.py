@@ -0,0 +1,145 @@
+import logging
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+import werkzeug.serving
+
+# Routes answered without waiting for a worker slot, so that health checks are never queued behind
+# expensive routes such as /logs.
+FAST_PATHS = frozenset(['/ok'])
+
+logger = logging.getLogger('monitor.wsgi_server')
+
+
+class RequestHandler(werkzeug.serving.WSGIRequestHandler):
+  # HTTP/1.1 so that clients can keep connections alive between requests.
+  protocol_version = 'HTTP/1.1'
+
+  # Buffer writes so that the status line, each header and the body don't each cost a send. Werkzeug
+  # flushes after every chunk of the body, so responses still aren't held back.
+  wbufsize = -1
+
+  def setup(self):
+    werkzeug.serving.WSGIRequestHandler.setup(self)
+    # Otherwise a streamed response's later chunks wait on the client's delayed ACK of the first.
+    self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+  def handle_one_request(self):
+    # Idle connections only wait for the keep-alive period, while a request that has started gets
+    # the full request timeout.
+    self.connection.settimeout(self.server.keep_alive_s or self.server.request_timeout_s)
+    self.raw_requestline = self.rfile.readline()
+    if not self.raw_requestline:
+      self.close_connection = 1
+      return
+    self.connection.settimeout(self.server.request_timeout_s)
+    if not self.parse_request():
+      return
+    if not self.server.keep_alive_s or self.server.is_stopping:
+      self.close_connection = 1
+
+    if self.path.split('?', 1)[0] in FAST_PATHS:
+      return self.server.run_request(self)
+    try:
+      self.server.worker_slots.get(timeout=self.server.request_timeout_s)
+    except Queue.Empty:
+      self.close_connection = 1
+      self.send_error(503, 'All workers are busy')
+      return
+    try:
+      return self.server.run_request(self)
+    finally:
+      self.server.worker_slots.put(None)
+
+  def log_request(self, code='-', size='-'):
+    logger.debug('"%s" %s %s', self.requestline, code, size)
+
+  def log(self, type, message, *args):
+    getattr(logger, type)(message, *args)
+
+
+# A WSGI server that handles each connection on its own thread but runs at most `workers` requests
+# through the app at a time, apart from FAST_PATHS. Stopping it stops accepting connections and then
+# lets in-flight requests finish.
+class Server(werkzeug.serving.BaseWSGIServer):
+  def __init__(self, host, port, app, workers=8, request_timeout_s=30.0, keep_alive_s=5.0):
+    werkzeug.serving.BaseWSGIServer.__init__(self, host, port, app, handler=RequestHandler)
+    self.request_timeout_s = request_timeout_s
+    self.keep_alive_s = keep_alive_s
+    self.worker_slots = Queue.Queue()
+    for i in xrange(workers):
+      self.worker_slots.put(None)
+    self.is_stopping = False
+    self.active_requests = 0
+    self.active_requests_condition = threading.Condition()
+
+  def run_request(self, handler):
+    with self.active_requests_condition:
+      self.active_requests += 1
+    try:
+      return handler.run_wsgi()
+    finally:
+      with self.active_requests_condition:
+        self.active_requests -= 1
+        self.active_requests_condition.notify_all()
+
+  def stop(self):
+    # Must not be called from the thread running serve_forever(), since it blocks until it returns.
+    self.is_stopping = True
+    self.shutdown()
+
+  def drain(self, timeout_s):
+    deadline = time.time() + timeout_s
+    with self.active_requests_condition:
+      while self.active_requests and time.time() < deadline:
+        self.active_requests_condition.wait(deadline - time.time())
+      if self.active_requests:
+        logger.warning('Gave up waiting for %s request(s) to finish.', self.active_requests)
+      return not self.active_requests
+
+
+# Each connection holds a thread for as long as it's kept alive, so besides the worker limit on
+# requests, at most `max_connections` are open at a time. Any more are turned away with a 503 rather
+# than each starting another thread.
+class ThreadedServer(SocketServer.ThreadingMixIn, Server):
+  multithread = True
+  daemon_threads = True
+
+  def __init__(self, host, port, app, workers=8, request_timeout_s=30.0, keep_alive_s=5.0,
+               max_connections=64):
+    Server.__init__(self, host, port, app, workers, request_timeout_s, keep_alive_s)
+    self.connection_slots = threading.BoundedSemaphore(max_connections)
+
+  def process_request(self, request, client_address):
+    if not self.connection_slots.acquire(False):
+      logger.warning('Turning away connection from %s, since too many are open.', client_address[0])
+      try:
+        request.sendall('HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n'
+                        'Connection: close\r\n\r\n')
+      except socket.error:
+        pass
+      self.shutdown_request(request)
+      return
+    try:
+      SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+    except:
+      self.connection_slots.release()
+      raise
+
+  def process_request_thread(self, request, client_address):
+    try:
+      SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+    finally:
+      self.connection_slots.release()
+
+
+def make_server(mode, host, port, app, workers=8, request_timeout_s=30.0, keep_alive_s=5.0,
+                max_connections=64):
+  if mode == 'threaded':
+    return ThreadedServer(host, port, app, workers, request_timeout_s, keep_alive_s,
+                          max_connections)
+  # The single-threaded development server can't keep idle connections open without blocking
+  # everyone else.
+  return Server(host, port, app, 1, request_timeout_s, 0)
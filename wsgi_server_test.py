@@ -0,0 +1,103 @@
+import flask
+import httplib
+import threading
+import time
+import unittest
+import wsgi_server
+
+
+
+class WsgiServerTest(unittest.TestCase):
+  def setUp(self):
+    self.release_slow = threading.Event()
+    self.slow_started = threading.Event()
+    app = flask.Flask(__name__)
+
+    @app.route('/ok')
+    def handle_ok():
+      return 'ok'
+
+    @app.route('/slow')
+    def handle_slow():
+      self.slow_started.set()
+      self.release_slow.wait(5)
+      return 'slow'
+
+    self.http_server = wsgi_server.make_server(
+        'threaded', '127.0.0.1', 0, app, workers=1, request_timeout_s=0.5, keep_alive_s=1)
+    self.port = self.http_server.server_address[1]
+    self.serve_thread = threading.Thread(target=self.http_server.serve_forever)
+    self.serve_thread.start()
+    self.slow_threads = []
+
+  def tearDown(self):
+    self.release_slow.set()
+    for thread in self.slow_threads:
+      thread.join()
+    if self.serve_thread.is_alive():
+      self.http_server.stop()
+    self.serve_thread.join()
+
+  def get(self, path, connection=None):
+    connection = connection or httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+  def start_slow_request(self):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(self.get('/slow')))
+    thread.start()
+    self.slow_threads.append(thread)
+    self.assertTrue(self.slow_started.wait(5))
+    return results
+
+  def test_ok_is_not_blocked_by_busy_workers(self):
+    self.start_slow_request()
+
+    start_time = time.time()
+    self.assertEqual(self.get('/ok'), (200, 'ok'))
+    self.assertLess(time.time() - start_time, 0.5)
+
+  def test_requests_time_out_waiting_for_a_worker(self):
+    self.start_slow_request()
+
+    status, body = self.get('/slow')
+    self.assertEqual(status, 503)
+
+  def test_keep_alive(self):
+    connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+    self.assertEqual(self.get('/ok', connection), (200, 'ok'))
+    socket = connection.sock
+    self.assertEqual(self.get('/ok', connection), (200, 'ok'))
+    self.assertIs(connection.sock, socket)
+
+  def test_connections_beyond_the_limit_are_turned_away(self):
+    self.http_server.stop()
+    self.serve_thread.join()
+    self.http_server = wsgi_server.make_server(
+        'threaded', '127.0.0.1', 0, flask.Flask(__name__), keep_alive_s=5, max_connections=1)
+    self.port = self.http_server.server_address[1]
+    self.serve_thread = threading.Thread(target=self.http_server.serve_forever)
+    self.serve_thread.start()
+
+    connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+    self.assertEqual(self.get('/missing', connection)[0], 404)
+    self.assertEqual(self.get('/missing'), (503, ''))
+    connection.close()
+
+  def test_stop_lets_active_requests_finish(self):
+    results = self.start_slow_request()
+
+    self.http_server.stop()
+    self.serve_thread.join()
+    self.assertFalse(self.http_server.drain(0.1))
+
+    self.release_slow.set()
+    self.assertTrue(self.http_server.drain(5))
+    self.slow_threads[0].join()
+    self.assertEqual(results, [(200, 'slow')])
+
+
+if __name__ == '__main__':
+  unittest.main()